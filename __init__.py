@@ -12,10 +12,15 @@ bl_info = {
     "category": "Animation"
 }
 
+import functools
+import time
 import bpy
 from bpy.types import Operator, AddonPreferences
 from bpy.props import StringProperty, IntProperty, BoolProperty
+from . import fan_out
+from . import journal
 from . import mixamo_baker
+from . import parallel
 
 class MixamoBakerPreferences(bpy.types.AddonPreferences):
     # this must match the add-on name, use '__package__'
@@ -45,14 +50,139 @@ class MixamoBakerPreferences(bpy.types.AddonPreferences):
         name="Transfer Rotation",
         description="Whether to transfer roation to root motion. Should be enabled for curve walking animations. Can be disabled for straight animations with strong hip Motion like Rolling",
         default=True)
+    root_smoothing: bpy.props.IntProperty(
+        name="Root Smoothing",
+        description="Number of frames root motion is averaged over, 0 disables smoothing (Single Pass bake only)",
+        default=0,
+        min=0)
+    root_start_at_origin: bpy.props.BoolProperty(
+        name="Start At Origin",
+        description="If enabled, horizontal root motion starts at the origin (Single Pass bake only)",
+        default=False)
     scale: bpy.props.FloatProperty(
         name="Unit Scale",
         description="Unit Scale down the Rig by this factor",
         default=0.01)
+    bake_mode: bpy.props.EnumProperty(
+        name="Bake Mode",
+        description="How destination bones are baked from the source armature",
+        items=(
+            ('SINGLE_PASS', "Single Pass", "Step the timeline once and key all bones in bulk"),
+            ('OPERATOR', "Per Bone", "Run bpy.ops.nla.bake once per bone (slow, reference output)"),
+            ('FK', "Forward Kinematics", "Compute bone transforms from the rest poses without evaluating the scene, falls back to Single Pass"),
+        ),
+        default='SINGLE_PASS')
+    keep_sparse_keys: bpy.props.BoolProperty(
+        name="Keep Sparse Keys",
+        description="If enabled, quaternion cleanup keeps the original key times instead of keying every frame",
+        default=False)
+    workers: bpy.props.IntProperty(
+        name="Workers",
+        description="Number of background Blender processes baking in parallel, 1 bakes inside this session",
+        default=1,
+        min=1)
+    clips_per_pass: bpy.props.IntProperty(
+        name="Clips Per Pass",
+        description="Number of files imported side by side and baked in one timeline sweep, only used by Single Pass baking",
+        default=1,
+        min=1)
+    memory_limit_mb: bpy.props.IntProperty(
+        name="Memory Limit (MB)",
+        description="Memory use above which background workers are restarted and the template is reloaded, 0 disables the limit",
+        default=0,
+        min=0)
+    incremental: bpy.props.BoolProperty(
+        name="Skip Up To Date",
+        description="If enabled, files whose source, template and settings are unchanged since the last bake are skipped",
+        default=False)
+    recursive: bpy.props.BoolProperty(
+        name="Include Subfolders",
+        description="If enabled, files in subfolders of the input path are baked too, into the same subfolders of the output path",
+        default=False)
+    resume: bpy.props.BoolProperty(
+        name="Resume",
+        description="If enabled, the batch recorded in the journal of the output path is continued instead of started over",
+        default=False)
+    duplicate_mode: bpy.props.EnumProperty(
+        name="Duplicates",
+        description="What to do with files whose animation was already baked with the same settings, in this or an earlier batch",
+        items=(
+            ('OFF', "Bake", "Bake every file, even if its animation was baked before"),
+            ('COPY', "Copy", "Copy the outputs of the identical clip instead of baking"),
+            ('LINK', "Link", "Hard link the outputs of the identical clip instead of baking, copy where links are not possible"),
+        ),
+        default='OFF')
+    output_format: bpy.props.EnumProperty(
+        name="Output Format",
+        description="File format baked animations are written in",
+        items=(
+            ('FBX', "FBX", "Export an FBX file per animation"),
+            ('CLIP', "Clip", "Write a compact binary clip with quantized channels per animation"),
+            ('BOTH', "FBX and Clip", "Write both an FBX file and a binary clip per animation"),
+        ),
+        default='FBX')
+    verify: bpy.props.EnumProperty(
+        name="Verify",
+        description="Compare the baked joints to the source in world space after baking",
+        items=(
+            ('OFF', "Off", "Do not verify baked clips"),
+            ('FLAG', "Flag", "Warn about clips above the error limits"),
+            ('FAIL', "Fail", "Fail and do not export clips above the error limits"),
+        ),
+        default='OFF')
+    max_position_error: bpy.props.FloatProperty(
+        name="Max Position Error",
+        description="Largest joint position error in centimeters, relative to the hips, a verified clip may have",
+        default=1.0,
+        min=0.0)
+    max_rotation_error: bpy.props.FloatProperty(
+        name="Max Rotation Error",
+        description="Largest joint rotation error in degrees a verified clip may have",
+        default=2.0,
+        min=0.0)
+    key_reduction: bpy.props.EnumProperty(
+        name="Key Reduction",
+        description="How redundant keyframes are removed before export",
+        items=(
+            ('CLEAN', "Clean", "Remove keys holding the same value as their neighbours"),
+            ('DECIMATE', "Decimate", "Remove keys that linear interpolation reproduces within the tolerances"),
+        ),
+        default='CLEAN')
+    location_tolerance: bpy.props.FloatProperty(
+        name="Location Tolerance",
+        description="Largest location error in centimeters introduced by decimation",
+        default=0.01,
+        min=0.0)
+    rotation_tolerance: bpy.props.FloatProperty(
+        name="Rotation Tolerance",
+        description="Largest rotation error in degrees introduced by decimation",
+        default=0.05,
+        min=0.0)
+    scale_tolerance: bpy.props.FloatProperty(
+        name="Scale Tolerance",
+        description="Largest scale error introduced by decimation",
+        default=0.001,
+        min=0.0)
+    anim_only: bpy.props.BoolProperty(
+        name="Animation Only Import",
+        description="If enabled, only the armature and its action are kept from source files, meshes, materials and images are skipped",
+        default=True)
+    anim_cache_dir: StringProperty(
+        name="Import Cache",
+        description="Directory caching imported source animations, leave empty to always import",
+        subtype='DIR_PATH',
+    )
     sk_path: StringProperty(
         name="Skeleton Template",
+        description="Skeleton template .blend, or a targets .json baking every clip onto several templates in this session",
         subtype='FILE_PATH',
     )
+    retarget_profile: StringProperty(
+        name="Retarget Profile",
+        default="unreal",
+        description="Name of a bundled retarget profile (unreal, unity_humanoid) or path to a profile JSON file",
+        subtype='NONE',
+    )
     sk_cbones: StringProperty(
         name="Constrained Bones",
         default="wrist_r wrist_l",
@@ -68,12 +198,18 @@ class MixamoBakerPreferences(bpy.types.AddonPreferences):
         name="Output Dir",
         subtype='DIR_PATH',
     )
+    rules_file: StringProperty(
+        name="Rules",
+        description="JSON file overriding settings for the files it matches, leave empty to use .mixamo_baker_rules.json of the input dir if there is one",
+        subtype='FILE_PATH',
+    )
 
     def draw(self, context):
         layout = self.layout
         box = layout.box()
         box.row().prop(self, "sk_path")
         box.row().prop(self, "sk_cbones")
+        box.row().prop(self, "retarget_profile")
 
 
 class OBJECT_OT_RenameToMixamo(bpy.types.Operator):
@@ -110,22 +246,124 @@ class OBJECT_OT_RenameToUnreal(bpy.types.Operator):
 class OBJECT_OT_BatchBake(bpy.types.Operator):
     bl_idname = "mixamo_baker.bake"
     bl_label = "Bake Animations"
-    bl_description = "Bake Animation"
+    bl_description = "Bake Animation, press Esc to stop after the current file"
 
-    def execute(self, context):
+    # progress of the running batch, shown by the panel
+    progress = None
+
+    def start_batch(self, context):
         preferences = context.preferences
         addon_prefs = preferences.addons[__name__].preferences
-        numfiles = mixamo_baker.process_batch(addon_prefs.inpath, addon_prefs.outpath, 
-                                              addon_prefs.sk_path, addon_prefs.sk_cbones, addon_prefs.hips_to_root,
-                                              addon_prefs.use_x, addon_prefs.use_y, addon_prefs.use_z, 
-                                              addon_prefs.use_rotation, addon_prefs.on_ground, 
-                                              addon_prefs.scale)
+        # several targets are baked from one import, which only this session does
+        if addon_prefs.workers > 1 and not fan_out.is_targets_file(addon_prefs.sk_path):
+            iter_batch = functools.partial(parallel.iter_batch_parallel, workers=addon_prefs.workers)
+        else:
+            iter_batch = mixamo_baker.iter_batch
+        return iter_batch(addon_prefs.inpath, addon_prefs.outpath, 
+                          addon_prefs.sk_path, addon_prefs.sk_cbones, addon_prefs.hips_to_root,
+                          addon_prefs.use_x, addon_prefs.use_y, addon_prefs.use_z, 
+                          addon_prefs.use_rotation, addon_prefs.on_ground, 
+                          addon_prefs.scale, bake_mode=addon_prefs.bake_mode,
+                          keep_sparse_keys=addon_prefs.keep_sparse_keys,
+                          incremental=addon_prefs.incremental,
+                          recursive=addon_prefs.recursive,
+                          resume=addon_prefs.resume,
+                          duplicate_mode=addon_prefs.duplicate_mode,
+                          clips_per_pass=addon_prefs.clips_per_pass,
+                          output_format=addon_prefs.output_format,
+                          verify=addon_prefs.verify,
+                          max_position_error=addon_prefs.max_position_error,
+                          max_rotation_error=addon_prefs.max_rotation_error,
+                          key_reduction=addon_prefs.key_reduction,
+                          location_tolerance=addon_prefs.location_tolerance,
+                          rotation_tolerance=addon_prefs.rotation_tolerance,
+                          scale_tolerance=addon_prefs.scale_tolerance,
+                          profile=addon_prefs.retarget_profile,
+                          root_smoothing=addon_prefs.root_smoothing,
+                          root_start_at_origin=addon_prefs.root_start_at_origin,
+                          anim_cache_dir=addon_prefs.anim_cache_dir,
+                          anim_only=addon_prefs.anim_only,
+                          rules_file=addon_prefs.rules_file or None,
+                          memory_limit_mb=addon_prefs.memory_limit_mb)
+
+    def finish(self, context, numfiles):
+        outpath = context.preferences.addons[__name__].preferences.outpath
         if numfiles == -1:
-            self.report({'ERROR_INVALID_INPUT'}, 'Error: Not all files could be converted, look in console for more information')
+            summary = journal.read_summary(outpath)
+            self.report({'ERROR_INVALID_INPUT'}, 'Error: %d files converted, %d failed, see %s for the errors'
+                        % (summary.get("done", 0), summary.get("failed", 0), journal.journal_name))
             return{ 'CANCELLED'}
         self.report({'INFO'}, "%d files converted" % numfiles)
         return{ 'FINISHED'}
 
+    def execute(self, context):
+        # blocking, for scripts and the operator search
+        return self.finish(context, mixamo_baker.run_batch(self.start_batch(context)))
+
+    def invoke(self, context, event):
+        if OBJECT_OT_BatchBake.progress is not None:
+            self.report({'WARNING'}, "A batch is already running")
+            return{ 'CANCELLED'}
+        self._batch = self.start_batch(context)
+        self._start = time.perf_counter()
+        OBJECT_OT_BatchBake.progress = {"done": 0, "total": 0, "file": None, "stage": "starting", "eta": None}
+        window_manager = context.window_manager
+        self._timer = window_manager.event_timer_add(0.1, window=context.window)
+        window_manager.modal_handler_add(self)
+        return{ 'RUNNING_MODAL'}
+
+    def stop(self, context):
+        context.window_manager.event_timer_remove(self._timer)
+        OBJECT_OT_BatchBake.progress = None
+        redraw_panels(context)
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # ticks bake whole files, so the current file is already done
+            self._batch.close()
+            self.stop(context)
+            summary = journal.read_summary(context.preferences.addons[__name__].preferences.outpath)
+            self.report({'WARNING'}, "Cancelled after %d files, enable Resume to continue" % summary.get("done", 0))
+            return{ 'CANCELLED'}
+        if event.type != 'TIMER':
+            return{ 'PASS_THROUGH'}
+
+        # one tick bakes one file
+        try:
+            progress = next(self._batch)
+        except StopIteration as end:
+            self.stop(context)
+            return self.finish(context, end.value)
+        except Exception as error:
+            self.stop(context)
+            self.report({'ERROR'}, "Error: %s, look in console for more information" % error)
+            raise
+        elapsed = time.perf_counter() - self._start
+        done = progress["done"]
+        progress["eta"] = elapsed / done * (progress["total"] - done) if done else None
+        OBJECT_OT_BatchBake.progress = progress
+        redraw_panels(context)
+        return{ 'PASS_THROUGH'}
+
+
+def redraw_panels(context):
+    for area in context.screen.areas:
+        if area.type == 'VIEW_3D':
+            area.tag_redraw()
+
+
+def draw_progress(layout, progress):
+    box = layout.box()
+    box.label(text="Baked %d of %d files" % (progress["done"], progress["total"]))
+    if progress["eta"] is not None:
+        minutes, seconds = divmod(int(progress["eta"]), 60)
+        box.label(text="Time left: %d:%02d" % (minutes, seconds))
+    if progress["file"]:
+        box.label(text="%s: %s" % (progress["stage"].capitalize(), progress["file"]))
+    else:
+        box.label(text=progress["stage"].capitalize())
+    box.label(text="Press Esc to stop after the current file", icon='CANCEL')
+
 
 class MIXAMOBAKER_VIEW_3D_PT_panel(bpy.types.Panel):
     bl_label = "Mixamo Animation Baker"
@@ -143,9 +381,13 @@ class MIXAMOBAKER_VIEW_3D_PT_panel(bpy.types.Panel):
         # Options for how to do the conversion
         box.row().prop(addon_prefs, "sk_path")
         box.row().prop(addon_prefs, "sk_cbones")
+        box.row().prop(addon_prefs, "retarget_profile")
         box.row().prop(addon_prefs, "hips_to_root")
         box.row().prop(addon_prefs, "inpath")
         box.row().prop(addon_prefs, "outpath")
+        box.row().prop(addon_prefs, "rules_file")
+        box.row().prop(addon_prefs, "anim_cache_dir")
+        box.row().prop(addon_prefs, "anim_only")
         box.row().operator("mixamo_baker.rename_to_mixamo")
         box.row().operator("mixamo_baker.rename_to_unreal")
 
@@ -160,10 +402,39 @@ class MIXAMOBAKER_VIEW_3D_PT_panel(bpy.types.Panel):
         row = box.row()
         if addon_prefs.use_z:
             col.prop(addon_prefs, "on_ground", toggle =True)
+        col.prop(addon_prefs, "root_smoothing")
+        col.prop(addon_prefs, "root_start_at_origin", toggle =True)
         row = box.row()
         col.prop(addon_prefs, "scale")
+        box.row().prop(addon_prefs, "bake_mode")
+        box.row().prop(addon_prefs, "keep_sparse_keys")
+        box.row().prop(addon_prefs, "workers")
+        if addon_prefs.bake_mode == 'SINGLE_PASS':
+            box.row().prop(addon_prefs, "clips_per_pass")
+        box.row().prop(addon_prefs, "memory_limit_mb")
+        box.row().prop(addon_prefs, "incremental")
+        box.row().prop(addon_prefs, "recursive")
+        box.row().prop(addon_prefs, "resume")
+        box.row().prop(addon_prefs, "duplicate_mode")
+        box.row().prop(addon_prefs, "output_format")
+        box.row().prop(addon_prefs, "verify")
+        if addon_prefs.verify != 'OFF':
+            col = box.column(align =True)
+            col.prop(addon_prefs, "max_position_error")
+            col.prop(addon_prefs, "max_rotation_error")
+        box.row().prop(addon_prefs, "key_reduction")
+        if addon_prefs.key_reduction == 'DECIMATE':
+            col = box.column(align =True)
+            col.prop(addon_prefs, "location_tolerance")
+            col.prop(addon_prefs, "rotation_tolerance")
+            col.prop(addon_prefs, "scale_tolerance")
 
-        box.row().operator("mixamo_baker.bake")
+        progress = OBJECT_OT_BatchBake.progress
+        row = box.row()
+        row.enabled = progress is None
+        row.operator("mixamo_baker.bake")
+        if progress is not None:
+            draw_progress(layout, progress)
 
 classes = (
     OBJECT_OT_RenameToUnreal,
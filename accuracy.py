@@ -0,0 +1,78 @@
+"""Retarget accuracy of baked clips, measured on world space joint transforms.
+
+Works on plain NumPy arrays so it can be used and tested outside Blender.
+The baker makes every paired destination bone follow its source bone in
+world space, so after baking both should agree on every frame. Positions are
+compared relative to the hips of each armature, which leaves out the root
+motion options (axes moved to the root, on ground offset) that shift the
+whole skeleton on purpose. Rotations are compared in world space.
+"""
+
+import numpy as np
+
+
+class AccuracyError(Exception):
+    pass
+
+
+def rotation_part(matrices):
+    """returns the 3x3 rotations of (..., 4, 4) matrices with their scale removed"""
+    rotations = matrices[..., :3, :3]
+    return rotations / np.linalg.norm(rotations, axis=-2, keepdims=True)
+
+
+def rotation_angles(a, b):
+    """angle in radians between the rotations of two arrays of (..., 4, 4) matrices"""
+    # trace(Ra^T Rb) = 1 + 2 cos(angle)
+    trace = np.einsum("...ij,...ij->...", rotation_part(a), rotation_part(b))
+    return np.arccos(np.clip((trace - 1.0) * 0.5, -1.0, 1.0))
+
+
+def joint_errors(src_world, dst_world, hips=None):
+    """returns the (frames, bones) position and rotation errors of two samplings
+
+    src_world and dst_world are (frames, bones, 4, 4) world matrices of the
+    same bones in the same order, hips the index of the hips among them.
+    Positions are in the units of the matrices, rotations in radians.
+    """
+    src_positions = src_world[..., :3, 3]
+    dst_positions = dst_world[..., :3, 3]
+    if hips is not None:
+        src_positions = src_positions - src_positions[:, hips : hips + 1]
+        dst_positions = dst_positions - dst_positions[:, hips : hips + 1]
+    position = np.linalg.norm(src_positions - dst_positions, axis=-1)
+    rotation = rotation_angles(src_world, dst_world)
+    return position, rotation
+
+
+def summarize(names, position, rotation):
+    """returns the largest errors per bone name and the worst bone and frame index of each
+
+    Without bones or frames the errors are 0 and the worst bones and frames
+    None.
+    """
+    if position.size == 0:
+        return {
+            "bones": {},
+            "position": 0.0,
+            "position_bone": None,
+            "position_frame": None,
+            "rotation": 0.0,
+            "rotation_bone": None,
+            "rotation_frame": None,
+        }
+    bones = {
+        name: {"position": float(p), "rotation": float(r)}
+        for name, p, r in zip(names, position.max(axis=0), rotation.max(axis=0))
+    }
+    worst_position = np.unravel_index(np.argmax(position), position.shape)
+    worst_rotation = np.unravel_index(np.argmax(rotation), rotation.shape)
+    return {
+        "bones": bones,
+        "position": float(position[worst_position]),
+        "position_bone": names[worst_position[1]],
+        "position_frame": int(worst_position[0]),
+        "rotation": float(rotation[worst_rotation]),
+        "rotation_bone": names[worst_rotation[1]],
+        "rotation_frame": int(worst_rotation[0]),
+    }
@@ -0,0 +1,180 @@
+"""Cache of imported source armatures as uncompressed .npz files.
+
+Importing FBX/DAE files is often the slowest step of a bake, and it is
+repeated every time only a bake setting changes. After an import the source
+armature is stored under the digest of the source file and of the import
+options, see import_options: its bones (names, parents, rest matrices,
+lengths and flags), the object transform and every fcurve of its action as
+flat keyframe arrays. Later runs rebuild the armature from these arrays
+instead of parsing the file again.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import numpy as np
+import bpy
+
+# bump when the importer settings or the cached layout change
+cache_version = 1
+
+
+def import_options(anim_only=True):
+    """returns what, besides the source file, changes the armature an import creates
+
+    The importer scales the armature and its animation by the scene unit
+    scale, and anim_only changes the importer settings.
+    """
+    return {
+        "scale": bpy.context.scene.unit_settings.scale_length,
+        "anim_only": anim_only,
+        "blender": bpy.app.version_string,
+    }
+
+
+def cache_path(cache_dir, source_digest, options):
+    """returns the cache file of a source file imported with import_options options"""
+    options_digest = hashlib.sha1(
+        json.dumps(options, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    return Path(cache_dir).joinpath(
+        "%s.%s.v%d.npz" % (source_digest, options_digest, cache_version)
+    )
+
+
+def _foreach_get(collection, attr, count, width, dtype=np.float32):
+    values = np.empty(count * width, dtype=dtype)
+    collection.foreach_get(attr, values)
+    return values.reshape(count, width) if width > 1 else values
+
+
+def save_armature(path, armature):
+    """writes the bones, transform and action of an armature object to path"""
+    bones = armature.data.bones
+    names = [bone.name for bone in bones]
+    index = {name: i for i, name in enumerate(names)}
+
+    arrays = {
+        "object_name": np.array(armature.name),
+        "matrix_world": np.array(armature.matrix_world, dtype=np.float64),
+        "bone_names": np.array(names),
+        "bone_parents": np.array(
+            [index[bone.parent.name] if bone.parent else -1 for bone in bones],
+            dtype=np.int32,
+        ),
+        "bone_matrices": np.array(
+            [bone.matrix_local for bone in bones], dtype=np.float64
+        ),
+        "bone_lengths": np.array([bone.length for bone in bones], dtype=np.float64),
+        "bone_connect": np.array([bone.use_connect for bone in bones], dtype=bool),
+        "bone_deform": np.array([bone.use_deform for bone in bones], dtype=bool),
+        "rotation_modes": np.array(
+            [armature.pose.bones[name].rotation_mode for name in names]
+        ),
+    }
+
+    action = armature.animation_data.action if armature.animation_data else None
+    fcurves = list(action.fcurves) if action else []
+    counts = [len(fc.keyframe_points) for fc in fcurves]
+    arrays["action_name"] = np.array(action.name if action else "")
+    arrays["fcurve_paths"] = np.array([fc.data_path for fc in fcurves])
+    arrays["fcurve_indices"] = np.array(
+        [fc.array_index for fc in fcurves], dtype=np.int32
+    )
+    arrays["fcurve_groups"] = np.array(
+        [fc.group.name if fc.group else "" for fc in fcurves]
+    )
+    arrays["fcurve_counts"] = np.array(counts, dtype=np.int64)
+    for attr, width, dtype in (
+        ("co", 2, np.float32),
+        ("handle_left", 2, np.float32),
+        ("handle_right", 2, np.float32),
+        ("interpolation", 1, np.int32),
+        ("handle_left_type", 1, np.int32),
+        ("handle_right_type", 1, np.int32),
+    ):
+        arrays["key_" + attr] = np.concatenate(
+            [np.empty((0, width) if width > 1 else 0, dtype=dtype)]
+            + [
+                _foreach_get(fc.keyframe_points, attr, count, width, dtype)
+                for fc, count in zip(fcurves, counts)
+            ]
+        )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    tmp.replace(path)
+
+
+def load_armature(path, collection=None):
+    """rebuilds a cached armature object, links it to the scene and selects it"""
+    # closing the archive releases its file handle on every platform
+    with np.load(path) as cached:
+        collection = collection or bpy.context.scene.collection
+
+        name = str(cached["object_name"])
+        data = bpy.data.armatures.new(name)
+        armature = bpy.data.objects.new(name, data)
+        collection.objects.link(armature)
+        armature.matrix_world = cached["matrix_world"].tolist()
+
+        bpy.context.view_layer.objects.active = armature
+        bpy.ops.object.mode_set(mode="EDIT")
+        names = cached["bone_names"].tolist()
+        edit_bones = [data.edit_bones.new(bone) for bone in names]
+        for edit_bone, matrix, length, parent, connect, deform in zip(
+            edit_bones,
+            cached["bone_matrices"],
+            cached["bone_lengths"],
+            cached["bone_parents"],
+            cached["bone_connect"],
+            cached["bone_deform"],
+        ):
+            edit_bone.tail = (0.0, float(length), 0.0)
+            edit_bone.matrix = matrix.tolist()
+            if parent >= 0:
+                edit_bone.parent = edit_bones[parent]
+                edit_bone.use_connect = bool(connect)
+            edit_bone.use_deform = bool(deform)
+        bpy.ops.object.mode_set(mode="OBJECT")
+
+        for name, mode in zip(names, cached["rotation_modes"].tolist()):
+            armature.pose.bones[name].rotation_mode = mode
+
+        action_name = str(cached["action_name"])
+        if action_name:
+            armature.animation_data_create()
+            action = bpy.data.actions.new(action_name)
+            armature.animation_data.action = action
+            offsets = np.concatenate(([0], np.cumsum(cached["fcurve_counts"])))
+            keys = {
+                attr: cached["key_" + attr]
+                for attr in (
+                    "co",
+                    "handle_left",
+                    "handle_right",
+                    "interpolation",
+                    "handle_left_type",
+                    "handle_right_type",
+                )
+            }
+            for i, (data_path, index, group) in enumerate(
+                zip(
+                    cached["fcurve_paths"].tolist(),
+                    cached["fcurve_indices"].tolist(),
+                    cached["fcurve_groups"].tolist(),
+                )
+            ):
+                fc = action.fcurves.new(data_path, index=index, action_group=group)
+                start, end = offsets[i], offsets[i + 1]
+                fc.keyframe_points.add(int(end - start))
+                for attr, values in keys.items():
+                    fc.keyframe_points.foreach_set(attr, values[start:end].ravel())
+                fc.update()
+
+    bpy.ops.object.select_all(action="DESELECT")
+    armature.select_set(True)
+    return armature
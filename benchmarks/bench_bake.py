@@ -0,0 +1,362 @@
+"""Reproducible bake benchmarks on synthetic Mixamo style rigs.
+
+Generates Mixamo named armatures (with the mixamorig: namespace) and
+procedural actions, so no Mixamo downloads are needed, then times the bake
+stages and a full process_batch run. Run under Blender:
+
+    blender -b --factory-startup --python benchmarks/bench_bake.py -- \
+        --frames 60 600 10000 --out bench.json
+
+Results are written as JSON, one entry per case with the elapsed time,
+throughput and memory, so runs can be compared in CI.
+"""
+
+from pathlib import Path
+import argparse
+import importlib
+import json
+import sys
+import tempfile
+import time
+import numpy as np
+import bpy
+
+fingers = ("Thumb", "Index", "Middle", "Ring", "Pinky")
+
+
+def mixamo_bones(extra=0):
+    """returns (name, parent, head, tail) of a Mixamo skeleton, extra bones are
+    chained above the head"""
+    bones = []
+
+    def add(name, parent, head, direction, length):
+        tail = tuple(h + d * length for h, d in zip(head, direction))
+        bones.append((name, parent, head, tail))
+        return tail
+
+    tail = add("Hips", None, (0.0, 0.0, 1.0), (0, 0, 1), 0.1)
+    for name, parent in (
+        ("Spine", "Hips"),
+        ("Spine1", "Spine"),
+        ("Spine2", "Spine1"),
+        ("Neck", "Spine2"),
+        ("Head", "Neck"),
+    ):
+        tail = add(name, parent, tail, (0, 0, 1), 0.1)
+    parent = "Head"
+    for i in range(extra):
+        tail = add("Extra%d" % i, parent, tail, (0, 0, 1), 0.02)
+        parent = "Extra%d" % i
+
+    for side, sx in (("Left", 1.0), ("Right", -1.0)):
+        tail = (sx * 0.05, 0.0, 1.45)
+        parent = "Spine2"
+        for name, length in (
+            ("Shoulder", 0.1),
+            ("Arm", 0.25),
+            ("ForeArm", 0.25),
+            ("Hand", 0.08),
+        ):
+            tail = add(side + name, parent, tail, (sx, 0, 0), length)
+            parent = side + name
+        hand = tail
+        for f, finger in enumerate(fingers):
+            tail = (hand[0], hand[1] + 0.02 * (f - 2), hand[2])
+            parent = side + "Hand"
+            for joint in range(1, 4):
+                name = "%sHand%s%d" % (side, finger, joint)
+                tail = add(name, parent, tail, (sx, 0, 0), 0.02)
+                parent = name
+
+        tail = (sx * 0.1, 0.0, 1.0)
+        parent = "Hips"
+        for name, direction, length in (
+            ("UpLeg", (0, 0, -1), 0.45),
+            ("Leg", (0, 0, -1), 0.45),
+            ("Foot", (0, -1, -1), 0.1),
+            ("ToeBase", (0, -1, 0), 0.05),
+        ):
+            tail = add(side + name, parent, tail, direction, length)
+            parent = side + name
+    return bones
+
+
+def build_armature(name, bones, prefix="", rename=None):
+    data = bpy.data.armatures.new(name)
+    obj = bpy.data.objects.new(name, data)
+    bpy.context.scene.collection.objects.link(obj)
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set(mode="EDIT")
+    rename = rename or (lambda bone: prefix + bone)
+    for bone, parent, head, tail in bones:
+        edit_bone = data.edit_bones.new(rename(bone))
+        edit_bone.head = head
+        edit_bone.tail = tail
+        if parent is not None:
+            edit_bone.parent = data.edit_bones[rename(parent)]
+    bpy.ops.object.mode_set(mode="OBJECT")
+    return obj
+
+
+def animate(obj, frames, flip_rate, rng, write_property):
+    """keys a procedural walk-like animation, flipping quaternion signs at random"""
+    obj.animation_data_create()
+    obj.animation_data.action = bpy.data.actions.new(obj.name + "_Action")
+    fcurves = obj.animation_data.action.fcurves
+    t = np.arange(1, frames + 1, dtype=np.float64)
+    for i, pose_bone in enumerate(obj.pose.bones):
+        pose_bone.rotation_mode = "QUATERNION"
+        axis = rng.normal(size=3)
+        axis /= np.linalg.norm(axis)
+        angle = 0.4 * np.sin(t / 15.0 + i)
+        quats = np.concatenate(
+            (np.cos(angle / 2)[:, None], np.sin(angle / 2)[:, None] * axis), axis=1
+        )
+        quats[rng.random(frames) < flip_rate] *= -1.0
+        path = pose_bone.path_from_id()
+        write_property(fcurves, path + ".rotation_quaternion", t, quats, pose_bone.name)
+        if pose_bone.parent is None:
+            locations = np.stack((0.0 * t, 0.02 * t, 0.05 * np.sin(t / 8.0)), axis=1)
+            write_property(fcurves, path + ".location", t, locations, pose_bone.name)
+
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for collection in (bpy.data.actions, bpy.data.armatures, bpy.data.meshes):
+        for datablock in list(collection):
+            collection.remove(datablock)
+
+
+def write_template(path, mixamo_baker, extra):
+    """saves an unreal named template with a root bone above the pelvis"""
+    profile = mixamo_baker.retarget_profiles.load_profile("unreal")
+    bones = [("Root", None, (0.0, 0.0, 0.0), (0.0, 0.1, 0.0))]
+    for bone, parent, head, tail in mixamo_bones(extra):
+        bones.append((bone, parent or "Root", head, tail))
+    obj = build_armature(
+        "Armature", bones, rename=lambda b: profile.to_target.get(b, b)
+    )
+    bpy.data.libraries.write(str(path), {obj})
+    clear_scene()
+
+
+def write_clips(directory, count, frames, flip_rate, rng, mixamo_baker, extra):
+    for i in range(count):
+        obj = build_armature("Armature", mixamo_bones(extra), prefix="mixamorig:")
+        animate(obj, frames, flip_rate, rng, mixamo_baker.write_property)
+        bpy.context.scene.frame_start = 1
+        bpy.context.scene.frame_end = frames
+        bpy.ops.export_scene.fbx(
+            filepath=str(Path(directory).joinpath("clip_%03d.fbx" % i)),
+            add_leaf_bones=False,
+            bake_anim=True,
+        )
+        clear_scene()
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_stages(mixamo_baker, template_path, frames, flip_rate, rng, bake_mode, extra):
+    """times the individual stages on an in-memory rig, without FBX import/export"""
+    instrumentation = mixamo_baker.instrumentation
+    template = mixamo_baker.SkeletonTemplate(str(template_path))
+    dst = template.instance()
+    src = build_armature("Source", mixamo_bones(extra), prefix="mixamorig:")
+    animate(src, frames, flip_rate, rng, mixamo_baker.write_property)
+    bone_count = len(src.data.bones)
+
+    results = []
+
+    def record(stage, seconds):
+        results.append(
+            {
+                "case": "stage",
+                "stage": stage,
+                "bake_mode": bake_mode,
+                "bones": bone_count,
+                "frames": frames,
+                "seconds": seconds,
+                "frames_per_sec": frames / seconds if seconds else None,
+                "peak_rss_mb": instrumentation.peak_rss() / (1 << 20),
+            }
+        )
+
+    record("rename", timed(mixamo_baker.rename_to_unreal, src))
+    record("quaternion_cleanup", timed(mixamo_baker.quaternion_cleanup, src))
+    record(
+        "bake_bones",
+        timed(
+            mixamo_baker.bake_bones,
+            src,
+            dst,
+            "bench",
+            "",
+            True,
+            True,
+            True,
+            True,
+            True,
+            True,
+            bake_mode,
+        ),
+    )
+    action = dst.animation_data.action.copy()
+    record("clear_keyframes", timed(mixamo_baker.clear_keyframes, dst))
+    dst.animation_data.action = action
+    record("reduce_keyframes", timed(mixamo_baker.reduce_keyframes, dst))
+
+    template.free()
+    clear_scene()
+    return results
+
+
+def bench_batch(
+    mixamo_baker,
+    template_path,
+    clips,
+    frames,
+    flip_rate,
+    rng,
+    bake_mode,
+    extra,
+    clips_per_pass=1,
+):
+    """times process_batch over generated FBX clips"""
+    with tempfile.TemporaryDirectory() as src_dir, tempfile.TemporaryDirectory() as dst_dir:
+        write_clips(src_dir, clips, frames, flip_rate, rng, mixamo_baker, extra)
+        rss_before = mixamo_baker.instrumentation.current_rss()
+        seconds = timed(
+            mixamo_baker.process_batch,
+            src_dir,
+            dst_dir,
+            str(template_path),
+            "",
+            True,
+            True,
+            True,
+            True,
+            True,
+            True,
+            0.01,
+            bake_mode=bake_mode,
+            clips_per_pass=clips_per_pass,
+        )
+        clear_scene()
+        return {
+            "case": "batch",
+            "bake_mode": bake_mode,
+            "bones": len(mixamo_bones(extra)),
+            "frames": frames,
+            "clips": clips,
+            "clips_per_pass": clips_per_pass,
+            "seconds": seconds,
+            "clips_per_min": clips * 60.0 / seconds,
+            "frames_per_sec": clips * frames / seconds,
+            "rss_growth_mb": (mixamo_baker.instrumentation.current_rss() - rss_before)
+            / (1 << 20),
+            "peak_rss_mb": mixamo_baker.instrumentation.peak_rss() / (1 << 20),
+        }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="bench_bake")
+    parser.add_argument("--frames", type=int, nargs="+", default=[60, 600, 10000])
+    parser.add_argument(
+        "--extra-bones", type=int, default=0, help="bones added to the 52 Mixamo bones"
+    )
+    parser.add_argument("--clips", type=int, default=5, help="clips per batch case")
+    parser.add_argument(
+        "--flip-rate", type=float, default=0.05, help="share of keys with flipped sign"
+    )
+    parser.add_argument(
+        "--bake-mode",
+        choices=("SINGLE_PASS", "OPERATOR", "FK"),
+        nargs="+",
+        default=["SINGLE_PASS"],
+    )
+    parser.add_argument(
+        "--clips-per-pass",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="files baked together in one timeline sweep, one batch case each",
+    )
+    parser.add_argument("--no-batch", dest="batch", action="store_false")
+    parser.add_argument("--no-stages", dest="stages", action="store_false")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_output.json")
+    args = parser.parse_args(argv)
+    if not args.batch and not args.stages:
+        parser.error("--no-batch and --no-stages leave nothing to benchmark")
+    return args
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    args = parse_args(argv)
+
+    package_dir = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(package_dir.parent))
+    mixamo_baker = importlib.import_module(package_dir.name + ".mixamo_baker")
+
+    rng = np.random.default_rng(args.seed)
+    clear_scene()
+    mixamo_baker.setup_scene(0.01)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        template_path = Path(tmp).joinpath("template.blend")
+        write_template(template_path, mixamo_baker, args.extra_bones)
+        for bake_mode in args.bake_mode:
+            for frames in args.frames:
+                added = len(results)
+                if args.stages:
+                    results.extend(
+                        bench_stages(
+                            mixamo_baker,
+                            template_path,
+                            frames,
+                            args.flip_rate,
+                            rng,
+                            bake_mode,
+                            args.extra_bones,
+                        )
+                    )
+                for clips_per_pass in args.clips_per_pass if args.batch else []:
+                    results.append(
+                        bench_batch(
+                            mixamo_baker,
+                            template_path,
+                            args.clips,
+                            frames,
+                            args.flip_rate,
+                            rng,
+                            bake_mode,
+                            args.extra_bones,
+                            clips_per_pass,
+                        )
+                    )
+                for result in results[added:]:
+                    print(json.dumps(result))
+
+    Path(args.out).write_text(
+        json.dumps(
+            {
+                "blender": bpy.app.version_string,
+                "seed": args.seed,
+                "flip_rate": args.flip_rate,
+                "results": results,
+            },
+            indent=1,
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""Command line entry point for baking without the Blender UI.
+
+Run the script directly from the add-on directory:
+
+    blender -b --factory-startup --python path/to/mixamo_baker/cli.py -- \
+        --in ~/mixamo --out ~/baked --template ~/skeleton.blend
+
+or, with the add-on installed, through its module:
+
+    blender -b --python-expr "import mixamo_baker.cli as cli; cli.main()" -- \
+        --in ~/mixamo --out ~/baked --template ~/skeleton.blend
+
+With --watch the session keeps running and bakes files as they arrive in the
+input directory, see watch.py. With --distributed any number of sessions on
+any number of hosts share one batch on a shared file system, see
+distributed.py. Options default to the add-on preference defaults. The exit
+code is 1 when not all files could be converted.
+"""
+
+from pathlib import Path
+import argparse
+import importlib
+import sys
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="mixamo_baker",
+        description="Bake Mixamo animations onto a skeleton template",
+    )
+    parser.add_argument("--in", dest="inpath", required=True, help="input directory")
+    parser.add_argument("--out", dest="outpath", required=True, help="output directory")
+    parser.add_argument(
+        "--template",
+        dest="sk_path",
+        required=True,
+        help="skeleton template .blend, or a targets .json to bake every file onto "
+        "several templates",
+    )
+    parser.add_argument(
+        "--cbones",
+        dest="sk_cbones",
+        default="wrist_r wrist_l",
+        help="space separated bone names which are constrained and not keyframe animated",
+    )
+    parser.add_argument(
+        "--profile",
+        default="unreal",
+        help="bundled retarget profile name or path to a profile JSON file",
+    )
+    parser.add_argument("--no-hips-to-root", dest="hips_to_root", action="store_false")
+    parser.add_argument("--no-x", dest="use_x", action="store_false")
+    parser.add_argument("--no-y", dest="use_y", action="store_false")
+    parser.add_argument("--no-z", dest="use_z", action="store_false")
+    parser.add_argument("--no-rotation", dest="use_rotation", action="store_false")
+    parser.add_argument("--no-on-ground", dest="on_ground", action="store_false")
+    parser.add_argument(
+        "--root-smoothing",
+        type=int,
+        default=0,
+        help="frames root motion is averaged over",
+    )
+    parser.add_argument("--root-start-at-origin", action="store_true")
+    parser.add_argument("--scale", type=float, default=0.01)
+    parser.add_argument(
+        "--bake-mode", choices=("SINGLE_PASS", "OPERATOR", "FK"), default="SINGLE_PASS"
+    )
+    parser.add_argument("--keep-sparse-keys", action="store_true")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--clips-per-pass",
+        type=int,
+        default=1,
+        help="files imported side by side and baked in one timeline sweep",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip files whose source, template and settings are unchanged",
+    )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="bake files in subfolders of inpath too, mirroring them in outpath",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the batch recorded in the journal of outpath",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and bake files as they are added to or changed in inpath",
+    )
+    parser.add_argument(
+        "--settle-time",
+        type=float,
+        default=2.0,
+        help="seconds a watched file must stay unchanged before it is baked",
+    )
+    parser.add_argument(
+        "--rules",
+        dest="rules_file",
+        help="JSON rules overriding settings per file, see rules.py, defaults to .mixamo_baker_rules.json in inpath",
+    )
+    parser.add_argument(
+        "--duplicates",
+        dest="duplicate_mode",
+        choices=("OFF", "COPY", "LINK"),
+        default="OFF",
+        help="copy or hard link the outputs of files whose animation was already baked instead of baking them",
+    )
+    parser.add_argument(
+        "--distributed",
+        action="store_true",
+        help="share the batch with other sessions baking the same directories",
+    )
+    parser.add_argument(
+        "--lease-time",
+        type=float,
+        default=300.0,
+        help="seconds without renewal after which a distributed node counts as dead",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=("FBX", "CLIP", "BOTH"),
+        default="FBX",
+        help="CLIP writes the compact binary clip format of clip_format.py",
+    )
+    parser.add_argument(
+        "--verify",
+        choices=("OFF", "FLAG", "FAIL"),
+        default="OFF",
+        help="compare baked joints to the source and warn about or fail clips above the limits",
+    )
+    parser.add_argument(
+        "--max-position-error", type=float, default=1.0, help="centimeters"
+    )
+    parser.add_argument("--max-rotation-error", type=float, default=2.0, help="degrees")
+    parser.add_argument(
+        "--key-reduction", choices=("CLEAN", "DECIMATE"), default="CLEAN"
+    )
+    parser.add_argument(
+        "--location-tolerance", type=float, default=0.01, help="centimeters"
+    )
+    parser.add_argument(
+        "--rotation-tolerance", type=float, default=0.05, help="degrees"
+    )
+    parser.add_argument("--scale-tolerance", type=float, default=0.001)
+    parser.add_argument(
+        "--anim-cache",
+        dest="anim_cache_dir",
+        help="directory caching imported source animations",
+    )
+    parser.add_argument(
+        "--full-import",
+        dest="anim_only",
+        action="store_false",
+        help="import meshes, materials and images of source files too",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        dest="memory_limit_mb",
+        type=int,
+        default=0,
+        help="restart the Blender session when its memory use grows above this many MB",
+    )
+    parser.add_argument(
+        "--cprofile",
+        dest="cprofile_file",
+        help="name of one input file to bake under cProfile, stats go to the output directory",
+    )
+    args = parser.parse_args(argv)
+    if Path(args.sk_path).suffix == ".json" and (
+        args.watch or args.distributed or args.workers > 1
+    ):
+        parser.error(
+            "a targets file bakes in a single session, without --watch, --distributed or --workers"
+        )
+    return args
+
+
+def main(argv=None):
+    """runs a batch from the arguments after '--' and returns the exit code"""
+    from . import mixamo_baker
+    from . import distributed
+    from . import fan_out
+    from . import parallel
+    from . import watch
+
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    args = parse_args(argv)
+    Path(args.outpath).mkdir(parents=True, exist_ok=True)
+
+    options = dict(
+        bake_mode=args.bake_mode,
+        keep_sparse_keys=args.keep_sparse_keys,
+        incremental=args.incremental,
+        recursive=args.recursive,
+        resume=args.resume,
+        clips_per_pass=args.clips_per_pass,
+        cprofile_file=args.cprofile_file,
+        memory_limit_mb=args.memory_limit_mb,
+        output_format=args.output_format,
+        verify=args.verify,
+        max_position_error=args.max_position_error,
+        max_rotation_error=args.max_rotation_error,
+        key_reduction=args.key_reduction,
+        location_tolerance=args.location_tolerance,
+        rotation_tolerance=args.rotation_tolerance,
+        scale_tolerance=args.scale_tolerance,
+        profile=args.profile,
+        root_smoothing=args.root_smoothing,
+        root_start_at_origin=args.root_start_at_origin,
+        anim_cache_dir=args.anim_cache_dir,
+        rules_file=args.rules_file,
+        duplicate_mode=args.duplicate_mode,
+        anim_only=args.anim_only,
+    )
+    if args.watch:
+        # the watcher always skips up to date files and has no batch to resume
+        process_batch = watch.watch_batch
+        del options["incremental"], options["resume"], options["clips_per_pass"]
+        options["settle_time"] = args.settle_time
+    elif args.distributed:
+        # the shared queue is resumable on its own and leases single files,
+        # nodes would race for the duplicate index
+        process_batch = distributed.distributed_batch
+        del options["resume"], options["clips_per_pass"], options["duplicate_mode"]
+        options["lease_time"] = args.lease_time
+    elif args.workers > 1 or (
+        args.memory_limit_mb and not fan_out.is_targets_file(args.sk_path)
+    ):
+        # only background workers can be restarted when they use too much memory,
+        # a batch of several targets reloads its templates instead
+        process_batch = parallel.process_batch_parallel
+        options["workers"] = args.workers
+    else:
+        process_batch = mixamo_baker.process_batch
+
+    numfiles = process_batch(
+        args.inpath,
+        args.outpath,
+        args.sk_path,
+        args.sk_cbones,
+        args.hips_to_root,
+        args.use_x,
+        args.use_y,
+        args.use_z,
+        args.use_rotation,
+        args.on_ground,
+        args.scale,
+        **options
+    )
+    if numfiles == -1:
+        print("Error: Not all files could be converted")
+        return 1
+    print("%d files converted" % numfiles)
+    return 0
+
+
+if __name__ == "__main__":
+    # run as a script, import the package so relative imports resolve
+    package_dir = Path(__file__).resolve().parent
+    sys.path.insert(0, str(package_dir.parent))
+    cli = importlib.import_module(package_dir.name + ".cli")
+    sys.exit(cli.main())
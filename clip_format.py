@@ -0,0 +1,258 @@
+"""Compact binary clip format for loading baked animations at runtime.
+
+Works on plain NumPy arrays so it can be used and tested outside Blender.
+All values are little endian and every array is 8 byte aligned, so a loader
+can memory map the file and point straight into it. The layout is
+
+    header       32 bytes, see header_format
+    bone table   bone_count entries of (name offset, name size) into the names
+    track table  track_count entries, see track_format
+    names        utf-8 bone names
+    track data   one array per track
+
+A track holds one property of one bone over all frames. Constant tracks are
+stored as a single float32 value and dropped altogether when they hold the
+rest value (identity rotation, zero location, unit scale). Animated rotations
+are stored as smallest-three quaternions in 48 bits per frame, animated
+locations and scales as 16 bit values quantized to the range of the track.
+Values are the pose channels of each bone, relative to its rest pose in
+Blender's bone space, with locations in meters.
+"""
+
+from pathlib import Path
+import struct
+import numpy as np
+from . import keyframe_reducer
+
+magic = b"MXCL"
+version = 1
+# magic, version, reserved, fps, frame count, bone count, track count,
+# names offset, names size
+header_format = struct.Struct("<4sHHfIIIII")
+bone_format = struct.Struct("<II")
+# bone index, kind, encoding, data offset, data size, reserved, range minimum
+# and range extent of quantized tracks
+track_format = struct.Struct("<HBBIII3f3f")
+
+kinds = ("rotation", "location", "scale")
+rest_values = {
+    "rotation": (1.0, 0.0, 0.0, 0.0),
+    "location": (0.0, 0.0, 0.0),
+    "scale": (1.0, 1.0, 1.0),
+}
+CONSTANT = 0
+SMALLEST_THREE = 1
+RANGE_U16 = 2
+
+# smallest-three components lie within +-1/sqrt(2), stored in 15 bits each
+component_bits = 15
+component_max = (1 << component_bits) - 1
+component_range = np.sqrt(0.5)
+
+
+def align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def encode_smallest_three(quats):
+    """packs (n, 4) wxyz unit quaternions into (n, 6) bytes
+
+    The largest component is dropped and its index stored in the top two
+    bits, the sign is folded into the other three since q and -q are the
+    same rotation.
+    """
+    quats = np.asarray(quats, dtype=np.float64)
+    quats = quats / np.linalg.norm(quats, axis=1)[:, None]
+    largest = np.argmax(np.abs(quats), axis=1)
+    rows = np.arange(len(quats))
+    quats = quats * np.where(quats[rows, largest] < 0.0, -1.0, 1.0)[:, None]
+    others = np.array([[j for j in range(4) if j != i] for i in range(4)])[largest]
+    small = quats[rows[:, None], others]
+    scaled = (small + component_range) / (2.0 * component_range) * component_max
+    q = np.clip(np.rint(scaled), 0, component_max).astype(np.uint64)
+    packed = largest.astype(np.uint64) << np.uint64(3 * component_bits)
+    for c in range(3):
+        packed |= q[:, c] << np.uint64((2 - c) * component_bits)
+    return packed.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6].copy()
+
+
+def decode_smallest_three(data):
+    """unpacks (n, 6) bytes written by encode_smallest_three into (n, 4) quaternions"""
+    data = np.asarray(data, dtype=np.uint8).reshape(-1, 6)
+    padded = np.zeros((len(data), 8), dtype=np.uint8)
+    padded[:, :6] = data
+    packed = padded.view("<u8")[:, 0]
+    largest = (packed >> np.uint64(3 * component_bits)).astype(np.intp)
+    small = np.empty((len(data), 3))
+    for c in range(3):
+        q = (packed >> np.uint64((2 - c) * component_bits)) & np.uint64(component_max)
+        small[:, c] = q / component_max * 2.0 * component_range - component_range
+    quats = np.empty((len(data), 4))
+    rows = np.arange(len(data))
+    others = np.array([[j for j in range(4) if j != i] for i in range(4)])[largest]
+    quats[rows[:, None], others] = small
+    quats[rows, largest] = np.sqrt(
+        np.clip(1.0 - np.einsum("ij,ij->i", small, small), 0.0, 1.0)
+    )
+    return quats
+
+
+def quantize_range(values):
+    """returns (n, 3) values as uint16 steps of their range, with the range minimum and extent"""
+    values = np.asarray(values, dtype=np.float64)
+    minimum = values.min(axis=0)
+    extent = values.max(axis=0) - minimum
+    steps = np.divide(
+        values - minimum,
+        extent,
+        out=np.zeros_like(values),
+        where=extent > 0.0,
+    )
+    return np.rint(steps * 65535.0).astype("<u2"), minimum, extent
+
+
+def dequantize_range(steps, minimum, extent):
+    return np.asarray(minimum) + steps.astype(np.float64) / 65535.0 * np.asarray(extent)
+
+
+def encode_track(kind, values, constant):
+    """returns (encoding, data bytes, minimum, extent) of one track"""
+    if constant:
+        return (
+            CONSTANT,
+            np.asarray(values[0], dtype="<f4").tobytes(),
+            (0.0,) * 3,
+            (0.0,) * 3,
+        )
+    if kind == "rotation":
+        return (
+            SMALLEST_THREE,
+            encode_smallest_three(values).tobytes(),
+            (0.0,) * 3,
+            (0.0,) * 3,
+        )
+    steps, minimum, extent = quantize_range(values)
+    return RANGE_U16, steps.tobytes(), tuple(minimum), tuple(extent)
+
+
+def write_clip(path, fps, frame_count, bones, tolerances):
+    """writes a clip file and returns its size in bytes
+
+    bones is a list of (name, channels) in skeleton order, where channels maps
+    kinds to (frame_count, 3 or 4) arrays, rotations as wxyz quaternions.
+    tolerances maps kinds to the largest deviation, in radians for rotations,
+    within which a track counts as constant. Bones without channels are kept
+    so track bone indices match the skeleton.
+    """
+    names = b""
+    bone_table = []
+    tracks = []
+    for index, (name, channels) in enumerate(bones):
+        encoded = name.encode("utf-8")
+        bone_table.append((len(names), len(encoded)))
+        names += encoded
+        for kind in kinds:
+            values = channels.get(kind)
+            if values is None:
+                continue
+            values = np.asarray(values, dtype=np.float64)
+            error = (
+                keyframe_reducer.quaternion_error
+                if kind == "rotation"
+                else keyframe_reducer.linear_error
+            )
+            constant = keyframe_reducer.is_constant(values, tolerances[kind], error)
+            rest = np.array(rest_values[kind])[None]
+            if constant and keyframe_reducer.is_constant(
+                np.concatenate([rest, values[:1]]), tolerances[kind], error
+            ):
+                continue
+            tracks.append(
+                (index, kinds.index(kind)) + encode_track(kind, values, constant)
+            )
+
+    names_offset = (
+        header_format.size
+        + bone_format.size * len(bone_table)
+        + track_format.size * len(tracks)
+    )
+    offset = align(names_offset + len(names))
+    track_table = []
+    for bone, kind, encoding, data, minimum, extent in tracks:
+        track_table.append(
+            track_format.pack(
+                bone, kind, encoding, offset, len(data), 0, *minimum, *extent
+            )
+        )
+        offset = align(offset + len(data))
+
+    with open(path, "wb") as f:
+        f.write(
+            header_format.pack(
+                magic,
+                version,
+                0,
+                fps,
+                frame_count,
+                len(bone_table),
+                len(tracks),
+                names_offset,
+                len(names),
+            )
+        )
+        for entry in bone_table:
+            f.write(bone_format.pack(*entry))
+        for entry in track_table:
+            f.write(entry)
+        f.write(names)
+        for bone, kind, encoding, data, minimum, extent in tracks:
+            f.write(b"\0" * (align(f.tell()) - f.tell()))
+            f.write(data)
+        return f.tell()
+
+
+def read_clip(path):
+    """returns fps, frame count and a dict of bone names to their decoded channels
+
+    Bones without tracks map to empty dicts, missing kinds hold the rest value.
+    """
+    data = np.memmap(Path(path), dtype=np.uint8, mode="r")
+    (
+        file_magic,
+        file_version,
+        _,
+        fps,
+        frame_count,
+        bone_count,
+        track_count,
+        names_offset,
+        names_size,
+    ) = header_format.unpack_from(data, 0)
+    if file_magic != magic or file_version != version:
+        raise ValueError("%s is not a version %d clip file" % (path, version))
+
+    names = bytes(data[names_offset : names_offset + names_size])
+    bones = []
+    for i in range(bone_count):
+        offset, size = bone_format.unpack_from(
+            data, header_format.size + i * bone_format.size
+        )
+        bones.append((names[offset : offset + size].decode("utf-8"), {}))
+
+    tracks_offset = header_format.size + bone_count * bone_format.size
+    for i in range(track_count):
+        bone, kind, encoding, offset, size, _, *ranges = track_format.unpack_from(
+            data, tracks_offset + i * track_format.size
+        )
+        kind = kinds[kind]
+        raw = data[offset : offset + size]
+        if encoding == CONSTANT:
+            values = np.repeat(raw.view("<f4")[None], frame_count, axis=0)
+        elif encoding == SMALLEST_THREE:
+            values = decode_smallest_three(raw.reshape(-1, 6))
+        else:
+            values = dequantize_range(
+                raw.view("<u2").reshape(-1, 3), ranges[:3], ranges[3:]
+            )
+        bones[bone][1][kind] = values
+    return fps, frame_count, dict(bones)
@@ -0,0 +1,524 @@
+"""Distributed batch baking over a work queue on a shared file system.
+
+Any number of headless Blender sessions, on any number of hosts, started with
+--distributed on the same input and output directories share the batch
+between them without a coordinator:
+
+    blender -b --factory-startup --python path/to/mixamo_baker/cli.py -- \
+        --distributed --in /nfs/mixamo --out /nfs/baked --template ~/skeleton.blend
+
+The queue lives in the output directory. A node claims a source file by
+creating its lease file with O_EXCL, which only one node can do, and touches
+the lease every lease_time / 4 seconds while it bakes. A lease that was not
+touched for lease_time seconds, as timed by the node looking at it so clocks
+of different hosts don't matter, belongs to a dead node and is taken over by
+renaming it away first, which again only one node can do. A file whose lease
+was taken over journal.max_attempts times is marked failed instead of
+crashing more nodes. Once baked, the lease is replaced with a done marker
+holding the digests of the source file and of its settings. Later runs skip
+finished files, but bake a file again when either digest changed.
+
+Each node appends its results to a file of its own. The node that finds every
+file finished merges them into distributed_summary.json, the bake report and,
+with incremental, the manifest. Delete the queue folder to start over.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from . import instrumentation
+from . import journal
+from . import manifest
+from . import mixamo_baker
+from . import parallel
+from . import retarget_profiles
+from . import rules
+
+log = logging.getLogger(__name__)
+
+queue_name = ".mixamo_baker_queue"
+summary_name = "distributed_summary.json"
+crashed_error = "nodes crashed while baking this file"
+
+
+def node_name():
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+def lease_name(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def fresh_signature(path):
+    """returns what identifies a version of a lease file
+
+    Opening the file makes NFS clients revalidate its attributes instead of
+    answering from their attribute cache.
+    """
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def write_atomic(path, data):
+    tmp = path.with_name(path.name + "." + node_name() + ".tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+class Lease:
+    """the claim of this node on one source file"""
+
+    def __init__(self, path, key, attempts, content, source=None, settings=None):
+        self.path = path
+        self.key = key
+        self.attempts = attempts
+        self.content = content
+        # digests of the source file this lease bakes and of its settings
+        self.source = source
+        self.settings = settings
+        self.lost = False
+
+    def held(self):
+        """whether the lease file is still the one this node created"""
+        try:
+            return self.path.read_bytes() == self.content
+        except FileNotFoundError:
+            return False
+
+    def renew(self):
+        if self.lost:
+            return
+        if not self.held():
+            log.warning("lease of %s was taken over by another node", self.key)
+            self.lost = True
+            return
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            # renamed away by another node since held() looked at it
+            log.warning("lease of %s was taken over by another node", self.key)
+            self.lost = True
+
+    def keep_alive(self, interval):
+        """renews the lease every interval seconds from a thread until the returned event is set"""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.renew()
+
+        threading.Thread(target=run, daemon=True).start()
+        return stop
+
+    def finish(self, status):
+        """replaces the lease with a done marker holding status
+
+        A lease that was taken over is left to the node that holds it now,
+        returns whether the marker was written.
+        """
+        if not self.held():
+            log.warning("lease of %s was taken over, leaving it to that node", self.key)
+            return False
+        write_atomic(
+            self.path.with_suffix(".done"),
+            {
+                "file": self.key,
+                "status": status,
+                "source": self.source,
+                "settings": self.settings,
+            },
+        )
+        self.release()
+        return True
+
+    def release(self):
+        """removes the lease file if it is still the one of this node"""
+        if self.held():
+            self.path.unlink()
+
+
+class WorkQueue:
+    def __init__(self, dst_dir, node, lease_time):
+        self.dir = Path(dst_dir).joinpath(queue_name)
+        self.leases = self.dir.joinpath("leases")
+        self.nodes = self.dir.joinpath("nodes")
+        self.leases.mkdir(parents=True, exist_ok=True)
+        self.nodes.mkdir(parents=True, exist_ok=True)
+        self.node = node
+        self.lease_time = lease_time
+        # lease file name to its signature and when this node first saw it
+        self.seen = {}
+
+    def lease_path(self, key):
+        return self.leases.joinpath(lease_name(key) + ".lease")
+
+    def is_finished(self, key, source=None, settings=None):
+        """whether key has a done marker of the same source and settings digests"""
+        try:
+            done = json.loads(self.lease_path(key).with_suffix(".done").read_text())
+        except (OSError, ValueError):
+            return False
+        return done.get("source") == source and done.get("settings") == settings
+
+    def create(self, path, key, attempts, source=None, settings=None):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return None
+        # the token tells this lease apart from later ones on the same file
+        content = json.dumps(
+            {
+                "file": key,
+                "node": self.node,
+                "attempts": attempts,
+                "token": uuid.uuid4().hex,
+            }
+        ).encode("utf-8")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        return Lease(path, key, attempts, content, source, settings)
+
+    def claim(self, key, now, source=None, settings=None):
+        """returns a Lease on key, or None when it is finished or held by a live node
+
+        source and settings are the digests of the file and of its settings,
+        a done marker of other digests does not count as finished.
+        """
+        if self.is_finished(key, source, settings):
+            return None
+        lease = self.acquire(self.lease_path(key), key, now, source, settings)
+        if lease is not None and lease.attempts > journal.max_attempts:
+            # taken over from nodes that crashed on it max_attempts times
+            self.record(
+                {
+                    "file": key,
+                    "status": "failed",
+                    "error": crashed_error,
+                    "source": source,
+                    "settings": settings,
+                }
+            )
+            lease.finish("failed")
+            return None
+        return lease
+
+    def acquire(self, path, key, now, source=None, settings=None):
+        """returns a Lease on path, or None while a live node holds it
+
+        A lease that was not renewed for lease_time, over the calls seeing
+        it, is taken over.
+        """
+        lease = self.create(path, key, 1, source, settings)
+        if lease is not None:
+            return lease
+        try:
+            current = fresh_signature(path)
+        except FileNotFoundError:
+            # released meanwhile, try again on the next round
+            return None
+        seen = self.seen.get(path.name)
+        if seen is None or seen[0] != current:
+            self.seen[path.name] = (current, now)
+            return None
+        if now - seen[1] < self.lease_time:
+            return None
+        del self.seen[path.name]
+        return self.take_over(path, key, current, source, settings)
+
+    def take_over(self, path, key, stale, source=None, settings=None):
+        """claims a lease that was not renewed for lease_time"""
+        private = path.with_name(path.name + "." + self.node)
+        try:
+            os.rename(path, private)
+        except FileNotFoundError:
+            # another node was faster
+            return None
+        if fresh_signature(private) != stale:
+            # renewed or claimed again since it was seen, put it back
+            try:
+                os.link(private, path)
+            except FileExistsError:
+                pass
+            private.unlink()
+            return None
+        try:
+            attempts = json.loads(private.read_text()).get("attempts", 1)
+        except ValueError:
+            attempts = 1
+        private.unlink()
+        log.warning("taking over %s from a node that stopped renewing it", key)
+        return self.create(path, key, attempts + 1, source, settings)
+
+    def record(self, entry):
+        """appends a result of this node"""
+        with open(self.nodes.joinpath(self.node + ".jsonl"), "a") as f:
+            f.write(json.dumps(dict(entry, node=self.node)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def results(self, sources=None, settings_digests=None):
+        """returns the last recorded result of every file over all nodes
+
+        With sources and settings_digests, the digests of the source files
+        and of their settings, results of the current version of a file win
+        over results of earlier versions.
+        """
+        settings_digests = settings_digests or {}
+
+        def is_current(key, entry):
+            return entry.get("source") == sources.get(key) and entry.get(
+                "settings"
+            ) == settings_digests.get(key)
+
+        results = {}
+        for path in sorted(self.nodes.glob("*.jsonl")):
+            for key, entry in parallel.read_results(path).items():
+                current = results.get(key)
+                if (
+                    sources is not None
+                    and current is not None
+                    and is_current(key, current)
+                    and not is_current(key, entry)
+                ):
+                    continue
+                results[key] = entry
+        return results
+
+
+def aggregate(
+    dst_dir,
+    queue,
+    clips=None,
+    settings_digests=None,
+    sources=None,
+    poll_interval=10.0,
+):
+    """merges the results of all nodes into the summary, the bake report and the manifest
+
+    Only one node at a time aggregates, holding a lease like the ones on
+    files. A node finding it held waits until it is released, or taken over
+    from a node that died aggregating, and then aggregates again, so the
+    results of the last node to finish are always merged. Returns the
+    summary.
+    """
+    path = queue.dir.joinpath("aggregate.lease")
+    while True:
+        lease = queue.acquire(path, "aggregate", time.monotonic())
+        if lease is not None:
+            break
+        time.sleep(min(poll_interval, queue.lease_time / 4))
+    stop = lease.keep_alive(queue.lease_time / 4)
+    try:
+        results = queue.results(sources, settings_digests)
+        counts = {}
+        nodes = {}
+        for entry in results.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+            node = nodes.setdefault(entry["node"], {})
+            node[entry["status"]] = node.get(entry["status"], 0) + 1
+        summary = {
+            "files": len(results),
+            "status": counts,
+            "nodes": nodes,
+            "failed": {
+                key: entry.get("error")
+                for key, entry in results.items()
+                if entry["status"] == "failed"
+            },
+        }
+        write_atomic(Path(dst_dir).joinpath(summary_name), summary)
+        instrumentation.write_report(
+            dst_dir, [entry.get("stats") for entry in results.values()]
+        )
+
+        if clips is not None:
+            for key, entry in results.items():
+                if entry["status"] == "done" and entry.get(
+                    "settings"
+                ) == settings_digests.get(key):
+                    manifest.record(
+                        clips,
+                        key,
+                        entry["source"],
+                        entry["settings"],
+                        entry["output"],
+                    )
+            manifest.save_manifest(dst_dir, clips)
+    finally:
+        stop.set()
+        lease.release()
+    return summary
+
+
+def distributed_batch(
+    src_dir,
+    dst_dir,
+    templ_path,
+    cbones,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    scale,
+    incremental=False,
+    recursive=False,
+    lease_time=300.0,
+    poll_interval=10.0,
+    node=None,
+    cprofile_file=None,
+    memory_limit_mb=0,
+    rules_file=None,
+    **options
+):
+    """bakes the files of src_dir together with other nodes working on the same queue
+
+    Options are passed on to bake_file, overridden for single files by the
+    rules of rules_file and their sidecar files. Keeps going until every file is
+    finished by some node, then returns the number of files this node
+    converted, or -1 if any file of the batch failed.
+    """
+    numfiles = 0
+    node = node or node_name()
+
+    mixamo_baker.setup_scene(scale)
+
+    settings = dict(
+        options,
+        hips_to_root=hips_to_root,
+        use_x=use_x,
+        use_y=use_y,
+        use_z=use_z,
+        use_rotation=use_rotation,
+        on_ground=on_ground,
+    )
+    files = {
+        mixamo_baker.relative_name(file, src_dir): file
+        for file in mixamo_baker.source_files(src_dir, recursive, dst_dir)
+    }
+    overrides = rules.resolve_files(src_dir, files, rules_file)
+    file_settings = rules.file_settings(settings, overrides)
+    sources = {key: manifest.file_digest(file) for key, file in files.items()}
+    # done markers hold the settings digests too, so changed settings bake again
+    settings_digests = rules.settings_digests(
+        templ_path, cbones, scale, settings, overrides
+    )
+    clips = manifest.load_manifest(dst_dir) if incremental else None
+    queue = WorkQueue(dst_dir, node, lease_time)
+    # every node walks the files in its own order so they rarely race for a lease
+    order = list(files)
+    random.Random(node).shuffle(order)
+
+    retarget_profiles.load_profile(settings.get("profile", "unreal"))
+    template = mixamo_baker.SkeletonTemplate(templ_path)
+    print("Node : {}".format(node))
+
+    try:
+        while True:
+            left = [
+                key
+                for key in order
+                if not queue.is_finished(key, sources[key], settings_digests[key])
+            ]
+            if not left:
+                break
+            claimed = False
+            for key in left:
+                lease = queue.claim(
+                    key, time.monotonic(), sources[key], settings_digests[key]
+                )
+                if lease is None:
+                    continue
+                claimed = True
+                stop = lease.keep_alive(lease_time / 4)
+                try:
+                    entry = bake_claimed(
+                        files[key],
+                        key,
+                        src_dir,
+                        dst_dir,
+                        template,
+                        cbones,
+                        cprofile_file,
+                        clips,
+                        sources[key],
+                        settings_digests[key],
+                        file_settings[key],
+                    )
+                finally:
+                    stop.set()
+                if lease.held():
+                    queue.record(entry)
+                lease.finish(entry["status"])
+                if entry["status"] == "done":
+                    numfiles += 1
+                    print("Baked : {}".format(key))
+                elif entry["status"] == "failed":
+                    print("Failed : {}\n{}".format(key, entry["error"]))
+                template = mixamo_baker.limit_memory(
+                    template, templ_path, memory_limit_mb, key
+                )
+            if not claimed:
+                # the rest is held by other nodes, wait for them to finish or die
+                time.sleep(min(poll_interval, lease_time / 4))
+    finally:
+        template.free()
+
+    summary = aggregate(dst_dir, queue, clips, settings_digests, sources, poll_interval)
+    print("Summary : {}".format(summary["status"]))
+    failed = [
+        entry
+        for entry in queue.results(sources, settings_digests).values()
+        if entry["status"] == "failed"
+    ]
+    if failed:
+        return -1
+    return numfiles
+
+
+def bake_claimed(
+    file,
+    key,
+    src_dir,
+    dst_dir,
+    template,
+    cbones,
+    cprofile_file,
+    clips,
+    source_digest,
+    settings_digest,
+    settings,
+):
+    """bakes one claimed file and returns its result entry"""
+    output = mixamo_baker.output_path(
+        file, dst_dir, src_dir, settings.get("output_format", "FBX")
+    )
+    entry = {
+        "file": key,
+        "output": str(output),
+        "source": source_digest,
+        "settings": settings_digest,
+    }
+    if clips is not None and manifest.is_up_to_date(
+        clips, key, source_digest, settings_digest, output
+    ):
+        return dict(entry, status="skipped")
+    try:
+        baked, row = mixamo_baker.bake_file_recorded(
+            file, dst_dir, template, cbones, cprofile_file, src_root=src_dir, **settings
+        )
+    except Exception:
+        traceback.print_exc()
+        mixamo_baker.object_mode()
+        return dict(entry, status="failed", error=traceback.format_exc())
+    return dict(entry, status="done" if baked else "skipped", stats=row)
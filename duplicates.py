@@ -0,0 +1,138 @@
+"""Detection of source files holding an animation that was already baked.
+
+Libraries collected from several people are full of byte different copies of
+the same Mixamo clip: downloaded with and without skin, downloaded twice or
+renamed. Before a file is baked, the action of its imported armature is
+fingerprinted: every fcurve is sampled on each frame, quantized and hashed
+together with its bone and channel, and so are the rest matrices of the
+bones, since rigs with other bone lengths bake differently. The fingerprint is combined with the
+manifest digest of the template and the bake settings into the clip's key.
+A file whose key is already in the index is not baked, its outputs are
+copies of, or hard links to, the outputs of the file first baked with that
+key. Copies keep the take name of that file. Outputs are always written
+through a new file replacing the old one, so rebaking a file leaves the
+links to its previous outputs at their content.
+
+The index lives in the output directory, so duplicates are found across runs
+for as long as the first outputs exist.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+index_name = ".mixamo_baker_clips.json"
+# bump when the fingerprint changes for identical actions
+index_version = 2
+# sampled values are rounded to this step before hashing
+quantum = 1e-4
+
+
+def quantized(values):
+    steps = np.rint(np.asarray(values, dtype=np.float64) / quantum)
+    # -0 and 0 must hash alike
+    return (steps + 0.0).astype("<i8").tobytes()
+
+
+def fingerprint(channels, rest=()):
+    """returns a hex digest of (data path, array index, sampled values) channels
+
+    rest holds the (bone name, 4x4 rest matrix) of every bone of the
+    armature. Channels and bones are hashed in the order given, callers sort
+    them.
+    """
+    h = hashlib.sha256()
+    for data_path, index, values in channels:
+        h.update("{}[{}]".format(data_path, index).encode("utf-8"))
+        h.update(quantized(values))
+    for name, matrix in rest:
+        h.update("rest {}".format(name).encode("utf-8"))
+        h.update(quantized(matrix))
+    return h.hexdigest()
+
+
+def clip_key(fingerprint, settings_digest):
+    """returns the index key of a fingerprinted action baked with manifest.settings_digest"""
+    h = hashlib.sha256()
+    h.update(str(index_version).encode())
+    h.update(fingerprint.encode())
+    h.update(settings_digest.encode())
+    return h.hexdigest()
+
+
+class DuplicateIndex:
+    """clip keys of baked files mapped to their outputs, relative to the output directory"""
+
+    def __init__(self, dst_dir, link=False):
+        self.dst_dir = Path(dst_dir)
+        self.path = self.dst_dir.joinpath(index_name)
+        self.link = link
+        # clips added since the last pop_added, for workers to report
+        self.added = {}
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            data = {}
+        self.clips = (
+            data.get("clips", {}) if data.get("version") == index_version else {}
+        )
+
+    def lookup(self, key):
+        """returns the output files of the clip baked with key, or None if there are none left"""
+        outputs = self.clips.get(key)
+        if outputs is None:
+            return None
+        outputs = [self.dst_dir.joinpath(output) for output in outputs]
+        if not all(output.exists() for output in outputs):
+            return None
+        return outputs
+
+    def add(self, key, outputs):
+        outputs = [
+            Path(output).relative_to(self.dst_dir).as_posix() for output in outputs
+        ]
+        self.clips[key] = outputs
+        self.added[key] = outputs
+
+    def update(self, clips):
+        self.clips.update(clips)
+
+    def pop_added(self):
+        added, self.added = self.added, {}
+        return added
+
+    def reuse(self, originals, outputs):
+        """writes outputs as copies of, or links to, the original outputs"""
+        for original, output in zip(originals, outputs):
+            output = Path(output)
+            if output == original:
+                continue
+            output.parent.mkdir(parents=True, exist_ok=True)
+            if output.exists():
+                output.unlink()
+            if self.link:
+                try:
+                    os.link(original, output)
+                    continue
+                except OSError:
+                    # different file systems, or no hard links there
+                    pass
+            shutil.copy2(original, output)
+
+    def save(self):
+        """writes the index through a temporary file so a crash never truncates it"""
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(
+            json.dumps({"version": index_version, "clips": self.clips}, indent=1)
+        )
+        os.replace(tmp, self.path)
+
+
+def open_index(dst_dir, mode):
+    """returns the index of dst_dir for duplicate mode COPY or LINK, None for OFF"""
+    if mode == "OFF":
+        return None
+    return DuplicateIndex(dst_dir, link=mode == "LINK")
@@ -0,0 +1,91 @@
+"""Fan out of every source file of a batch to several skeleton templates.
+
+Instead of a .blend template, a batch can be given a targets file:
+
+    {
+        "targets": [
+            {"template": "mannequin.blend", "subfolder": "ue"},
+            {"template": "hero.blend", "cbones": "hand_r hand_l", "scale": 1.0},
+            {"template": "crowd_lod.blend", "subfolder": "crowd"}
+        ]
+    }
+
+Every source file is then imported and cleaned up once and baked onto each
+template, see mixamo_baker.bake_file_targets. Template paths are relative to
+the targets file. Constrained bones and the scene unit scale default to the
+batch's, the subfolder of the output directory a target's clips go to
+defaults to the name of its template.
+
+The source is imported once at the batch scale, and the importer scales the
+armature object by the inverse of the scene unit scale. For a target of
+another scale the source armature is scaled by source_factor about the
+origin before baking, which is what importing it at the scale of the target
+would have done, and the clips are baked and exported at the target's scale.
+"""
+
+from pathlib import Path
+import json
+
+
+class Target:
+    """a skeleton template with the constrained bones, scale and output subfolder to bake it with"""
+
+    def __init__(self, template, cbones="", scale=0.01, subfolder=""):
+        self.template = str(template)
+        self.cbones = cbones
+        self.scale = scale
+        self.subfolder = subfolder
+
+    def output_dir(self, dst_dir):
+        return Path(dst_dir).joinpath(self.subfolder)
+
+    def source_factor(self, import_scale):
+        """returns how much a source imported at import_scale is scaled for this target"""
+        return import_scale / self.scale
+
+
+def is_targets_file(templ_path):
+    return isinstance(templ_path, (str, Path)) and Path(templ_path).suffix == ".json"
+
+
+def load_targets(path, cbones, scale):
+    """reads a targets file, filling in cbones and scale where a target leaves them out"""
+    path = Path(path)
+    data = json.loads(path.read_text())
+    return make_targets(data["targets"], cbones, scale, path.parent)
+
+
+def make_targets(entries, cbones, scale, base_dir=None):
+    """returns Targets for a list of Targets or dicts as found in targets files"""
+    targets = []
+    for entry in entries:
+        if not isinstance(entry, Target):
+            template = Path(entry["template"])
+            if base_dir is not None:
+                template = Path(base_dir).joinpath(template)
+            entry = Target(
+                template,
+                entry.get("cbones", cbones),
+                entry.get("scale", scale),
+                entry.get("subfolder", template.stem),
+            )
+        if not entry.scale > 0:
+            raise ValueError(
+                "target %s needs a positive scale, not %s"
+                % (entry.template, entry.scale)
+            )
+        targets.append(entry)
+
+    subfolders = [target.subfolder for target in targets]
+    if len(set(subfolders)) < len(subfolders):
+        raise ValueError("targets need different subfolders: %s" % subfolders)
+    return targets
+
+
+def resolve_targets(templ_path, cbones, scale):
+    """returns the targets templ_path stands for, or None when it is a single template"""
+    if isinstance(templ_path, (list, tuple)):
+        return make_targets(templ_path, cbones, scale)
+    if is_targets_file(templ_path):
+        return load_targets(templ_path, cbones, scale)
+    return None
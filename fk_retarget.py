@@ -0,0 +1,201 @@
+"""Forward kinematics retargeting on arrays of bone transforms.
+
+Reproduces what the bake does with constraints (every paired destination
+bone copies the world location and rotation of its source bone) as plain
+NumPy math over all frames at once, so no scene evaluation is needed. All
+functions work on arrays and do not need Blender.
+
+Armatures are described by their bones' rest matrices in armature space,
+Blender's bone.matrix_local, and the index of each bone's parent, -1 for
+roots. Bones are assumed to inherit rotation and scale from their parents
+and to have local locations, which is Blender's default.
+"""
+
+import numpy as np
+from .root_motion import compose_matrices
+
+
+def hierarchy_order(parents):
+    """returns bone indices ordered so that every parent comes before its children"""
+    order = []
+    placed = set()
+    pending = list(range(len(parents)))
+    while pending:
+        left = []
+        for b in pending:
+            if parents[b] < 0 or parents[b] in placed:
+                order.append(b)
+                placed.add(b)
+            else:
+                left.append(b)
+        if len(left) == len(pending):
+            raise ValueError("bone parents form a cycle")
+        pending = left
+    return order
+
+
+def rest_offsets(rest, parents):
+    """returns the (bones, 4, 4) rest matrices of every bone relative to its parent"""
+    offsets = np.array(rest, dtype=np.float64)
+    for b, p in enumerate(parents):
+        if p >= 0:
+            offsets[b] = np.linalg.inv(rest[p]) @ rest[b]
+    return offsets
+
+
+def forward_kinematics(rest, parents, basis):
+    """returns (frames, bones, 4, 4) armature space pose matrices
+
+    basis holds the (frames, bones, 4, 4) local pose matrices, what Blender
+    keys as location, rotation and scale of each pose bone.
+    """
+    offsets = rest_offsets(rest, parents)
+    pose = np.empty_like(basis)
+    for b in hierarchy_order(parents):
+        p = parents[b]
+        if p < 0:
+            pose[:, b] = offsets[b] @ basis[:, b]
+        else:
+            pose[:, b] = pose[:, p] @ offsets[b] @ basis[:, b]
+    return pose
+
+
+def inverse_kinematics(rest, parents, pose):
+    """returns the (frames, bones, 4, 4) local pose matrices that produce pose"""
+    offsets = rest_offsets(rest, parents)
+    basis = np.empty_like(pose)
+    for b, p in enumerate(parents):
+        parent = offsets[b] if p < 0 else pose[:, p] @ offsets[b]
+        basis[:, b] = np.linalg.inv(parent) @ pose[:, b]
+    return basis
+
+
+def without_scale(matrices):
+    """returns copies of (..., 4, 4) matrices with unit length axes"""
+    matrices = np.array(matrices, dtype=np.float64)
+    matrices[..., :3, :3] /= np.linalg.norm(matrices[..., :3, :3], axis=-2)[
+        ..., None, :
+    ]
+    return matrices
+
+
+def retarget(src_world, dst_object, dst_rest, dst_parents, pairs, dst_basis):
+    """returns the (frames, bones, 4, 4) local pose matrices of the destination
+
+    src_world holds the (frames, src bones, 4, 4) world matrices of the
+    source bones, dst_object the (frames, 4, 4) world matrices of the
+    destination object. pairs maps destination bone indices to the source
+    bone they follow: such a bone takes the world location and rotation of
+    its source, like a copy location and a copy rotation constraint, and keeps
+    its own scale. All other bones keep their (bones, 4, 4) dst_basis.
+    """
+    frames = len(src_world)
+    offsets = rest_offsets(dst_rest, dst_parents)
+    to_armature = np.linalg.inv(dst_object)
+    pose = np.empty((frames, len(dst_parents), 4, 4))
+    for b in hierarchy_order(dst_parents):
+        p = dst_parents[b]
+        parent = offsets[b] if p < 0 else pose[:, p] @ offsets[b]
+        pose[:, b] = parent @ dst_basis[b]
+        if b in pairs:
+            # the constraints replace location and rotation, the scale stays
+            scale = np.linalg.norm(pose[:, b, :3, :3], axis=-2)
+            target = without_scale(to_armature @ without_scale(src_world[:, pairs[b]]))
+            target[:, :3, :3] *= scale[:, None, :]
+            pose[:, b] = target
+    return inverse_kinematics(dst_rest, dst_parents, pose)
+
+
+def constraints_allowed(parents, pairs, constrained):
+    """whether retarget solves the paired bones of a destination with constraints
+
+    constrained holds the indices of destination bones with constraints of
+    their own, which retarget ignores. That is only right when none of them
+    is paired or above a paired bone, their pose is then left to the scene.
+    """
+    constrained = set(constrained)
+    for b in pairs:
+        while b >= 0:
+            if b in constrained:
+                return False
+            b = parents[b]
+    return True
+
+
+def matrix_to_quaternion(matrices):
+    """(n, 3+, 3+) rotation matrices to (n, 4) w, x, y, z quaternions"""
+    m = np.asarray(matrices, dtype=np.float64)[:, :3, :3]
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+    # pick the largest of w, x, y, z to divide by, for precision
+    candidates = np.stack(
+        (trace, m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]),
+        axis=1,
+    )
+    largest = np.argmax(candidates, axis=1)
+    quats = np.empty((len(m), 4))
+
+    w = largest == 0
+    s = np.sqrt(np.maximum(trace[w] + 1.0, 0.0)) * 2.0
+    quats[w] = np.stack(
+        (
+            0.25 * s,
+            (m[w, 2, 1] - m[w, 1, 2]) / s,
+            (m[w, 0, 2] - m[w, 2, 0]) / s,
+            (m[w, 1, 0] - m[w, 0, 1]) / s,
+        ),
+        axis=1,
+    )
+    x = largest == 1
+    s = np.sqrt(np.maximum(1.0 + m[x, 0, 0] - m[x, 1, 1] - m[x, 2, 2], 0.0)) * 2.0
+    quats[x] = np.stack(
+        (
+            (m[x, 2, 1] - m[x, 1, 2]) / s,
+            0.25 * s,
+            (m[x, 0, 1] + m[x, 1, 0]) / s,
+            (m[x, 0, 2] + m[x, 2, 0]) / s,
+        ),
+        axis=1,
+    )
+    y = largest == 2
+    s = np.sqrt(np.maximum(1.0 + m[y, 1, 1] - m[y, 0, 0] - m[y, 2, 2], 0.0)) * 2.0
+    quats[y] = np.stack(
+        (
+            (m[y, 0, 2] - m[y, 2, 0]) / s,
+            (m[y, 0, 1] + m[y, 1, 0]) / s,
+            0.25 * s,
+            (m[y, 1, 2] + m[y, 2, 1]) / s,
+        ),
+        axis=1,
+    )
+    z = largest == 3
+    s = np.sqrt(np.maximum(1.0 + m[z, 2, 2] - m[z, 0, 0] - m[z, 1, 1], 0.0)) * 2.0
+    quats[z] = np.stack(
+        (
+            (m[z, 1, 0] - m[z, 0, 1]) / s,
+            (m[z, 0, 2] + m[z, 2, 0]) / s,
+            (m[z, 1, 2] + m[z, 2, 1]) / s,
+            0.25 * s,
+        ),
+        axis=1,
+    )
+    return quats / np.linalg.norm(quats, axis=1)[:, None]
+
+
+def decompose(matrices):
+    """(n, 4, 4) matrices to (n, 3) locations, (n, 4) quaternions and (n, 3) scales"""
+    matrices = np.asarray(matrices, dtype=np.float64)
+    scales = np.linalg.norm(matrices[:, :3, :3], axis=1)
+    return (
+        matrices[:, :3, 3].copy(),
+        matrix_to_quaternion(matrices[:, :3, :3] / scales[:, None, :]),
+        scales,
+    )
+
+
+def compose(locations, quats, scales):
+    """(n, 4, 4) matrices from location, quaternion and scale arrays"""
+    return compose_matrices(
+        np.asarray(locations, dtype=np.float64),
+        np.asarray(quats, dtype=np.float64),
+        np.asarray(scales, dtype=np.float64),
+    )
@@ -0,0 +1,122 @@
+"""Per file stage timings and counters for batch reports.
+
+Stages are timed with the stage() context manager and counters set with
+count(), or summed with add() and maximized with peak() when one file bakes
+several clips. They only record while a file is active, between begin_file()
+and end_file(), so the bake functions can be instrumented unconditionally.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import cProfile
+import csv
+import json
+import os
+import resource
+import sys
+import time
+
+report_name = "bake_report"
+_active = None
+
+
+def current_rss():
+    """resident set size of this process in bytes, the peak RSS if unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss():
+    """peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def begin_file(file):
+    global _active
+    _active = {
+        "file": str(file),
+        "stages": {},
+        "counters": {},
+        "peak_rss": current_rss(),
+        "start": time.perf_counter(),
+    }
+
+
+def end_file():
+    """stops recording and returns the flat report row of the active file"""
+    global _active
+    stats, _active = _active, None
+    if stats is None:
+        return None
+    row = {"file": stats["file"]}
+    row["total"] = time.perf_counter() - stats["start"]
+    row.update(stats["stages"])
+    row.update(stats["counters"])
+    row["peak_rss_mb"] = max(stats["peak_rss"], current_rss()) / (1 << 20)
+    row["process_peak_rss_mb"] = peak_rss() / (1 << 20)
+    return row
+
+
+@contextmanager
+def stage(name):
+    """times the enclosed block as stage name of the active file"""
+    if _active is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _active is not None:
+            stages = _active["stages"]
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+            _active["peak_rss"] = max(_active["peak_rss"], current_rss())
+
+
+def count(name, value):
+    if _active is not None:
+        _active["counters"][name] = value
+
+
+def add(name, value):
+    """adds value to counter name, for counters summed over the clips of a file"""
+    if _active is not None:
+        counters = _active["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+
+def peak(name, value):
+    """keeps the largest value of counter name"""
+    if _active is not None:
+        counters = _active["counters"]
+        counters[name] = max(counters.get(name, value), value)
+
+
+def profiled(path, function, *args, **kwargs):
+    """runs function under cProfile and dumps the stats to path"""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(str(path))
+        print("Profile : {}".format(path))
+
+
+def write_report(dst_dir, rows):
+    """writes the rows as bake_report.json and bake_report.csv into dst_dir"""
+    rows = [row for row in rows if row]
+    dst_dir = Path(dst_dir)
+    dst_dir.joinpath(report_name + ".json").write_text(json.dumps(rows, indent=1))
+
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    with open(dst_dir.joinpath(report_name + ".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,96 @@
+"""Crash safe journal of a batch job.
+
+The journal is an append-only JSON lines file in the output directory. Every
+file of a batch is first recorded as pending, then as started when its bake
+begins and as done, skipped or failed (with the error) when it ends. Each
+line is flushed and synced, so after a crash the journal tells exactly which
+files are left, and a resumed batch continues from there.
+"""
+
+from pathlib import Path
+import json
+import os
+
+journal_name = ".mixamo_baker_journal.jsonl"
+finished = ("done", "skipped", "failed")
+# a file that was started this many times without finishing is taken as
+# crashing the session and is not started again
+max_attempts = 2
+
+
+class Journal:
+    def __init__(self, dst_dir, resume=False):
+        self.path = Path(dst_dir).joinpath(journal_name)
+        self.status = {}
+        self.errors = {}
+        self.attempts = {}
+        if resume and self.path.exists():
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line cut short by a crash
+                        continue
+                    self._apply(entry)
+            self._file = open(self.path, "a")
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "w")
+
+    def _apply(self, entry):
+        key = entry["file"]
+        self.status[key] = entry["status"]
+        if entry["status"] == "started":
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+        if entry.get("error"):
+            self.errors[key] = entry["error"]
+
+    def mark(self, key, status, error=None):
+        entry = {"file": key, "status": status}
+        if error:
+            entry["error"] = error
+        self._apply(entry)
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def remaining(self, keys):
+        """records new keys as pending and returns the keys still to bake, in order"""
+        left = []
+        for key in keys:
+            status = self.status.get(key)
+            if status is None:
+                self.mark(key, "pending")
+            elif status in finished:
+                continue
+            elif self.attempts.get(key, 0) >= max_attempts:
+                self.mark(key, "failed", "session crashed while baking this file")
+                continue
+            left.append(key)
+        return left
+
+    def summary(self):
+        counts = {}
+        for status in self.status.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def failed(self):
+        return {
+            key: self.errors.get(key)
+            for key, status in self.status.items()
+            if status == "failed"
+        }
+
+    def close(self):
+        self._file.close()
+
+
+def read_summary(dst_dir):
+    """returns the status counts of the journal in dst_dir, empty if there is none"""
+    if not Path(dst_dir).joinpath(journal_name).exists():
+        return {}
+    journal = Journal(dst_dir, resume=True)
+    journal.close()
+    return journal.summary()
@@ -0,0 +1,86 @@
+"""Tolerance driven keyframe reduction on whole channel arrays.
+
+Works on plain NumPy arrays so it can be used and tested outside Blender.
+Channels of one property (the xyz of a location, the wxyz of a quaternion)
+are reduced together so that they keep common key times, and the kept keys
+are meant to be interpolated linearly.
+"""
+
+import numpy as np
+
+
+def linear_error(times, values, i, j):
+    """absolute error of the samples between keys i and j when interpolated linearly"""
+    t = (times[i + 1 : j] - times[i]) / (times[j] - times[i])
+    interp = values[i] + t[:, None] * (values[j] - values[i])
+    return np.abs(interp - values[i + 1 : j]).max(axis=1)
+
+
+def quaternion_error(times, values, i, j):
+    """angle in radians between the samples between keys i and j and their
+    normalized linear interpolation"""
+    t = (times[i + 1 : j] - times[i]) / (times[j] - times[i])
+    interp = values[i] + t[:, None] * (values[j] - values[i])
+    interp /= np.linalg.norm(interp, axis=1)[:, None]
+    return quaternion_angle(interp, values[i + 1 : j])
+
+
+def quaternion_angle(a, b):
+    """angle in radians between two arrays of unit quaternions"""
+    b = b / np.linalg.norm(b, axis=1)[:, None]
+    dots = np.abs(np.einsum("ij,ij->i", a, b))
+    return 2.0 * np.arccos(np.clip(dots, 0.0, 1.0))
+
+
+def is_constant(values, tolerance, error=linear_error):
+    """whether every sample is within tolerance of the first one"""
+    if error is quaternion_error:
+        first = values[:1] / np.linalg.norm(values[0])
+        deviation = quaternion_angle(np.repeat(first, len(values), 0), values)
+    else:
+        deviation = np.abs(values - values[0]).max(axis=1)
+    return deviation.max() <= tolerance
+
+
+def decimate(times, values, tolerance, error=linear_error):
+    """returns the sorted indices of the keys to keep
+
+    Uses Douglas-Peucker: a segment is split at its worst sample for as long
+    as that sample is further than tolerance from the interpolated segment.
+    times is an (n,) array, values an (n, channels) array.
+    """
+    n = len(times)
+    if n <= 2:
+        return np.arange(n)
+    if is_constant(values, tolerance, error):
+        return np.array([0])
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        err = error(times, values, i, j)
+        worst = int(np.argmax(err))
+        if err[worst] > tolerance:
+            k = i + 1 + worst
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return np.flatnonzero(keep)
+
+
+def max_error(times, values, keep, error=linear_error):
+    """largest error of the samples against the curve through the kept keys"""
+    if len(keep) == 1:
+        if error is quaternion_error:
+            first = values[:1] / np.linalg.norm(values[0])
+            return quaternion_angle(np.repeat(first, len(values), 0), values).max()
+        return np.abs(values - values[0]).max()
+    worst = 0.0
+    for i, j in zip(keep[:-1], keep[1:]):
+        if j - i > 1:
+            worst = max(worst, error(times, values, i, j).max())
+    return float(worst)
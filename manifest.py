@@ -0,0 +1,76 @@
+"""Manifest of baked clips used to skip files whose output is up to date.
+
+The manifest lives in the output directory and maps every source file path,
+relative to the input directory, to a digest of its bytes combined with a
+digest of everything else the bake depends on: the skeleton template, the
+constrained bones, the unit scale and the bake flags.
+"""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+
+manifest_name = ".mixamo_baker_manifest.json"
+# bump when a change to the baker alters its output for identical inputs
+manifest_version = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """returns the sha256 hex digest of a file's bytes"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def settings_digest(templ_path, cbones, scale, settings):
+    """returns a digest of the template file and all settings a bake depends on"""
+    h = hashlib.sha256()
+    h.update(str(manifest_version).encode())
+    h.update(file_digest(templ_path).encode())
+    h.update(" ".join(sorted(cbones.split())).encode())
+    h.update(json.dumps(dict(settings, scale=scale), sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def load_manifest(dst_dir):
+    path = Path(dst_dir).joinpath(manifest_name)
+    try:
+        manifest = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {"version": manifest_version, "files": {}}
+    if manifest.get("version") != manifest_version:
+        return {"version": manifest_version, "files": {}}
+    return manifest
+
+
+def save_manifest(dst_dir, manifest):
+    """writes the manifest through a temporary file so a crash never truncates it"""
+    path = Path(dst_dir).joinpath(manifest_name)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def is_up_to_date(manifest, key, source, settings, output):
+    """whether the output of the source file known as key is current
+
+    key is the path of the file relative to the input directory.
+    """
+    entry = manifest["files"].get(key)
+    return (
+        entry is not None
+        and entry["source"] == source
+        and entry["settings"] == settings
+        and Path(output).exists()
+    )
+
+
+def record(manifest, key, source, settings, output):
+    manifest["files"][key] = {
+        "source": source,
+        "settings": settings,
+        "output": Path(output).name,
+    }
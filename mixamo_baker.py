@@ -1,59 +1,38 @@
 from pathlib import Path
+import functools
+import gc
+import os
 import re
+import time
+import traceback
 import logging
+import numpy as np
 import bpy
 from bpy_types import Object
-from math import pi
-from mathutils import Vector, Quaternion
+from . import accuracy
+from . import anim_cache
+from . import clip_format
+from . import duplicates
+from . import fan_out
+from . import fk_retarget
+from . import instrumentation
+from . import journal
+from . import keyframe_reducer
+from . import manifest
+from . import retarget_profiles
+from . import root_motion
+from . import rules
 
 rotation_mode = "QUATERNION"
 log = logging.getLogger(__name__)
 # log.setLevel('DEBUG')
-unreal = {
-    "Root": "root",
-    "Hips": "pelvis",
-    "Spine": "spine_01",
-    "Spine1": "spine_02",
-    "Spine2": "spine_03",
-    "~Shoulder": "clavicle_~",
-    "~Arm": "upperarm_~",
-    "~ForeArm": "lowerarm_~",
-    "~Hand": "hand_~",
-    "Neck1": "neck_01",
-    "Neck": "neck_01",
-    "Head": "head",
-    "~UpLeg": "thigh_~",
-    "~Leg": "calf_~",
-    "~Foot": "foot_~",
-    "~HandIndex1": "index_01_~",
-    "~HandIndex2": "index_02_~",
-    "~HandIndex3": "index_03_~",
-    "~HandMiddle1": "middle_01_~",
-    "~HandMiddle2": "middle_02_~",
-    "~HandMiddle3": "middle_03_~",
-    "~HandPinky1": "pinky_01_~",
-    "~HandPinky2": "pinky_02_~",
-    "~HandPinky3": "pinky_03_~",
-    "~HandRing1": "ring_01_~",
-    "~HandRing2": "ring_02_~",
-    "~HandRing3": "ring_03_~",
-    "~HandThumb1": "thumb_01_~",
-    "~HandThumb2": "thumb_02_~",
-    "~HandThumb3": "thumb_03_~",
-    "~ToeBase": "ball_~",
-    "~Wrist": "wrist_~",
-}
 
 
 def remove_namespace(s=""):
     """function for removing all namespaces from strings, objects or even armatrure bones"""
 
     if type(s) == str:
-        i = re.search(r"[:_]", s[::-1])
-        if i:
-            return s[-(i.start()) : :]
-        else:
-            return s
+        return retarget_profiles.strip_namespace(s)
 
     elif type(s) == Object:
         if s.type == "ARMATURE":
@@ -64,42 +43,45 @@ def remove_namespace(s=""):
     return -1
 
 
-def rename_to_unreal(s):
-    """function for renaming the armature bones to a target skeleton"""
+def rename_to_profile(s, profile="unreal"):
+    """function for renaming the armature bones to the target skeleton of a retarget profile"""
 
     if s.type == "ARMATURE":
-        remove_namespace(s)
-        for name, value in unreal.items():
-            if "~" in name:
-                src = name.replace("~", "Left")
-                dst = value.replace("~", "l")
-                rename_bone(s, [name[1:], name[1:] + ".L", src], dst)
-                src = name.replace("~", "Right")
-                dst = value.replace("~", "r")
-                rename_bone(s, [name[1:], name[1:] + ".R", src], dst)
-            else:
-                rename_bone(s, [name], value)
+        profile = retarget_profiles.load_profile(profile)
+        s.name = remove_namespace(s.name)
+        for bone in s.data.bones:
+            bone.name = profile.target_name(bone.name) or remove_namespace(bone.name)
 
 
-def rename_to_mixamo(s):
-    """function for renaming the armature bones to a target skeleton"""
+def rename_from_profile(s, profile="unreal"):
+    """function for renaming target skeleton bones of a retarget profile back to mixamo"""
 
     if s.type == "ARMATURE":
-        remove_namespace(s)
-        for name, value in unreal.items():
-            if "~" in value:
-                src = value.replace("~", "l")
-                dst = name.replace("~", "Left")
-                rename_bone(s, [src], dst)
-                src = value.replace("~", "r")
-                dst = name.replace("~", "Right")
-                rename_bone(s, [src], dst)
-            else:
-                rename_bone(s, [value], name)
+        profile = retarget_profiles.load_profile(profile)
+        s.name = remove_namespace(s.name)
+        for bone in s.data.bones:
+            source = profile.to_source.get(bone.name)
+            if source is None:
+                source = profile.to_source.get(remove_namespace(bone.name))
+            if source is not None:
+                bone.name = source
+
+
+def rename_to_unreal(s):
+    """function for renaming the armature bones to a target skeleton"""
+    rename_to_profile(s, "unreal")
+
+
+def rename_to_mixamo(s):
+    """function for renaming the armature bones to a target skeleton"""
+    rename_from_profile(s, "unreal")
 
 
 def get_all_quaternion_curves(object):
     """returns all quaternion fcurves of object/bones packed together in a touple per object/bone"""
+    # objects without root motion, like in-place clips, may have no action yet
+    if not object.animation_data or not object.animation_data.action:
+        return
     fcurves = object.animation_data.action.fcurves
     if fcurves.find("rotation_quaternion"):
         yield (
@@ -120,40 +102,122 @@ def get_all_quaternion_curves(object):
                 )
 
 
-def quaternion_cleanup(object, prevent_flips=True, prevent_inverts=True):
-    """fixes signs in quaternion fcurves swapping from one frame to another"""
+# enum values of bpy.types.Keyframe.interpolation as used by foreach_set
+interpolation_modes = {"CONSTANT": 0, "LINEAR": 1, "BEZIER": 2}
+
+
+def read_keyframes(curve):
+    """returns keyframe times and values of a fcurve as numpy arrays"""
+    co = np.empty(len(curve.keyframe_points) * 2, dtype=np.float32)
+    curve.keyframe_points.foreach_get("co", co)
+    return co[0::2], co[1::2]
+
+
+def write_keyframes(curve, times, values, interpolation=None):
+    """replaces the keyframes of a fcurve with times and values in one bulk write"""
+    keyframe_points = curve.keyframe_points
+    if len(keyframe_points) < len(times):
+        keyframe_points.add(len(times) - len(keyframe_points))
+    while len(keyframe_points) > len(times):
+        keyframe_points.remove(keyframe_points[-1], fast=True)
+    co = np.empty((len(times), 2), dtype=np.float32)
+    co[:, 0] = times
+    co[:, 1] = values
+    keyframe_points.foreach_set("co", co.ravel())
+    if interpolation is not None:
+        keyframe_points.foreach_set(
+            "interpolation", [interpolation_modes[interpolation]] * len(times)
+        )
+    curve.update()
+
+
+def quaternion_multiply(a, b):
+    """hamilton product of two (n, 4) arrays of w, x, y, z quaternions"""
+    aw, ax, ay, az = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bw, bx, by, bz = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return np.stack(
+        (
+            aw * bw - ax * bx - ay * by - az * bz,
+            aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+        ),
+        axis=1,
+    )
+
+
+def fix_hemisphere(quats):
+    """negates samples so that each quaternion lies in the hemisphere of the previous one"""
+    dots = np.einsum("ij,ij->i", quats[1:], quats[:-1])
+    signs = np.ones(len(quats), dtype=quats.dtype)
+    signs[1:] = np.where(dots < 0.0, -1.0, 1.0)
+    return quats * np.cumprod(signs)[:, None]
+
+
+def fix_flips(quats, threshold=0.5):
+    """removes 180 degree pops between consecutive samples
+
+    Each pop rotates the rest of the clip by half a turn around the axis of
+    the pop, so corrections are applied per segment rather than per sample.
+    """
+    # two consecutive samples differing by pi +- threshold have |dot| below this
+    limit = np.sin(threshold / 2.0)
+    start = 1
+    while start < len(quats):
+        dots = np.einsum("ij,ij->i", quats[start:], quats[start - 1 : -1])
+        pops = np.flatnonzero(np.abs(dots) < limit)
+        if not len(pops):
+            break
+        i = start + pops[0]
+        prev_conj = quats[i - 1] * np.array([1.0, -1.0, -1.0, -1.0])
+        diff = quaternion_multiply(prev_conj[None, :], quats[i][None, :])[0]
+        axis = diff[1:]
+        norm = np.linalg.norm(axis)
+        if norm < 1e-8:
+            start = i + 1
+            continue
+        half_turn = np.zeros((1, 4), dtype=quats.dtype)
+        half_turn[0, 1:] = axis / norm
+        quats[i:] = quaternion_multiply(
+            quats[i:], np.repeat(half_turn, len(quats) - i, 0)
+        )
+        quats[i:] = fix_hemisphere(np.concatenate((quats[i - 1 : i], quats[i:])))[1:]
+        start = i + 1
+    return quats
+
+
+def quaternion_cleanup(object, prevent_flips=True, prevent_inverts=True, dense=True):
+    """fixes signs in quaternion fcurves swapping from one frame to another
+
+    With dense enabled every channel gets one linear key per frame, otherwise
+    the existing key times are kept and only the values are corrected.
+    """
     for curves in get_all_quaternion_curves(object):
-        start = int(min((curves[i].keyframe_points[0].co.x for i in range(4))))
-        end = int(max((curves[i].keyframe_points[-1].co.x for i in range(4))))
-        for curve in curves:
-            for i in range(start, end):
-                curve.keyframe_points.insert(
-                    i, curve.evaluate(i)
-                ).interpolation = "LINEAR"
-        zipped = list(
-            zip(
-                curves[0].keyframe_points,
-                curves[1].keyframe_points,
-                curves[2].keyframe_points,
-                curves[3].keyframe_points,
+        if None in curves or not all(len(c.keyframe_points) for c in curves):
+            continue
+        keys = [read_keyframes(curve) for curve in curves]
+        times = np.unique(np.concatenate([t for t, v in keys]))
+        if dense:
+            frames = np.arange(int(times[0]), int(times[-1]), dtype=np.float32)
+            times = np.union1d(times, frames)
+
+        quats = np.empty((len(times), 4), dtype=np.float64)
+        for j, curve in enumerate(curves):
+            key_times, key_values = keys[j]
+            if len(key_times) == len(times) and np.array_equal(key_times, times):
+                quats[:, j] = key_values
+            else:
+                quats[:, j] = [curve.evaluate(t) for t in times]
+
+        if prevent_inverts:
+            quats = fix_hemisphere(quats)
+        if prevent_flips:
+            quats = fix_flips(quats)
+
+        for j, curve in enumerate(curves):
+            write_keyframes(
+                curve, times, quats[:, j], interpolation="LINEAR" if dense else None
             )
-        )
-        for i in range(1, len(zipped)):
-            if prevent_flips:
-                rot_prev = Quaternion((zipped[i - 1][j].co.y for j in range(4)))
-                rot_cur = Quaternion((zipped[i][j].co.y for j in range(4)))
-                diff = rot_prev.rotation_difference(rot_cur)
-                if abs(diff.angle - pi) < 0.5:
-                    rot_cur.rotate(Quaternion(diff.axis, pi))
-                    for j in range(4):
-                        zipped[i][j].co.y = rot_cur[j]
-            if prevent_inverts:
-                change_amount = 0.0
-                for j in range(4):
-                    change_amount += abs(zipped[i - 1][j].co.y - zipped[i][j].co.y)
-                if change_amount > 1.0:
-                    for j in range(4):
-                        zipped[i][j].co.y *= -1.0
 
 
 def rename_bone(s, names, dst):
@@ -163,6 +227,22 @@ def rename_bone(s, names, dst):
             bone.name = dst
 
 
+def find_hips(src_armature):
+    hips = None
+    for hipname in ("Hips", "mixamorig:Hips", "mixamorig_Hips", "pelvis"):
+        hips = src_armature.pose.bones.get(hipname)
+        if hips != None:
+            break
+
+    if hips == None:
+        log.warning(
+            "WARNING I have not found any hip bone for %s and the conversion is stopping here",
+            src_armature.name,
+        )
+        raise ValueError("no hips found")
+    return hips
+
+
 def bake_hips(
     src_armature,
     dst_armature,
@@ -181,18 +261,7 @@ def bake_hips(
     dst_armature.select_set(True)
     bpy.context.view_layer.objects.active = dst_armature
 
-    hips = None
-    for hipname in ("Hips", "mixamorig:Hips", "mixamorig_Hips", "pelvis"):
-        hips = src_armature.pose.bones.get(hipname)
-        if hips != None:
-            break
-
-    if hips == None:
-        log.warning(
-            "WARNING I have not found any hip bone for %s and the conversion is stopping here",
-            root.pose.bones,
-        )
-        raise ValueError("no hips found")
+    hips = find_hips(src_armature)
 
     hiplocation_world = src_armature.matrix_local @ hips.bone.head
     z_offset = hiplocation_world[2]
@@ -245,7 +314,129 @@ def bake_hips(
         )
 
 
-def bake_bones(
+def sample_fcurve(fc, frames):
+    """returns the values of a fcurve at frames, read from its keys where they line up"""
+    times, values = read_keyframes(fc)
+    if len(times) and not fc.modifiers:
+        index = np.minimum(np.searchsorted(times, frames), len(times) - 1)
+        if np.all(times[index] == frames):
+            return values[index].astype(np.float64)
+    return np.array([fc.evaluate(frame) for frame in frames])
+
+
+def sample_bone_channels(armature, pose_bone, frames):
+    """evaluates the location, rotation_quaternion and scale fcurves of a pose bone"""
+    return sample_channels(
+        armature.animation_data.action.fcurves,
+        pose_bone,
+        pose_bone.path_from_id() + ".",
+        frames,
+    )
+
+
+def sample_channels(fcurves, owner, path, frames):
+    """evaluates the location, rotation_quaternion and scale fcurves of an object or pose bone
+
+    Channels without fcurves hold the owner's current value.
+    """
+    channels = []
+    for prop in ("location", "rotation_quaternion", "scale"):
+        default = getattr(owner, prop)
+        values = np.empty((len(frames), len(default)))
+        for index in range(len(default)):
+            fc = fcurves.find(path + prop, index=index)
+            if fc:
+                values[:, index] = sample_fcurve(fc, frames)
+            else:
+                values[:, index] = default[index]
+        channels.append(values)
+    return channels
+
+
+def sample_hips_matrices(src_armature, hips, frames):
+    """returns the (frames, 4, 4) world matrices of the hips
+
+    Parentless hips on an unanimated object are evaluated from their fcurves,
+    anything else falls back to stepping the timeline.
+    """
+    fcurves = src_armature.animation_data.action.fcurves
+    if hips.parent is None and all(fc.data_path.startswith("pose.") for fc in fcurves):
+        basis = root_motion.compose_matrices(
+            *sample_bone_channels(src_armature, hips, frames)
+        )
+        rest = np.array(src_armature.matrix_world @ hips.bone.matrix_local)
+        return rest[None, :, :] @ basis
+
+    scene = bpy.context.scene
+    frame_current = scene.frame_current
+    matrices = np.empty((len(frames), 4, 4))
+    for f, frame in enumerate(frames):
+        scene.frame_set(int(frame))
+        matrices[f] = np.array(src_armature.matrix_world @ hips.matrix)
+    scene.frame_set(frame_current)
+    return matrices
+
+
+def write_property(fcurves, data_path, frames, values, group=""):
+    """replaces the fcurves of a property with one key per frame"""
+    for index in range(values.shape[1]):
+        fc = fcurves.find(data_path, index=index)
+        if fc:
+            fcurves.remove(fc)
+        fc = fcurves.new(data_path, index=index, action_group=group)
+        write_keyframes(fc, frames, values[:, index])
+
+
+def bake_hips_analytic(
+    src_armature,
+    dst_armature,
+    act_name,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    framerange,
+    smoothing=0,
+    start_at_origin=False,
+):
+    """keys root motion computed from the hips transforms onto the destination object"""
+    if not hips_to_root:
+        return
+
+    hips = find_hips(src_armature)
+    z_offset = (src_armature.matrix_local @ hips.bone.head)[2]
+    frames = np.arange(int(framerange[0]), int(framerange[1]) + 1, dtype=np.float64)
+
+    dst_armature.rotation_mode = rotation_mode
+    locations, eulers = root_motion.extract_root_motion(
+        sample_hips_matrices(src_armature, hips, frames),
+        dst_armature.location,
+        dst_armature.matrix_basis.to_euler("XYZ"),
+        z_offset,
+        use_x,
+        use_y,
+        use_z,
+        use_rotation,
+        on_ground,
+        smoothing,
+        start_at_origin,
+    )
+    quats = fix_hemisphere(root_motion.euler_to_quaternion(eulers))
+    scales = np.repeat(np.array(dst_armature.scale)[None, :], len(frames), 0)
+
+    if not dst_armature.animation_data:
+        dst_armature.animation_data_create()
+    dst_armature.animation_data.action = bpy.data.actions.new(act_name)
+    fcurves = dst_armature.animation_data.action.fcurves
+    group = "Object Transforms"
+    write_property(fcurves, "location", frames, locations, group)
+    write_property(fcurves, "rotation_quaternion", frames, quats, group)
+    write_property(fcurves, "scale", frames, scales, group)
+
+
+def prepare_bones(
     src_armature,
     dst_armature,
     act_name,
@@ -256,29 +447,55 @@ def bake_bones(
     use_z,
     use_rotation,
     on_ground,
+    bake_mode="SINGLE_PASS",
+    keep_sparse_keys=False,
+    profile="unreal",
+    root_smoothing=0,
+    root_start_at_origin=False,
+    clean_source=True,
 ):
+    """bakes the root motion and pairs up the bones of the destination with the source
 
+    Returns the (src, dst) pose bones to constrain, the destination bones
+    keyed as they are and the frame range, for bake_bones_operator or
+    bake_clips_single_pass. Without clean_source the source quaternions are
+    taken as already cleaned up by an earlier bake.
+    """
     frame_range = src_armature.animation_data.action.frame_range
     print("Baking : {} - {} - {}".format(act_name, frame_range[0], frame_range[1]))
     bpy.ops.object.select_all(action="DESELECT")
     dst_armature.select_set(True)
     bpy.context.view_layer.objects.active = dst_armature
-    quaternion_cleanup(src_armature)
-    bake_hips(
-        src_armature,
-        dst_armature,
-        act_name,
-        hips_to_root,
-        use_x,
-        use_y,
-        use_z,
-        use_rotation,
-        on_ground,
-        frame_range,
-    )
-    quaternion_cleanup(dst_armature)
+    instrumentation.count("frames", int(frame_range[1]) - int(frame_range[0]) + 1)
+    if clean_source:
+        with instrumentation.stage("quaternion_cleanup_source"):
+            quaternion_cleanup(src_armature, dense=not keep_sparse_keys)
+    if bake_mode == "OPERATOR":
+        bake_root = bake_hips
+    else:
+        bake_root = functools.partial(
+            bake_hips_analytic,
+            smoothing=root_smoothing,
+            start_at_origin=root_start_at_origin,
+        )
+    with instrumentation.stage("bake_hips"):
+        bake_root(
+            src_armature,
+            dst_armature,
+            act_name,
+            hips_to_root,
+            use_x,
+            use_y,
+            use_z,
+            use_rotation,
+            on_ground,
+            frame_range,
+        )
+    with instrumentation.stage("quaternion_cleanup_root"):
+        quaternion_cleanup(dst_armature, dense=not keep_sparse_keys)
     bpy.ops.object.mode_set(mode="POSE")
     process_later = []
+    constrained = []
 
     src_armature.rotation_mode = rotation_mode
     for dst in dst_armature.pose.bones:
@@ -288,42 +505,129 @@ def bake_bones(
         src.bone.select = False
         src.rotation_mode = rotation_mode
 
+    pairs = retarget_profiles.load_profile(profile).pair_bones(
+        src_armature, dst_armature
+    )
     for dst in dst_armature.pose.bones:
         if dst.bone.use_deform:
-            src = src_armature.pose.bones.get(dst.name)
-            if src and not (dst.name in cbones):
-                dst.bone.select = True
-                dst_armature.data.bones.active = dst.bone
-                dst.rotation_mode = rotation_mode
-                src.rotation_mode = rotation_mode
-                c = dst.constraints.new(type="COPY_LOCATION")
-                c.target = src_armature
-                c.subtarget = src.name
-
-                c = dst.constraints.new(type="COPY_ROTATION")
-                c.target = src_armature
-                c.subtarget = src.name
-
-                bpy.ops.nla.bake(
-                    frame_start=int(frame_range[0]),
-                    frame_end=int(frame_range[1]),
-                    step=1,
-                    only_selected=True,
-                    visual_keying=True,
-                    clear_constraints=True,
-                    clear_parents=False,
-                    use_current_action=True,
-                    bake_types={"POSE"},
-                )
-
-                dst.bone.select = False
+            src = pairs.get(dst.name)
+            if src and dst.name not in cbones.split():
+                constrained.append((src, dst))
             else:
                 process_later.append(dst)
 
+    instrumentation.count("bones", len(constrained) + len(process_later))
+    return constrained, process_later, frame_range
+
+
+def finish_bones(dst_armature, act_name, keep_sparse_keys=False):
+    bpy.ops.object.mode_set(mode="OBJECT")
+    dst_armature.select_set(True)
+    bpy.context.view_layer.objects.active = dst_armature
+    dst_armature.animation_data.action.name = act_name
+    with instrumentation.stage("quaternion_cleanup_bones"):
+        quaternion_cleanup(dst_armature, dense=not keep_sparse_keys)
+
+
+def bake_bones(
+    src_armature,
+    dst_armature,
+    act_name,
+    cbones,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    bake_mode="SINGLE_PASS",
+    keep_sparse_keys=False,
+    profile="unreal",
+    root_smoothing=0,
+    root_start_at_origin=False,
+    clean_source=True,
+):
+    constrained, process_later, frame_range = prepare_bones(
+        src_armature,
+        dst_armature,
+        act_name,
+        cbones,
+        hips_to_root,
+        use_x,
+        use_y,
+        use_z,
+        use_rotation,
+        on_ground,
+        bake_mode,
+        keep_sparse_keys,
+        profile,
+        root_smoothing,
+        root_start_at_origin,
+        clean_source,
+    )
+    with instrumentation.stage("bake_bones"):
+        if bake_mode == "OPERATOR":
+            bake_bones_operator(
+                src_armature, dst_armature, constrained, process_later, frame_range
+            )
+        elif bake_mode == "FK":
+            bake_bones_fk(
+                src_armature,
+                dst_armature,
+                act_name,
+                constrained,
+                process_later,
+                frame_range,
+            )
+        else:
+            bake_bones_single_pass(
+                src_armature,
+                dst_armature,
+                act_name,
+                constrained,
+                process_later,
+                frame_range,
+            )
+    finish_bones(dst_armature, act_name, keep_sparse_keys)
+
+
+def constrain_bone(src_armature, src, dst):
+    """constrains dst pose bone to follow src pose bone in world space"""
+    c = dst.constraints.new(type="COPY_LOCATION")
+    c.target = src_armature
+    c.subtarget = src.name
+
+    c = dst.constraints.new(type="COPY_ROTATION")
+    c.target = src_armature
+    c.subtarget = src.name
+
+
+def bake_bones_operator(
+    src_armature, dst_armature, constrained, process_later, frame_range
+):
+    """bakes bones one at a time with bpy.ops.nla.bake, kept as reference path"""
+    for src, dst in constrained:
+        dst.bone.select = True
+        dst_armature.data.bones.active = dst.bone
+        constrain_bone(src_armature, src, dst)
+
+        bpy.ops.nla.bake(
+            frame_start=int(frame_range[0]),
+            frame_end=int(frame_range[1]),
+            step=1,
+            only_selected=True,
+            visual_keying=True,
+            clear_constraints=True,
+            clear_parents=False,
+            use_current_action=True,
+            bake_types={"POSE"},
+        )
+
+        dst.bone.select = False
+
     for dst in process_later:
         dst.bone.select = True
         dst_armature.data.bones.active = dst.bone
-        dst.rotation_mode = rotation_mode
         bpy.ops.nla.bake(
             frame_start=int(frame_range[0]),
             frame_end=int(frame_range[1]),
@@ -337,52 +641,569 @@ def bake_bones(
         )
         dst.bone.select = False
 
-    bpy.ops.object.mode_set(mode="OBJECT")
-    dst_armature.select_set(True)
-    bpy.context.view_layer.objects.active = dst_armature
-    dst_armature.animation_data.action.name = act_name
-    quaternion_cleanup(dst_armature)
 
+def bake_bones_single_pass(
+    src_armature, dst_armature, act_name, constrained, process_later, frame_range
+):
+    """bakes all bones in one timeline sweep and writes the fcurves in bulk"""
+    bake_clips_single_pass(
+        [
+            (
+                src_armature,
+                dst_armature,
+                act_name,
+                constrained,
+                process_later,
+                frame_range,
+            )
+        ]
+    )
 
-def clear_keyframes(dst_armature):
 
-    bpy.ops.object.select_all(action="DESELECT")
-    dst_armature.select_set(False)
-    bpy.context.view_layer.objects.active = dst_armature
+def bake_clips_single_pass(clips):
+    """bakes the bones of several clips in one timeline sweep
+
+    clips holds (src_armature, dst_armature, act_name, constrained,
+    process_later, frame_range) tuples as prepared by prepare_bones. The sweep
+    covers all frame ranges and each clip is sampled over its own.
+    """
+    sampled = []
+    for (
+        src_armature,
+        dst_armature,
+        act_name,
+        constrained,
+        process_later,
+        frame_range,
+    ) in clips:
+        for src, dst in constrained:
+            constrain_bone(src_armature, src, dst)
+
+        bones = [dst for src, dst in constrained] + process_later
+        start = int(frame_range[0])
+        end = int(frame_range[1])
+        # per bone samples: location(3), rotation_quaternion(4), scale(3)
+        samples = np.empty((len(bones), end - start + 1, 10), dtype=np.float32)
+        sampled.append(
+            (dst_armature, act_name, bones, start, samples, [None] * len(bones))
+        )
+
+    scene = bpy.context.scene
+    frame_current = scene.frame_current
+    first = min(clip[3] for clip in sampled)
+    last = max(clip[3] + clip[4].shape[1] - 1 for clip in sampled)
+    for frame in range(first, last + 1):
+        scene.frame_set(frame)
+        for dst_armature, act_name, bones, start, samples, previous in sampled:
+            f = frame - start
+            if f < 0 or f >= samples.shape[1]:
+                continue
+            for b, dst in enumerate(bones):
+                matrix = dst_armature.convert_space(
+                    pose_bone=dst,
+                    matrix=dst.matrix,
+                    from_space="POSE",
+                    to_space="LOCAL",
+                )
+                loc, rot, sca = matrix.decompose()
+                if previous[b] is not None:
+                    rot.make_compatible(previous[b])
+                previous[b] = rot
+                samples[b, f, 0:3] = loc
+                samples[b, f, 3:7] = rot
+                samples[b, f, 7:10] = sca
+    scene.frame_set(frame_current)
+
+    for dst_armature, act_name, bones, start, samples, previous in sampled:
+        for dst in bones:
+            for c in list(dst.constraints):
+                dst.constraints.remove(c)
+
+        if not dst_armature.animation_data:
+            dst_armature.animation_data_create()
+        if not dst_armature.animation_data.action:
+            dst_armature.animation_data.action = bpy.data.actions.new(act_name)
+        fcurves = dst_armature.animation_data.action.fcurves
+
+        frames = np.arange(start, start + samples.shape[1], dtype=np.float32)
+        for b, dst in enumerate(bones):
+            path = 'pose.bones["' + dst.name + '"].'
+            write_property(
+                fcurves, path + "location", frames, samples[b, :, 0:3], dst.name
+            )
+            write_property(
+                fcurves,
+                path + "rotation_quaternion",
+                frames,
+                samples[b, :, 3:7],
+                dst.name,
+            )
+            write_property(
+                fcurves, path + "scale", frames, samples[b, :, 7:10], dst.name
+            )
 
-    old_type = bpy.context.area.type
 
-    bpy.context.area.type = "DOPESHEET_EDITOR"
-    bpy.ops.object.mode_set(mode="POSE")
+def armature_rest(armature):
+    """returns the (bones, 4, 4) rest matrices and the parent indices of an armature's bones"""
+    bones = armature.data.bones
+    rest = np.empty(len(bones) * 16, dtype=np.float32)
+    # foreach_get flattens matrices column by column
+    bones.foreach_get("matrix_local", rest)
+    index = {bone.name: i for i, bone in enumerate(bones)}
+    parents = [index[bone.parent.name] if bone.parent else -1 for bone in bones]
+    return rest.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64), parents
+
+
+def sample_object_matrices(obj, frames):
+    """returns the (frames, 4, 4) world matrices of an unparented object from its fcurves"""
+    action = obj.animation_data.action if obj.animation_data else None
+    if action is None:
+        return np.repeat(np.array(obj.matrix_world)[None], len(frames), 0)
+    return fk_retarget.compose(*sample_channels(action.fcurves, obj, "", frames))
+
+
+def fk_supported(src_armature, dst_armature, constrained=()):
+    """whether bake_bones_fk reproduces what the constraints would bake
+
+    The source has to be driven by quaternion fcurves alone and bones of both
+    armatures have to inherit their parents' transforms the default way.
+    Destination bones with constraints of their own, like the constrained
+    bones of the template, must not be paired in constrained or be above a
+    paired bone.
+    """
+    if src_armature.parent is not None or dst_armature.parent is not None:
+        return False
+    if src_armature.rotation_mode != rotation_mode:
+        return False
+    for fc in src_armature.animation_data.action.fcurves:
+        if not fc.data_path.startswith("pose.") or fc.data_path.endswith(
+            ("rotation_euler", "rotation_axis_angle")
+        ):
+            return False
+    for pose_bone in src_armature.pose.bones:
+        if pose_bone.constraints or pose_bone.rotation_mode != rotation_mode:
+            return False
+    bones = dst_armature.data.bones
+    index = {bone.name: i for i, bone in enumerate(bones)}
+    if not fk_retarget.constraints_allowed(
+        [index[bone.parent.name] if bone.parent else -1 for bone in bones],
+        [index[dst.name] for src, dst in constrained],
+        [
+            index[pose_bone.name]
+            for pose_bone in dst_armature.pose.bones
+            if pose_bone.constraints
+        ],
+    ):
+        return False
+    for armature in (src_armature, dst_armature):
+        for bone in armature.data.bones:
+            if (
+                not bone.use_inherit_rotation
+                or bone.inherit_scale != "FULL"
+                or not bone.use_local_location
+            ):
+                return False
+    return True
+
+
+def bake_bones_fk(
+    src_armature, dst_armature, act_name, constrained, process_later, frame_range
+):
+    """bakes all bones with forward kinematics on arrays, without evaluating the scene
+
+    Falls back to bake_bones_single_pass for armatures fk_supported rejects.
+    Bones that are not paired keep their current pose, except for bones with
+    constraints of their own, which are sampled in a single pass once the
+    paired bones are keyed.
+    """
+    if not fk_supported(src_armature, dst_armature, constrained):
+        log.warning(
+            "%s can not be baked with forward kinematics, baking it in a single pass",
+            act_name,
+        )
+        bake_bones_single_pass(
+            src_armature,
+            dst_armature,
+            act_name,
+            constrained,
+            process_later,
+            frame_range,
+        )
+        return
+
+    frames = np.arange(int(frame_range[0]), int(frame_range[1]) + 1, dtype=np.float64)
+
+    src_rest, src_parents = armature_rest(src_armature)
+    src_bones = list(src_armature.pose.bones)
+    src_basis = np.empty((len(frames), len(src_bones), 4, 4))
+    for b, pose_bone in enumerate(src_bones):
+        src_basis[:, b] = fk_retarget.compose(
+            *sample_bone_channels(src_armature, pose_bone, frames)
+        )
+    src_world = np.array(src_armature.matrix_world) @ fk_retarget.forward_kinematics(
+        src_rest, src_parents, src_basis
+    )
+
+    dst_rest, dst_parents = armature_rest(dst_armature)
+    dst_index = {
+        pose_bone.name: i for i, pose_bone in enumerate(dst_armature.pose.bones)
+    }
+    src_index = {pose_bone.name: i for i, pose_bone in enumerate(src_bones)}
+    pairs = {dst_index[dst.name]: src_index[src.name] for src, dst in constrained}
+    dst_basis = np.array(
+        [pose_bone.matrix_basis for pose_bone in dst_armature.pose.bones],
+        dtype=np.float64,
+    )
+    basis = fk_retarget.retarget(
+        src_world,
+        sample_object_matrices(dst_armature, frames),
+        dst_rest,
+        dst_parents,
+        pairs,
+        dst_basis,
+    )
+
+    if not dst_armature.animation_data:
+        dst_armature.animation_data_create()
+    if not dst_armature.animation_data.action:
+        dst_armature.animation_data.action = bpy.data.actions.new(act_name)
+    fcurves = dst_armature.animation_data.action.fcurves
+
+    # the constraints of the template may follow the paired bones, so their
+    # bones are sampled from the scene after these are keyed
+    sampled = [dst for dst in process_later if dst.constraints]
+    keyed = [dst for src, dst in constrained]
+    keyed += [dst for dst in process_later if not dst.constraints]
+    for dst in keyed:
+        locations, quats, scales = fk_retarget.decompose(basis[:, dst_index[dst.name]])
+        path = 'pose.bones["' + dst.name + '"].'
+        write_property(fcurves, path + "location", frames, locations, dst.name)
+        write_property(
+            fcurves,
+            path + "rotation_quaternion",
+            frames,
+            fix_hemisphere(quats),
+            dst.name,
+        )
+        write_property(fcurves, path + "scale", frames, scales, dst.name)
+    if sampled:
+        bake_clips_single_pass(
+            [(src_armature, dst_armature, act_name, [], sampled, frame_range)]
+        )
 
+
+def clean_keys(times, values, threshold=0.001):
+    """returns the indices of the keys bpy.ops.action.clean keeps
+
+    A key is dropped when it holds the value of the last kept key and of the
+    next key, so slow drifts below the threshold are still kept once they add
+    up to more than it.
+    """
+    keep = [0]
+    last = len(values) - 1
+    for i in range(1, len(values)):
+        prev = keep[-1]
+        if abs(times[i] - times[prev]) <= threshold:
+            continue
+        if abs(values[i] - values[prev]) > threshold:
+            keep.append(i)
+        elif i < last and abs(values[i + 1] - values[i]) > threshold:
+            keep.append(i)
+    return keep
+
+
+def clear_keyframes(dst_armature, threshold=0.001):
+    """removes redundant keyframes like bpy.ops.action.clean, without needing a dopesheet"""
     for fc in dst_armature.animation_data.action.fcurves:
-        fc.select = True
-        key_count = 0
-        for x in fc.keyframe_points:
-            x.select_control_point = True
-            key_count += 1
-        if key_count > 1:
-            bpy.ops.action.clean(channels=False)
-        for x in fc.keyframe_points:
-            x.select_control_point = False
-        fc.select = False
-
-    bpy.context.area.type = old_type
-    bpy.ops.object.mode_set(mode="OBJECT")
+        if len(fc.keyframe_points) > 1:
+            times, values = read_keyframes(fc)
+            keep = clean_keys(times.tolist(), values.tolist(), threshold)
+            if len(keep) < len(times):
+                write_keyframes(fc, times[keep], values[keep])
+
+
+def channel_groups(action):
+    """yields (data_path, fcurves sorted by array index) for every property of an action"""
+    groups = {}
+    for fc in action.fcurves:
+        groups.setdefault(fc.data_path, []).append(fc)
+    for data_path, fcurves in groups.items():
+        yield data_path, sorted(fcurves, key=lambda fc: fc.array_index)
+
+
+def read_action(action):
+    """returns the fcurves of an action as (data_path, index, group, times, values) tuples"""
+    return [
+        (fc.data_path, fc.array_index, fc.group.name if fc.group else "")
+        + read_keyframes(fc)
+        for fc in action.fcurves
+    ]
+
+
+def write_action(armature, act_name, channels):
+    """gives armature a new action act_name with the fcurves read by read_action"""
+    if not armature.animation_data:
+        armature.animation_data_create()
+    action = bpy.data.actions.new(act_name)
+    armature.animation_data.action = action
+    for data_path, index, group, times, values in channels:
+        fc = action.fcurves.new(data_path, index=index, action_group=group)
+        write_keyframes(fc, times, values)
+    return action
+
+
+def bone_name(data_path):
+    """returns the pose bone a data path animates, or '' for object channels"""
+    match = re.match(r'pose\.bones\["(.*)"\]', data_path)
+    return match.group(1) if match else ""
+
+
+def reduce_keyframes(
+    dst_armature,
+    location_tolerance=0.01,
+    rotation_tolerance=0.05,
+    scale_tolerance=0.001,
+):
+    """decimates all channels of the armature's action within the given tolerances
+
+    location_tolerance is in centimeters, rotation_tolerance in degrees and
+    measured as the angle between quaternions for quaternion channels.
+    Returns a dict per bone with the keys before and after reduction and the
+    largest location (cm), rotation (degrees) and scale error introduced.
+    """
+    # scene units are scale_length meters, location keys are in scene units
+    units_per_cm = 0.01 / bpy.context.scene.unit_settings.scale_length
+    report = {}
+    for data_path, fcurves in channel_groups(dst_armature.animation_data.action):
+        prop = data_path.rsplit(".", 1)[-1]
+        if prop == "location":
+            tolerance = location_tolerance * units_per_cm
+            error = keyframe_reducer.linear_error
+            to_report = 1.0 / units_per_cm
+        elif prop in ("rotation_quaternion", "rotation_euler", "rotation_axis_angle"):
+            prop = "rotation"
+            tolerance = np.radians(rotation_tolerance)
+            to_report = np.degrees(1.0)
+            if len(fcurves) == 4 and data_path.endswith("rotation_quaternion"):
+                error = keyframe_reducer.quaternion_error
+            else:
+                error = keyframe_reducer.linear_error
+        elif prop == "scale":
+            tolerance = scale_tolerance
+            error = keyframe_reducer.linear_error
+            to_report = 1.0
+        else:
+            continue
+
+        keys = [read_keyframes(fc) for fc in fcurves]
+        times = keys[0][0]
+        if not all(np.array_equal(t, times) for t, v in keys):
+            # channels keyed at different times are reduced one by one
+            error = keyframe_reducer.linear_error
+            channels = [([fc], t, v[:, None]) for fc, (t, v) in zip(fcurves, keys)]
+        else:
+            values = np.stack([v for t, v in keys], axis=1).astype(np.float64)
+            channels = [(fcurves, times, values)]
+
+        bone = report.setdefault(
+            bone_name(data_path),
+            {
+                "keys_before": 0,
+                "keys_after": 0,
+                "location": 0.0,
+                "rotation": 0.0,
+                "scale": 0.0,
+            },
+        )
+        for curves, times, values in channels:
+            keep = keyframe_reducer.decimate(times, values, tolerance, error)
+            err = keyframe_reducer.max_error(times, values, keep, error) * to_report
+            bone[prop] = max(bone[prop], err)
+            bone["keys_before"] += len(times) * len(curves)
+            bone["keys_after"] += len(keep) * len(curves)
+            for c, fc in enumerate(curves):
+                write_keyframes(
+                    fc, times[keep], values[keep, c], interpolation="LINEAR"
+                )
 
+    for name, bone in report.items():
+        log.debug(
+            "%s: %d -> %d keys, max error %.4f cm %.4f deg %.5f scale",
+            name or dst_armature.name,
+            bone["keys_before"],
+            bone["keys_after"],
+            bone["location"],
+            bone["rotation"],
+            bone["scale"],
+        )
+    return report
 
-def get_dst_armature(templ_path):
 
-    files = []
-    with bpy.data.libraries.load(templ_path) as (data_from, data_to):
-        for name in data_from.objects:
-            files.append({"name": name})
+clip_kinds = {
+    "rotation_quaternion": "rotation",
+    "location": "location",
+    "scale": "scale",
+}
 
-    bpy.ops.wm.append(directory=templ_path + "/Object/", files=files)
 
-    for obj in bpy.data.objects:
-        if obj.type == "ARMATURE":
-            return obj
+def sample_clip_channels(dst_armature, frames):
+    """returns (name, channels) of every pose bone for clip_format.write_clip
+
+    Channels are the bone's quaternion, location and scale fcurves linearly
+    interpolated at frames, locations converted from scene units to meters.
+    """
+    meters_per_unit = bpy.context.scene.unit_settings.scale_length
+    channels = {}
+    for data_path, fcurves in channel_groups(dst_armature.animation_data.action):
+        name = bone_name(data_path)
+        kind = clip_kinds.get(data_path.rsplit(".", 1)[-1])
+        if not name or kind is None:
+            continue
+        # channels without fcurves keep their rest value
+        values = np.tile(clip_format.rest_values[kind], (len(frames), 1))
+        for fc in fcurves:
+            values[:, fc.array_index] = np.interp(frames, *read_keyframes(fc))
+        if kind == "location":
+            values *= meters_per_unit
+        channels.setdefault(name, {})[kind] = values
+    return [
+        (bone.name, channels.get(bone.name, {})) for bone in dst_armature.pose.bones
+    ]
+
+
+def export_clip(
+    dst_armature,
+    path,
+    location_tolerance=0.01,
+    rotation_tolerance=0.05,
+    scale_tolerance=0.001,
+):
+    """writes the armature's action as a compact clip file and returns its size in bytes
+
+    Tracks that stay within the tolerances (centimeters, degrees) are stored
+    as constants.
+    """
+    start, end = dst_armature.animation_data.action.frame_range
+    frames = np.arange(int(np.floor(start)), int(np.ceil(end)) + 1, dtype=np.float64)
+    render = bpy.context.scene.render
+    return clip_format.write_clip(
+        path,
+        render.fps / render.fps_base,
+        len(frames),
+        sample_clip_channels(dst_armature, frames),
+        {
+            "rotation": np.radians(rotation_tolerance),
+            "location": location_tolerance * 0.01,
+            "scale": scale_tolerance,
+        },
+    )
+
+
+class SkeletonTemplate:
+    """objects of a skeleton template .blend, read once and instanced per clip
+
+    The loaded objects are kept out of the scene under a hidden name and with
+    a fake user, so per clip cleanup and orphan purges never touch them. Each
+    instance is an in-memory copy carrying the original names, since the
+    exported FBX takes its node names from the objects.
+    """
+
+    hidden_prefix = ".mixamo_baker_template."
+
+    def __init__(self, templ_path):
+        self.path = templ_path
+        with bpy.data.libraries.load(templ_path, link=False) as (data_from, data_to):
+            names = list(data_from.objects)
+            data_to.objects = names
+
+        # loaded objects may have been renamed on clashes, keep the names of the file
+        self.objects = []
+        self.names = {}
+        for name, obj in zip(names, data_to.objects):
+            if obj is None:
+                continue
+            obj.name = self.hidden_prefix + name
+            obj.use_fake_user = True
+            self.objects.append(obj)
+            self.names[obj.name] = name
+
+        self.datablocks = list(self.objects)
+        for obj in self.objects:
+            if obj.data is not None:
+                self.datablocks.append(obj.data)
+            for slot in obj.material_slots:
+                if slot.material is not None:
+                    self.datablocks.append(slot.material)
+            if obj.animation_data and obj.animation_data.action:
+                self.datablocks.append(obj.animation_data.action)
+
+    def owns(self, datablock):
+        return datablock in self.datablocks
+
+    def instance(self, collection=None):
+        """links a copy of the template into the scene and returns its armature
+
+        Armature data is copied so pose and animation changes stay on the copy,
+        other object data is shared with the template.
+        """
+        collection = collection or bpy.context.scene.collection
+        copies = {}
+        for obj in self.objects:
+            copy = obj.copy()
+            if obj.type == "ARMATURE":
+                copy.data = obj.data.copy()
+            copy.animation_data_clear()
+            copy.use_fake_user = False
+            copy.name = self.names[obj.name]
+            collection.objects.link(copy)
+            copies[obj.name] = copy
+
+        armature = None
+        for name, copy in copies.items():
+            if copy.parent is not None and copy.parent.name in copies:
+                copy.parent = copies[copy.parent.name]
+            for modifier in copy.modifiers:
+                if modifier.type == "ARMATURE" and modifier.object is not None:
+                    if modifier.object.name in copies:
+                        modifier.object = copies[modifier.object.name]
+            if armature is None and copy.type == "ARMATURE":
+                armature = copy
+        return armature
+
+    def free(self):
+        for obj in self.objects:
+            data = obj.data
+            bpy.data.objects.remove(obj, do_unlink=True)
+            if data is not None and data.users == 0:
+                if isinstance(data, bpy.types.Armature):
+                    bpy.data.armatures.remove(data)
+                elif isinstance(data, bpy.types.Mesh):
+                    bpy.data.meshes.remove(data)
+        self.objects = []
+        self.datablocks = []
+
+
+class TemplateSet:
+    """the skeleton templates of a list of targets, loaded side by side
+
+    Stands in for a SkeletonTemplate wherever the scene is cleared, so no
+    template's datablocks are removed.
+    """
+
+    def __init__(self, targets):
+        self.templates = {
+            target: SkeletonTemplate(target.template) for target in targets
+        }
+
+    def __getitem__(self, target):
+        return self.templates[target]
+
+    def owns(self, datablock):
+        return any(template.owns(datablock) for template in self.templates.values())
+
+    def free(self):
+        for template in self.templates.values():
+            template.free()
 
 
 def get_src_armature():
@@ -392,10 +1213,263 @@ def get_src_armature():
             return obj
 
 
-def process_batch(
-    src_dir,
+file_loaders = {
+    ".fbx": lambda filename, anim_only=False: bpy.ops.import_scene.fbx(
+        filepath=str(filename),
+        axis_forward="-Z",
+        axis_up="Y",
+        directory="",
+        filter_glob="*.fbx",
+        ui_tab="MAIN",
+        use_manual_orientation=False,
+        global_scale=1.0,
+        bake_space_transform=False,
+        use_custom_normals=not anim_only,
+        use_image_search=not anim_only,
+        use_alpha_decals=False,
+        decal_offset=0.0,
+        use_anim=True,
+        anim_offset=1.0,
+        use_custom_props=not anim_only,
+        use_custom_props_enum_as_string=True,
+        ignore_leaf_bones=True,
+        force_connect_children=False,
+        automatic_bone_orientation=False,
+        primary_bone_axis="Y",
+        secondary_bone_axis="X",
+        use_prepost_rot=True,
+    ),
+    ".dae": lambda filename, anim_only=False: bpy.ops.wm.collada_import(
+        filepath=str(filename),
+        filter_blender=False,
+        filter_backup=False,
+        filter_image=False,
+        filter_movie=False,
+        filter_python=False,
+        filter_font=False,
+        filter_sound=False,
+        filter_text=False,
+        filter_btx=False,
+        filter_collada=True,
+        filter_alembic=False,
+        filter_folder=True,
+        filter_blenlib=False,
+        filemode=8,
+        display_type="DEFAULT",
+        sort_method="FILE_SORT_ALPHA",
+        import_units=False,
+        fix_orientation=True,
+        find_chains=True,
+        auto_connect=True,
+        min_chain_length=0,
+    ),
+}
+
+
+def inside_output(path, src_dir, dst_dir):
+    """whether path is dst_dir or below it, when dst_dir is a subfolder of src_dir"""
+    dst_dir = Path(dst_dir).resolve()
+    if dst_dir == Path(src_dir).resolve():
+        return False
+    path = Path(path).resolve()
+    return path == dst_dir or dst_dir in path.parents
+
+
+def source_files(src_dir, recursive=False, dst_dir=None):
+    """yields all importable animation files in src_dir, or its whole tree with recursive
+
+    Files in dst_dir are skipped when it is a subfolder of src_dir, so baked
+    outputs are never taken for sources.
+    """
+    files = Path(src_dir).rglob("*") if recursive else Path(src_dir).iterdir()
+    for file in sorted(files):
+        if file.is_file() and file.suffix in file_loaders:
+            if recursive and dst_dir is not None:
+                if inside_output(file, src_dir, dst_dir):
+                    continue
+            yield file
+
+
+def relative_name(file, src_dir):
+    """returns the path of file below src_dir, used to identify it in journals and manifests"""
+    return Path(file).relative_to(src_dir).as_posix()
+
+
+# datablock types an import may bring in besides the armature and its action
+imported_data = ("meshes", "materials", "images", "textures", "node_groups")
+
+
+def load_source(file, anim_only=True):
+    """runs the importer for file and returns the imported armature
+
+    With anim_only, the importer skips image search, custom normals and
+    custom properties. Every non-armature object it created is removed with
+    its now unused meshes, materials and images, before anything evaluates
+    them.
+    """
+    if not anim_only:
+        file_loaders[file.suffix](file)
+        return get_src_armature()
+
+    existing = {
+        attr: {datablock.as_pointer() for datablock in getattr(bpy.data, attr)}
+        for attr in imported_data
+    }
+    file_loaders[file.suffix](file, anim_only=True)
+    src_armature = get_src_armature()
+
+    for obj in list(bpy.context.selected_objects):
+        if obj.type != "ARMATURE":
+            bpy.data.objects.remove(obj, do_unlink=True)
+    for attr in imported_data:
+        collection = getattr(bpy.data, attr)
+        for datablock in list(collection):
+            if datablock.users == 0 and datablock.as_pointer() not in existing[attr]:
+                collection.remove(datablock)
+    return src_armature
+
+
+def import_source(file, anim_cache_dir=None, anim_only=True):
+    """imports a source file and returns its armature, going through the cache if set"""
+    if not anim_cache_dir:
+        return load_source(file, anim_only)
+
+    path = anim_cache.cache_path(
+        anim_cache_dir, manifest.file_digest(file), anim_cache.import_options(anim_only)
+    )
+    if path.exists():
+        instrumentation.count("import_cached", True)
+        return anim_cache.load_armature(path)
+
+    instrumentation.count("import_cached", False)
+    src_armature = load_source(file, anim_only)
+    if src_armature is not None and src_armature.animation_data:
+        anim_cache.save_armature(path, src_armature)
+    return src_armature
+
+
+def output_path(file, dst_dir, src_root=None, output_format="FBX"):
+    """returns the output file, below the same subfolder of dst_dir as file is below src_root
+
+    The FBX file is returned when output_format writes both formats.
+    """
+    dst_dir = Path(dst_dir)
+    if src_root is not None:
+        dst_dir = dst_dir.joinpath(Path(file).parent.relative_to(src_root))
+    suffix = ".clip" if output_format == "CLIP" else ".fbx"
+    return dst_dir.joinpath(Path(file).stem + suffix)
+
+
+def output_files(file, dst_dir, src_root=None, output_format="FBX"):
+    """returns every output file written for file, see output_path"""
+    formats = ("FBX", "CLIP") if output_format == "BOTH" else (output_format,)
+    return [output_path(file, dst_dir, src_root, name) for name in formats]
+
+
+def sample_action_channels(armature):
+    """returns (data path, array index, values) of the fcurves of armature's action
+
+    Every fcurve is sampled on each frame of the action, channels are sorted
+    by data path and index.
+    """
+    action = armature.animation_data.action
+    start, end = action.frame_range
+    frames = np.arange(int(start), int(end) + 1, dtype=np.float64)
+    channels = [
+        (fc.data_path, fc.array_index, sample_fcurve(fc, frames))
+        for fc in action.fcurves
+    ]
+    return sorted(channels, key=lambda channel: channel[:2])
+
+
+def armature_rest_pose(armature):
+    """returns (name, rest matrix) of every bone of armature, sorted by name"""
+    rest, parents = armature_rest(armature)
+    names = [bone.name for bone in armature.data.bones]
+    return sorted(zip(names, rest), key=lambda bone: bone[0])
+
+
+def find_duplicate(src_armature, act_name, duplicate_index, settings_digest):
+    """fingerprints the source action and returns its clip key with the outputs of an identical clip
+
+    The outputs are None when no identical clip was baked with the same
+    settings. Call before the source is cleaned up for baking.
+    """
+    with instrumentation.stage("fingerprint"):
+        key = duplicates.clip_key(
+            duplicates.fingerprint(
+                sample_action_channels(src_armature), armature_rest_pose(src_armature)
+            ),
+            settings_digest,
+        )
+    originals = duplicate_index.lookup(key)
+    instrumentation.count("duplicate", originals is not None)
+    if originals is not None:
+        print("Duplicate : {} - {}".format(act_name, originals[0].name))
+    return key, originals
+
+
+def setup_scene(scale):
+    bpy.context.scene.unit_settings.system = "METRIC"
+    bpy.context.scene.unit_settings.scale_length = scale
+
+
+def purge_orphans():
+    """removes every datablock without users, including those only used by other orphans
+
+    The template is kept by its fake users.
+    """
+    if hasattr(bpy.data, "orphans_purge"):
+        bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+    else:
+        while True:
+            orphans = [
+                datablock
+                for datablock in bpy.data.user_map()
+                if datablock.users == 0 and not datablock.use_fake_user
+            ]
+            if not orphans:
+                break
+            bpy.data.batch_remove(orphans)
+    for library in list(bpy.data.libraries):
+        if library.users == 0:
+            bpy.data.libraries.remove(library)
+
+
+def count_keys(obj):
+    return sum(len(fc.keyframe_points) for fc in obj.animation_data.action.fcurves)
+
+
+def remove_datablocks(collection, template):
+    """removes all datablocks of a bpy.data collection except the template's"""
+    for datablock in list(collection):
+        if not template.owns(datablock):
+            collection.remove(datablock, do_unlink=True)
+
+
+def object_mode():
+    """leaves pose or edit mode, which a failed bake may have left the scene in"""
+    if bpy.context.object is not None and bpy.context.object.mode != "OBJECT":
+        bpy.ops.object.mode_set(mode="OBJECT")
+
+
+def wipe_scene(template):
+    """deletes all objects and the datablocks they used, except the template's"""
+    object_mode()
+    bpy.ops.object.select_all(action="SELECT")
+    bpy.ops.object.delete(use_global=True)
+
+    # remove all datablocks
+    remove_datablocks(bpy.data.meshes, template)
+    remove_datablocks(bpy.data.materials, template)
+    remove_datablocks(bpy.data.actions, template)
+    remove_datablocks(bpy.data.armatures, template)
+
+
+def bake_file(
+    file,
     dst_dir,
-    templ_path,
+    template,
     cbones,
     hips_to_root,
     use_x,
@@ -403,156 +1477,1135 @@ def process_batch(
     use_z,
     use_rotation,
     on_ground,
-    scale,
+    bake_mode="SINGLE_PASS",
+    keep_sparse_keys=False,
+    key_reduction="CLEAN",
+    location_tolerance=0.01,
+    rotation_tolerance=0.05,
+    scale_tolerance=0.001,
+    profile="unreal",
+    root_smoothing=0,
+    root_start_at_origin=False,
+    anim_cache_dir=None,
+    anim_only=True,
+    src_root=None,
+    output_format="FBX",
+    verify="OFF",
+    max_position_error=1.0,
+    max_rotation_error=2.0,
+    duplicate_index=None,
+    settings_digest=None,
 ):
+    """imports, bakes and exports a single source file
+
+    Returns False if the file holds no animation and nothing was exported.
+    With anim_cache_dir set, imported armatures are cached there and rebuilt
+    from the cache on later runs. output_format selects FBX, the compact
+    CLIP format of clip_format, or BOTH. With verify set to FLAG or FAIL the
+    baked clip is compared to the source, see verify_clip. With a
+    duplicates.DuplicateIndex and the manifest settings digest of the file,
+    a file whose animation was already baked with the same settings gets
+    copies of those outputs instead of being baked.
+    """
+    file = Path(file)
+
+    with instrumentation.stage("scene_wipe"):
+        wipe_scene(template)
+
+    # instance Template
+    with instrumentation.stage("template_instance"):
+        dst_armature = template.instance()
+    bpy.ops.object.select_all(action="DESELECT")
 
-    source_dir = Path(src_dir)
+    # import FBX
+    with instrumentation.stage("import"):
+        src_armature = import_source(file, anim_cache_dir, anim_only)
 
-    numfiles = 0
+    if not src_armature.animation_data:
+        return False
 
-    bpy.context.scene.unit_settings.system = "METRIC"
-    bpy.context.scene.unit_settings.scale_length = scale
+    with instrumentation.stage("rename"):
+        rename_to_profile(src_armature, profile)
 
-    for file in source_dir.iterdir():
-        if not file.is_file():
-            continue
-        file_ext = file.suffix
-        file_loader = {
-            ".fbx": lambda filename: bpy.ops.import_scene.fbx(
-                filepath=str(filename),
-                axis_forward="-Z",
-                axis_up="Y",
-                directory="",
-                filter_glob="*.fbx",
-                ui_tab="MAIN",
-                use_manual_orientation=False,
-                global_scale=1.0,
-                bake_space_transform=False,
-                use_custom_normals=True,
-                use_image_search=True,
-                use_alpha_decals=False,
-                decal_offset=0.0,
-                use_anim=True,
-                anim_offset=1.0,
-                use_custom_props=True,
-                use_custom_props_enum_as_string=True,
-                ignore_leaf_bones=True,
-                force_connect_children=False,
-                automatic_bone_orientation=False,
-                primary_bone_axis="Y",
-                secondary_bone_axis="X",
-                use_prepost_rot=True,
-            ),
-            ".dae": lambda filename: bpy.ops.wm.collada_import(
-                filepath=str(filename),
-                filter_blender=False,
-                filter_backup=False,
-                filter_image=False,
-                filter_movie=False,
-                filter_python=False,
-                filter_font=False,
-                filter_sound=False,
-                filter_text=False,
-                filter_btx=False,
-                filter_collada=True,
-                filter_alembic=False,
-                filter_folder=True,
-                filter_blenlib=False,
-                filemode=8,
-                display_type="DEFAULT",
-                sort_method="FILE_SORT_ALPHA",
-                import_units=False,
-                fix_orientation=True,
-                find_chains=True,
-                auto_connect=True,
-                min_chain_length=0,
-            ),
-        }
+    act_name = file.stem.replace(" ", "_")
 
-        if not file_ext in file_loader:
-            continue
-        numfiles += 1
+    if duplicate_index is not None:
+        clip_key, originals = find_duplicate(
+            src_armature, act_name, duplicate_index, settings_digest
+        )
+        if originals is not None:
+            duplicate_index.reuse(
+                originals, output_files(file, dst_dir, src_root, output_format)
+            )
+            with instrumentation.stage("scene_wipe"):
+                wipe_scene(template)
+            with instrumentation.stage("purge"):
+                purge_orphans()
+            return True
+
+    # Bake
+    bake_bones(
+        src_armature,
+        dst_armature,
+        act_name,
+        cbones,
+        hips_to_root,
+        use_x,
+        use_y,
+        use_z,
+        use_rotation,
+        on_ground,
+        bake_mode,
+        keep_sparse_keys,
+        profile,
+        root_smoothing,
+        root_start_at_origin,
+    )
+
+    if verify != "OFF":
+        with instrumentation.stage("verify_sample_source"):
+            names, src_names, hips, frames = verify_bones(
+                src_armature, dst_armature, cbones, profile
+            )
+            src_world = sample_world_matrices(src_armature, src_names, frames)
+
+    bpy.ops.object.select_all(action="SELECT")
+    dst_armature.select_set(False)
+    bpy.context.view_layer.objects.active = src_armature
+    bpy.ops.object.delete(use_global=True)
 
-        bpy.ops.object.select_all(action="SELECT")
-        bpy.ops.object.delete(use_global=True)
+    # remove all datablocks
+    remove_datablocks(bpy.data.meshes, template)
+    remove_datablocks(bpy.data.materials, template)
 
-        # remove all datablocks
-        for mesh in bpy.data.meshes:
-            bpy.data.meshes.remove(mesh, do_unlink=True)
-        for material in bpy.data.materials:
-            bpy.data.materials.remove(material, do_unlink=True)
-        for action in bpy.data.actions:
+    for action in bpy.data.actions:
+        if action != dst_armature.animation_data.action and not template.owns(action):
+            print("Deleting Action: " + action.name)
             bpy.data.actions.remove(action, do_unlink=True)
+    for armature in bpy.data.armatures:
+        if armature != dst_armature.data and not template.owns(armature):
+            bpy.data.armatures.remove(armature, do_unlink=True)
+
+    verification = None
+    if verify != "OFF":
+        verification = names, hips, frames, src_world
+    exported = finish_clip(
+        file,
+        dst_dir,
+        template,
+        dst_armature,
+        act_name,
+        key_reduction,
+        location_tolerance,
+        rotation_tolerance,
+        scale_tolerance,
+        src_root,
+        output_format,
+        verify,
+        verification,
+        max_position_error,
+        max_rotation_error,
+    )
+    if duplicate_index is not None:
+        duplicate_index.add(
+            clip_key, output_files(file, dst_dir, src_root, output_format)
+        )
+    return exported
 
-        # import Template
-        dst_armature = get_dst_armature(templ_path)
-        bpy.ops.object.select_all(action="DESELECT")
 
-        # import FBX
-        file_loader[file_ext](file)
-        src_armature = get_src_armature()
+def replace_output(path, write):
+    """calls write with a temporary file next to path and moves it over path once written
+
+    Other hard links to the previous output, see duplicates.py, keep their
+    content, and an interrupted export never leaves a truncated output.
+    Returns what write returns.
+    """
+    path = Path(path)
+    # exporters add their extension to paths without it
+    tmp = path.with_name(path.stem + ".tmp" + path.suffix)
+    result = write(tmp)
+    os.replace(tmp, path)
+    return result
+
 
+def finish_clip(
+    file,
+    dst_dir,
+    template,
+    dst_armature,
+    act_name,
+    key_reduction="CLEAN",
+    location_tolerance=0.01,
+    rotation_tolerance=0.05,
+    scale_tolerance=0.001,
+    src_root=None,
+    output_format="FBX",
+    verify="OFF",
+    verification=None,
+    max_position_error=1.0,
+    max_rotation_error=2.0,
+):
+    """reduces, verifies and exports the baked destination armature, then clears the scene
+
+    verification holds the bone names, hips index, frames and source world
+    matrices sampled for verify_clip.
+    """
+    instrumentation.add("keys_before", count_keys(dst_armature))
+    if key_reduction == "DECIMATE":
+        with instrumentation.stage("clear_keyframes"):
+            report = reduce_keyframes(
+                dst_armature, location_tolerance, rotation_tolerance, scale_tolerance
+            )
+        print(
+            "Reduced : {} - {} -> {} keys - max error {:.4f} cm {:.4f} deg".format(
+                act_name,
+                sum(bone["keys_before"] for bone in report.values()),
+                sum(bone["keys_after"] for bone in report.values()),
+                max((bone["location"] for bone in report.values()), default=0.0),
+                max((bone["rotation"] for bone in report.values()), default=0.0),
+            )
+        )
+    else:
+        with instrumentation.stage("clear_keyframes"):
+            clear_keyframes(dst_armature)
+    instrumentation.add("keys_after", count_keys(dst_armature))
+
+    if verify != "OFF":
+        names, hips, frames, src_world = verification
+        with instrumentation.stage("verify"):
+            verify_clip(
+                act_name,
+                src_world,
+                sample_world_matrices(dst_armature, names, frames),
+                names,
+                hips,
+                max_position_error,
+                max_rotation_error,
+                fail=verify == "FAIL",
+            )
+
+    # Export
+    output_file = output_path(file, dst_dir, src_root)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    if output_format in ("FBX", "BOTH"):
+        with instrumentation.stage("export"):
+            replace_output(
+                output_file,
+                lambda path: bpy.ops.export_scene.fbx(
+                    filepath=str(path),
+                    use_selection=False,
+                    apply_unit_scale=True,
+                    add_leaf_bones=False,
+                    axis_forward="-Z",
+                    axis_up="Y",
+                    mesh_smooth_type="FACE",
+                    use_armature_deform_only=True,
+                ),
+            )
+    if output_format in ("CLIP", "BOTH"):
+        with instrumentation.stage("export_clip"):
+            clip_bytes = replace_output(
+                output_path(file, dst_dir, src_root, "CLIP"),
+                lambda path: export_clip(
+                    dst_armature,
+                    path,
+                    location_tolerance,
+                    rotation_tolerance,
+                    scale_tolerance,
+                ),
+            )
+        instrumentation.add("clip_bytes", clip_bytes)
+
+    # Cleanup
+    bpy.ops.object.select_all(action="SELECT")
+    bpy.ops.object.delete(use_global=False)
+
+    remove_datablocks(bpy.data.actions, template)
+    remove_datablocks(bpy.data.armatures, template)
+    with instrumentation.stage("purge"):
+        purge_orphans()
+
+    return True
+
+
+def bake_files(
+    files,
+    dst_dir,
+    template,
+    cbones,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    bake_mode="SINGLE_PASS",
+    keep_sparse_keys=False,
+    key_reduction="CLEAN",
+    location_tolerance=0.01,
+    rotation_tolerance=0.05,
+    scale_tolerance=0.001,
+    profile="unreal",
+    root_smoothing=0,
+    root_start_at_origin=False,
+    anim_cache_dir=None,
+    anim_only=True,
+    src_root=None,
+    output_format="FBX",
+    verify="OFF",
+    max_position_error=1.0,
+    max_rotation_error=2.0,
+    duplicate_index=None,
+    settings_digest=None,
+):
+    """bakes several source files in one timeline sweep, like bake_file does for one
+
+    All files are imported side by side, each with its own template instance,
+    and their bones are sampled together with bake_clips_single_pass. The
+    baked actions are then kept as arrays while the scene is wiped, and every
+    clip is exported from a fresh template instance so its output matches
+    bake_file. Always bakes in SINGLE_PASS mode.
+
+    Returns a dict of files to whether they were exported. A file whose
+    reduction, verification or export failed is logged and left out, as is
+    a duplicate of such a file.
+    """
+    files = [Path(file) for file in files]
+    baked = {}
+    clip_keys = {}
+    repeats = []
+
+    with instrumentation.stage("scene_wipe"):
+        wipe_scene(template)
+
+    clips = []
+    for file in files:
+        with instrumentation.stage("template_instance"):
+            dst_armature = template.instance()
+        bpy.ops.object.select_all(action="DESELECT")
+
+        with instrumentation.stage("import"):
+            src_armature = import_source(file, anim_cache_dir, anim_only)
         if not src_armature.animation_data:
+            baked[file] = False
             continue
 
-        rename_to_unreal(src_armature)
-
+        with instrumentation.stage("rename"):
+            rename_to_profile(src_armature, profile)
         act_name = file.stem.replace(" ", "_")
 
-        # Bake
-        bake_bones(
-            src_armature,
-            dst_armature,
+        if duplicate_index is not None:
+            clip_key, originals = find_duplicate(
+                src_armature, act_name, duplicate_index, settings_digest
+            )
+            if originals is not None or clip_key in clip_keys.values():
+                # keep it out of the sweep
+                bpy.data.objects.remove(src_armature, do_unlink=True)
+                if originals is None:
+                    repeats.append((file, clip_key))
+                    continue
+                duplicate_index.reuse(
+                    originals, output_files(file, dst_dir, src_root, output_format)
+                )
+                baked[file] = True
+                continue
+            clip_keys[file] = clip_key
+        clips.append((file, src_armature, dst_armature, act_name))
+
+    prepared = []
+    for file, src_armature, dst_armature, act_name in clips:
+        object_mode()
+        prepared.append(
+            (src_armature, dst_armature, act_name)
+            + prepare_bones(
+                src_armature,
+                dst_armature,
+                act_name,
+                cbones,
+                hips_to_root,
+                use_x,
+                use_y,
+                use_z,
+                use_rotation,
+                on_ground,
+                "SINGLE_PASS",
+                keep_sparse_keys,
+                profile,
+                root_smoothing,
+                root_start_at_origin,
+            )
+        )
+    instrumentation.count(
+        "frames", sum(int(p[5][1]) - int(p[5][0]) + 1 for p in prepared)
+    )
+    with instrumentation.stage("bake_bones"):
+        bake_clips_single_pass(prepared)
+
+    baked_clips = []
+    for file, src_armature, dst_armature, act_name in clips:
+        finish_bones(dst_armature, act_name, keep_sparse_keys)
+        verification = None
+        if verify != "OFF":
+            with instrumentation.stage("verify_sample_source"):
+                names, src_names, hips, frames = verify_bones(
+                    src_armature, dst_armature, cbones, profile
+                )
+                src_world = sample_world_matrices(src_armature, src_names, frames)
+            verification = names, hips, frames, src_world
+        baked_clips.append(
+            (
+                file,
+                act_name,
+                read_action(dst_armature.animation_data.action),
+                verification,
+            )
+        )
+
+    with instrumentation.stage("scene_wipe"):
+        wipe_scene(template)
+
+    for file, act_name, channels, verification in baked_clips:
+        with instrumentation.stage("template_instance"):
+            dst_armature = template.instance()
+        write_action(dst_armature, act_name, channels)
+        try:
+            baked[file] = finish_clip(
+                file,
+                dst_dir,
+                template,
+                dst_armature,
+                act_name,
+                key_reduction,
+                location_tolerance,
+                rotation_tolerance,
+                scale_tolerance,
+                src_root,
+                output_format,
+                verify,
+                verification,
+                max_position_error,
+                max_rotation_error,
+            )
+        except Exception:
+            log.exception("exporting %s failed", file.name)
+            wipe_scene(template)
+            continue
+        if file in clip_keys:
+            duplicate_index.add(
+                clip_keys[file], output_files(file, dst_dir, src_root, output_format)
+            )
+
+    # files identical to another one of the group
+    for file, clip_key in repeats:
+        originals = duplicate_index.lookup(clip_key)
+        if originals is not None:
+            duplicate_index.reuse(
+                originals, output_files(file, dst_dir, src_root, output_format)
+            )
+            baked[file] = True
+    return baked
+
+
+def scaled_matrix(matrix, factor):
+    """returns the 4x4 matrix scaled by factor about the origin"""
+    return np.diag((factor, factor, factor, 1.0)) @ np.asarray(matrix)
+
+
+def bake_file_targets(
+    file,
+    dst_dir,
+    templates,
+    targets,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    bake_mode="SINGLE_PASS",
+    keep_sparse_keys=False,
+    key_reduction="CLEAN",
+    location_tolerance=0.01,
+    rotation_tolerance=0.05,
+    scale_tolerance=0.001,
+    profile="unreal",
+    root_smoothing=0,
+    root_start_at_origin=False,
+    anim_cache_dir=None,
+    anim_only=True,
+    src_root=None,
+    output_format="FBX",
+    verify="OFF",
+    max_position_error=1.0,
+    max_rotation_error=2.0,
+):
+    """imports a source file once and bakes and exports it for every target, like bake_file
+
+    targets is a list of fan_out.Target and templates the TemplateSet they
+    are loaded in. The source is imported at the scene unit scale, renamed
+    and cleaned up once, then scaled to the scale of each target and baked
+    onto an instance of its template with its constrained bones. The baked
+    actions are kept as arrays while the scene is wiped, and every clip is
+    exported at the scale of its target from a fresh instance into the
+    target's subfolder of dst_dir, as bake_files does.
+
+    Returns False if the file holds no animation and nothing was exported.
+    """
+    file = Path(file)
+    instrumentation.count("targets", len(targets))
+
+    with instrumentation.stage("scene_wipe"):
+        wipe_scene(templates)
+
+    with instrumentation.stage("import"):
+        src_armature = import_source(file, anim_cache_dir, anim_only)
+    if not src_armature.animation_data:
+        return False
+
+    with instrumentation.stage("rename"):
+        rename_to_profile(src_armature, profile)
+
+    act_name = file.stem.replace(" ", "_")
+
+    import_scale = bpy.context.scene.unit_settings.scale_length
+    src_matrix = np.array(src_armature.matrix_world)
+    try:
+        baked_clips = []
+        for index, target in enumerate(targets):
+            # as if the source had been imported at the scale of the target
+            setup_scene(target.scale)
+            src_armature.matrix_world = scaled_matrix(
+                src_matrix, target.source_factor(import_scale)
+            ).tolist()
+            with instrumentation.stage("template_instance"):
+                dst_armature = templates[target].instance()
+            object_mode()
+            bpy.ops.object.select_all(action="DESELECT")
+
+            bake_bones(
+                src_armature,
+                dst_armature,
+                act_name,
+                target.cbones,
+                hips_to_root,
+                use_x,
+                use_y,
+                use_z,
+                use_rotation,
+                on_ground,
+                bake_mode,
+                keep_sparse_keys,
+                profile,
+                root_smoothing,
+                root_start_at_origin,
+                clean_source=index == 0,
+            )
+
+            verification = None
+            if verify != "OFF":
+                with instrumentation.stage("verify_sample_source"):
+                    names, src_names, hips, frames = verify_bones(
+                        src_armature, dst_armature, target.cbones, profile
+                    )
+                    src_world = sample_world_matrices(src_armature, src_names, frames)
+                verification = names, hips, frames, src_world
+            baked_clips.append(
+                (target, read_action(dst_armature.animation_data.action), verification)
+            )
+
+        with instrumentation.stage("scene_wipe"):
+            wipe_scene(templates)
+
+        for target, channels, verification in baked_clips:
+            setup_scene(target.scale)
+            with instrumentation.stage("template_instance"):
+                dst_armature = templates[target].instance()
+            write_action(dst_armature, act_name, channels)
+            finish_clip(
+                file,
+                target.output_dir(dst_dir),
+                templates,
+                dst_armature,
+                act_name,
+                key_reduction,
+                location_tolerance,
+                rotation_tolerance,
+                scale_tolerance,
+                src_root,
+                output_format,
+                verify,
+                verification,
+                max_position_error,
+                max_rotation_error,
+            )
+    finally:
+        # the next source is imported at the batch scale again
+        setup_scene(import_scale)
+    return True
+
+
+def bake_file_recorded(
+    file, dst_dir, template, cbones, cprofile_file=None, bake=bake_file, **options
+):
+    """runs bake_file and returns its result with the file's report row
+
+    The file named cprofile_file is baked under cProfile and its stats are
+    dumped next to its output. bake_file_targets can be passed as bake, with
+    the templates and targets in place of template and cbones.
+    """
+    file = Path(file)
+    if file.name == cprofile_file:
+        bake = functools.partial(
+            instrumentation.profiled,
+            Path(dst_dir).joinpath(file.stem + ".prof"),
+            bake,
+        )
+    instrumentation.begin_file(file)
+    try:
+        baked = bake(file, dst_dir, template, cbones, **options)
+    finally:
+        row = instrumentation.end_file()
+    return baked, row
+
+
+def bake_files_recorded(files, dst_dir, template, cbones, **options):
+    """runs bake_files and returns its result with one report row for all files"""
+    instrumentation.begin_file(
+        "{} (+{} files)".format(Path(files[0]).name, len(files) - 1)
+    )
+    instrumentation.count("clips", len(files))
+    try:
+        baked = bake_files(files, dst_dir, template, cbones, **options)
+    finally:
+        row = instrumentation.end_file()
+    return baked, row
+
+
+def verify_bones(src_armature, dst_armature, cbones, profile="unreal"):
+    """returns the destination and source names of the bones verify_clip compares
+
+    These are the paired deform bones the bake keys, constrained bones are
+    left out. Also returns the index of the hips among them, or None, and the
+    frames of the source action.
+    """
+    pairs = retarget_profiles.load_profile(profile).pair_bones(
+        src_armature, dst_armature
+    )
+    names = []
+    src_names = []
+    for dst in dst_armature.pose.bones:
+        src = pairs.get(dst.name)
+        if dst.bone.use_deform and src and dst.name not in cbones.split():
+            names.append(dst.name)
+            src_names.append(src.name)
+    start, end = src_armature.animation_data.action.frame_range
+    frames = np.arange(int(start), int(end) + 1)
+    try:
+        hips = src_names.index(find_hips(src_armature).name)
+    except ValueError:
+        # no hips, or hips that are not baked
+        hips = None
+    return names, src_names, hips, frames
+
+
+def sample_world_matrices(armature, names, frames):
+    """returns the (frames, bones, 4, 4) world matrices of the named pose bones"""
+    pose_bones = armature.pose.bones
+    index = [pose_bones.find(name) for name in names]
+    buffer = np.empty(len(pose_bones) * 16, dtype=np.float32)
+    matrices = np.empty((len(frames), len(names), 4, 4))
+
+    scene = bpy.context.scene
+    frame_current = scene.frame_current
+    for f, frame in enumerate(frames):
+        scene.frame_set(int(frame))
+        # foreach_get flattens matrices column by column
+        pose_bones.foreach_get("matrix", buffer)
+        pose = buffer.reshape(-1, 4, 4).transpose(0, 2, 1)[index]
+        matrices[f] = np.array(armature.matrix_world) @ pose
+    scene.frame_set(frame_current)
+    return matrices
+
+
+def verify_clip(
+    act_name,
+    src_world,
+    dst_world,
+    names,
+    hips,
+    max_position_error=1.0,
+    max_rotation_error=2.0,
+    fail=False,
+):
+    """compares sampled source and baked joints and flags clips above the limits
+
+    Limits are in centimeters and degrees. With fail an AccuracyError is
+    raised instead of a warning, so the clip is not exported.
+    """
+    units_per_cm = 0.01 / bpy.context.scene.unit_settings.scale_length
+    position, rotation = accuracy.joint_errors(src_world, dst_world, hips)
+    summary = accuracy.summarize(names, position / units_per_cm, np.degrees(rotation))
+    if not summary["bones"]:
+        log.warning("%s has no baked bones paired with the source to verify", act_name)
+        return summary
+    instrumentation.peak("position_error_cm", summary["position"])
+    instrumentation.peak("rotation_error_deg", summary["rotation"])
+    print(
+        "Verified : {} - max error {:.4f} cm ({}) {:.4f} deg ({})".format(
             act_name,
-            cbones,
-            hips_to_root,
-            use_x,
-            use_y,
-            use_z,
-            use_rotation,
-            on_ground,
+            summary["position"],
+            summary["position_bone"],
+            summary["rotation"],
+            summary["rotation_bone"],
         )
+    )
+    if (
+        summary["position"] <= max_position_error
+        and summary["rotation"] <= max_rotation_error
+    ):
+        return summary
 
-        bpy.ops.object.select_all(action="SELECT")
-        dst_armature.select_set(False)
-        bpy.context.view_layer.objects.active = src_armature
-        bpy.ops.object.delete(use_global=True)
-
-        # remove all datablocks
-        for mesh in bpy.data.meshes:
-            bpy.data.meshes.remove(mesh, do_unlink=True)
-        for material in bpy.data.materials:
-            bpy.data.materials.remove(material, do_unlink=True)
-
-        for action in bpy.data.actions:
-            if action != dst_armature.animation_data.action:
-                print("Deleting Action: " + action.name)
-                bpy.data.actions.remove(action, do_unlink=True)
-        for armature in bpy.data.armatures:
-            if armature != dst_armature.data:
-                bpy.data.armatures.remove(armature, do_unlink=True)
-
-        clear_keyframes(dst_armature)
-
-        # Export
-        dst_dir = Path(dst_dir)
-        output_file = dst_dir.joinpath(file.stem + ".fbx")
-        bpy.ops.export_scene.fbx(
-            filepath=str(output_file),
-            use_selection=False,
-            apply_unit_scale=True,
-            add_leaf_bones=False,
-            axis_forward="-Z",
-            axis_up="Y",
-            mesh_smooth_type="FACE",
-            use_armature_deform_only=True,
+    message = "%s is off by %.4f cm at %s and %.4f deg at %s" % (
+        act_name,
+        summary["position"],
+        summary["position_bone"],
+        summary["rotation"],
+        summary["rotation_bone"],
+    )
+    instrumentation.add("accuracy_flagged", 1)
+    if fail:
+        raise accuracy.AccuracyError(message)
+    log.warning(message)
+    return summary
+
+
+def limit_memory(template, templ_path, memory_limit_mb, name):
+    """reports memory use after baking name and reloads the template when it is above memory_limit_mb
+
+    template may also be a TemplateSet with the targets it was loaded from as
+    templ_path. Returns the template to bake the next file with.
+    """
+    rss = instrumentation.current_rss() / (1 << 20)
+    print("Memory : {} - {:.0f} MB".format(name, rss))
+    if memory_limit_mb and rss > memory_limit_mb:
+        # a session can't restart itself, start over with a fresh template instead
+        log.warning(
+            "memory use of %.0f MB is above the limit of %d MB, reloading the template",
+            rss,
+            memory_limit_mb,
         )
+        template.free()
+        purge_orphans()
+        gc.collect()
+        template = type(template)(templ_path)
+    return template
 
-        # Cleanup
-        bpy.ops.object.select_all(action="SELECT")
-        bpy.ops.object.delete(use_global=False)
 
-        for action in bpy.data.actions:
-            bpy.data.actions.remove(action, do_unlink=True)
+def iter_batch(
+    src_dir,
+    dst_dir,
+    templ_path,
+    cbones,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    scale,
+    incremental=False,
+    cprofile_file=None,
+    memory_limit_mb=0,
+    recursive=False,
+    resume=False,
+    clips_per_pass=1,
+    rules_file=None,
+    duplicate_mode="OFF",
+    **options
+):
+    """bakes every file of src_dir, options are passed on to bake_file
+
+    Stage timings and counters of every file are written to bake_report.json
+    and bake_report.csv in dst_dir. Orphan data is purged after every file,
+    and when memory use still grows over memory_limit_mb the template is
+    freed and loaded again. Restarting the whole session is only possible
+    for background workers, see parallel.process_batch_parallel.
+
+    Progress is recorded in a journal in dst_dir, resume continues the batch
+    the journal belongs to. With recursive, files in subfolders are baked as
+    well and their outputs written to the same subfolders of dst_dir. With
+    clips_per_pass above 1, that many files with the same settings are baked
+    together by bake_files, falling back to one at a time for files it could
+    not bake. Options of single files are overridden by the rules of
+    rules_file and their sidecar files, see rules.py. With duplicate_mode
+    COPY or LINK, files holding an animation that was already baked with the
+    same settings get copies of, or links to, its outputs, see duplicates.py.
+
+    templ_path may also be a fan_out targets file or a list of targets, the
+    batch is then run by iter_batch_targets.
+
+    This is a generator yielding a progress dict with the number of files
+    done, the total, the files about to be baked and the current stage before
+    every bake, so callers can interleave other work. Closing it stops the
+    batch after the current file. It returns the number of files converted,
+    or -1 if any file failed.
+    """
+    targets = fan_out.resolve_targets(templ_path, cbones, scale)
+    if targets is not None:
+        if duplicate_mode != "OFF":
+            log.warning("duplicates are not detected when baking several targets")
+        return (
+            yield from iter_batch_targets(
+                src_dir,
+                dst_dir,
+                targets,
+                hips_to_root,
+                use_x,
+                use_y,
+                use_z,
+                use_rotation,
+                on_ground,
+                scale,
+                incremental,
+                cprofile_file,
+                memory_limit_mb,
+                recursive,
+                resume,
+                rules_file,
+                **options
+            )
+        )
+
+    numfiles = 0
+    uptodate = 0
+    failed = 0
+    rows = []
+
+    setup_scene(scale)
+
+    settings = dict(
+        options,
+        hips_to_root=hips_to_root,
+        use_x=use_x,
+        use_y=use_y,
+        use_z=use_z,
+        use_rotation=use_rotation,
+        on_ground=on_ground,
+    )
+
+    files = {
+        relative_name(file, src_dir): file
+        for file in source_files(src_dir, recursive, dst_dir)
+    }
+    overrides = rules.resolve_files(src_dir, files, rules_file)
+    file_settings = rules.file_settings(settings, overrides)
+    duplicate_index = duplicates.open_index(dst_dir, duplicate_mode)
+    if incremental:
+        clips = manifest.load_manifest(dst_dir)
+    if incremental or duplicate_index is not None:
+        settings_digests = rules.settings_digests(
+            templ_path, cbones, scale, settings, overrides
+        )
+    else:
+        settings_digests = {}
+    batch = journal.Journal(dst_dir, resume)
+    remaining = batch.remaining(list(files))
+
+    total = len(remaining)
+    template = None
+
+    try:
+        yield {"done": 0, "total": total, "file": None, "stage": "loading template"}
+        template_start = time.perf_counter()
+        template = SkeletonTemplate(templ_path)
+        rows.append(
+            {"file": templ_path, "template_load": time.perf_counter() - template_start}
+        )
+
+        outputs = {}
+        digests = {}
+        pending = []
+        for key in remaining:
+            outputs[key] = output_path(
+                files[key],
+                dst_dir,
+                src_dir,
+                file_settings[key].get("output_format", "FBX"),
+            )
+            if incremental:
+                digests[key] = manifest.file_digest(files[key])
+                if manifest.is_up_to_date(
+                    clips, key, digests[key], settings_digests[key], outputs[key]
+                ):
+                    uptodate += 1
+                    batch.mark(key, "skipped")
+                    continue
+            pending.append(key)
+
+        done = 0
+        for group in rules.group_files(pending, file_settings, clips_per_pass):
+            yield {
+                "done": done,
+                "total": len(pending),
+                "file": (
+                    group[0]
+                    if len(group) == 1
+                    else "{} (+{} files)".format(group[0], len(group) - 1)
+                ),
+                "stage": "baking",
+            }
+            numfiles += len(group)
+            for key in group:
+                batch.mark(key, "started")
+
+            converted = {}
+            if len(group) > 1:
+                try:
+                    baked, row = bake_files_recorded(
+                        [files[key] for key in group],
+                        dst_dir,
+                        template,
+                        cbones,
+                        src_root=src_dir,
+                        duplicate_index=duplicate_index,
+                        settings_digest=settings_digests.get(group[0]),
+                        **file_settings[group[0]]
+                    )
+                except Exception:
+                    log.exception(
+                        "baking %s and %d more in one pass failed, baking them one by one",
+                        group[0],
+                        len(group) - 1,
+                    )
+                    object_mode()
+                else:
+                    rows.append(row)
+                    converted = {
+                        key: baked[files[key]] for key in group if files[key] in baked
+                    }
+
+            # single files, and files the batched bake could not finish
+            for key in group:
+                if key not in converted:
+                    try:
+                        converted[key], row = bake_file_recorded(
+                            files[key],
+                            dst_dir,
+                            template,
+                            cbones,
+                            cprofile_file,
+                            src_root=src_dir,
+                            duplicate_index=duplicate_index,
+                            settings_digest=settings_digests.get(key),
+                            **file_settings[key]
+                        )
+                    except Exception:
+                        log.exception("baking %s failed", key)
+                        batch.mark(key, "failed", traceback.format_exc())
+                        failed += 1
+                        object_mode()
+                        continue
+                    rows.append(row)
+                batch.mark(key, "done" if converted[key] else "skipped")
+
+                if converted[key] and incremental:
+                    manifest.record(
+                        clips, key, digests[key], settings_digests[key], outputs[key]
+                    )
+                    manifest.save_manifest(dst_dir, clips)
+
+            if duplicate_index is not None:
+                duplicate_index.save()
+            done += len(group)
+            template = limit_memory(template, templ_path, memory_limit_mb, group[-1])
+    finally:
+        # also runs when the batch is cancelled by closing the generator
+        if template is not None:
+            template.free()
+        batch.close()
+        instrumentation.write_report(dst_dir, rows)
+
+    if incremental:
+        print("{} files up to date".format(uptodate))
+    if failed:
+        return -1
+    return numfiles
 
+
+def iter_batch_targets(
+    src_dir,
+    dst_dir,
+    targets,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    scale,
+    incremental=False,
+    cprofile_file=None,
+    memory_limit_mb=0,
+    recursive=False,
+    resume=False,
+    rules_file=None,
+    **options
+):
+    """bakes every file of src_dir onto several skeleton templates, see iter_batch
+
+    Each file is imported once at scale and baked for every fan_out.Target by
+    bake_file_targets at the scale of the target. The journal and report are
+    kept in dst_dir, with incremental every target's subfolder keeps its own
+    manifest and a file is only baked for the targets whose output is out of
+    date.
+    """
+    numfiles = 0
+    uptodate = 0
+    failed = 0
+    rows = []
+
+    setup_scene(scale)
+
+    settings = dict(
+        options,
+        hips_to_root=hips_to_root,
+        use_x=use_x,
+        use_y=use_y,
+        use_z=use_z,
+        use_rotation=use_rotation,
+        on_ground=on_ground,
+    )
+
+    files = {
+        relative_name(file, src_dir): file
+        for file in source_files(src_dir, recursive, dst_dir)
+    }
+    overrides = rules.resolve_files(src_dir, files, rules_file)
+    file_settings = rules.file_settings(settings, overrides)
+    if incremental:
+        clips = {
+            target: manifest.load_manifest(target.output_dir(dst_dir))
+            for target in targets
+        }
+        settings_digests = {
+            target: rules.settings_digests(
+                target.template, target.cbones, target.scale, settings, overrides
+            )
+            for target in targets
+        }
+    batch = journal.Journal(dst_dir, resume)
+    remaining = batch.remaining(list(files))
+    templates = None
+
+    try:
+        yield {
+            "done": 0,
+            "total": len(remaining),
+            "file": None,
+            "stage": "loading templates",
+        }
+        template_start = time.perf_counter()
+        templates = TemplateSet(targets)
+        rows.append(
+            {
+                "file": ", ".join(target.template for target in targets),
+                "template_load": time.perf_counter() - template_start,
+            }
+        )
+
+        for done, key in enumerate(remaining):
+            yield {
+                "done": done,
+                "total": len(remaining),
+                "file": key,
+                "stage": "baking",
+            }
+            stale = targets
+            if incremental:
+                source_digest = manifest.file_digest(files[key])
+                stale = [
+                    target
+                    for target in targets
+                    if not manifest.is_up_to_date(
+                        clips[target],
+                        key,
+                        source_digest,
+                        settings_digests[target][key],
+                        output_path(
+                            files[key],
+                            target.output_dir(dst_dir),
+                            src_dir,
+                            file_settings[key].get("output_format", "FBX"),
+                        ),
+                    )
+                ]
+                if not stale:
+                    uptodate += 1
+                    batch.mark(key, "skipped")
+                    continue
+
+            batch.mark(key, "started")
+            try:
+                converted, row = bake_file_recorded(
+                    files[key],
+                    dst_dir,
+                    templates,
+                    stale,
+                    cprofile_file,
+                    bake=bake_file_targets,
+                    src_root=src_dir,
+                    **file_settings[key]
+                )
+            except Exception:
+                log.exception("baking %s failed", key)
+                batch.mark(key, "failed", traceback.format_exc())
+                failed += 1
+                object_mode()
+                continue
+            rows.append(row)
+            batch.mark(key, "done" if converted else "skipped")
+            if converted:
+                numfiles += 1
+
+            if converted and incremental:
+                for target in stale:
+                    manifest.record(
+                        clips[target],
+                        key,
+                        source_digest,
+                        settings_digests[target][key],
+                        output_path(
+                            files[key],
+                            target.output_dir(dst_dir),
+                            src_dir,
+                            file_settings[key].get("output_format", "FBX"),
+                        ),
+                    )
+                    manifest.save_manifest(target.output_dir(dst_dir), clips[target])
+
+            templates = limit_memory(templates, targets, memory_limit_mb, key)
+    finally:
+        if templates is not None:
+            templates.free()
+        batch.close()
+        instrumentation.write_report(dst_dir, rows)
+
+    if incremental:
+        print("{} files up to date".format(uptodate))
+    if failed:
+        return -1
     return numfiles
+
+
+def run_batch(batch):
+    """runs a batch generator to the end and returns its result"""
+    while True:
+        try:
+            next(batch)
+        except StopIteration as end:
+            return end.value
+
+
+def process_batch(*args, **options):
+    """bakes every file of src_dir, see iter_batch for the arguments"""
+    return run_batch(iter_batch(*args, **options))
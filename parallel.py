@@ -0,0 +1,338 @@
+from pathlib import Path
+import json
+import logging
+import shutil
+import subprocess
+import tempfile
+import time
+import bpy
+from . import duplicates
+from . import instrumentation
+from . import journal
+from . import manifest
+from . import mixamo_baker
+from . import rules
+from . import worker
+
+log = logging.getLogger(__name__)
+worker_script = Path(__file__).resolve().parent.joinpath("worker.py")
+
+
+def read_results(path):
+    """returns the last recorded status per file of a worker result file"""
+    results = {}
+    if not Path(path).exists():
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # partial line written by a worker that died mid-write
+                continue
+            results[entry["file"]] = entry
+    return results
+
+
+class ResultTail:
+    """reads the entries a running worker appends to its result file as they come in"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset = 0
+
+    def read(self):
+        """returns the entries of the lines completed since the last read"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        # the last line may still be written, keep it for the next read
+        complete = data[: data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        entries = []
+        for line in complete.splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # partial line written by a worker that died mid-write
+                continue
+        return entries
+
+
+def start_worker(blender, job_dir, index, files, job):
+    """writes a job file for files and launches a background blender on it"""
+    job_path = Path(job_dir).joinpath("job_%d.json" % index)
+    job = dict(job, files=files, results=str(job_path.with_suffix(".jsonl")))
+    job_path.write_text(json.dumps(job))
+    proc = subprocess.Popen(
+        [
+            blender,
+            "-b",
+            "--factory-startup",
+            "--python-exit-code",
+            "1",
+            "--python",
+            str(worker_script),
+            "--",
+            str(job_path),
+        ]
+    )
+    return proc, files, ResultTail(job["results"])
+
+
+def iter_batch_parallel(
+    src_dir,
+    dst_dir,
+    templ_path,
+    cbones,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    scale,
+    workers=2,
+    blender=None,
+    incremental=False,
+    cprofile_file=None,
+    memory_limit_mb=0,
+    recursive=False,
+    resume=False,
+    clips_per_pass=1,
+    rules_file=None,
+    duplicate_mode="OFF",
+    **settings
+):
+    """bakes the files of src_dir in background blender processes
+
+    Files are sharded round robin over the workers. When a worker dies, the
+    file it was working on is marked failed and the rest of its shard is
+    handed to a fresh worker. Workers whose memory use grows above
+    memory_limit_mb exit after their current file and are replaced the same
+    way. Every poll reads what the workers reported since the last one and
+    records started and finished files in the journal of dst_dir, and with
+    incremental in the manifest, so resume picks up what an interrupted batch
+    left and files that keep crashing workers are given up after
+    journal.max_attempts. Rules of rules_file and sidecar files are resolved
+    here and sent to the workers with the job. With duplicate_mode, each
+    worker looks duplicates up in the index of dst_dir as of its start, clips
+    it bakes are added to the index as it reports them.
+
+    Like mixamo_baker.iter_batch this is a generator, it yields a progress
+    dict every time the workers should be polled. Closing it terminates the
+    workers, their files stay pending in the journal. It returns the number
+    of files converted, or -1 if any file failed.
+    """
+    settings.update(
+        hips_to_root=hips_to_root,
+        use_x=use_x,
+        use_y=use_y,
+        use_z=use_z,
+        use_rotation=use_rotation,
+        on_ground=on_ground,
+    )
+
+    keys = {
+        str(file): mixamo_baker.relative_name(file, src_dir)
+        for file in mixamo_baker.source_files(src_dir, recursive, dst_dir)
+    }
+    overrides = rules.resolve_files(
+        src_dir, {key: file for file, key in keys.items()}, rules_file
+    )
+    file_settings = rules.file_settings(settings, overrides)
+    batch = journal.Journal(dst_dir, resume)
+    remaining = set(batch.remaining(list(keys.values())))
+    files = [file for file, key in keys.items() if key in remaining]
+    duplicate_index = duplicates.open_index(dst_dir, duplicate_mode)
+    settings_digests = {}
+    if incremental or duplicate_index is not None:
+        settings_digests = rules.settings_digests(
+            templ_path, cbones, scale, settings, overrides
+        )
+    if incremental:
+        baked = manifest.load_manifest(dst_dir)
+        source_digests = {file: manifest.file_digest(file) for file in files}
+        uptodate = [
+            file
+            for file in files
+            if manifest.is_up_to_date(
+                baked,
+                keys[file],
+                source_digests[file],
+                settings_digests[keys[file]],
+                mixamo_baker.output_path(
+                    file,
+                    dst_dir,
+                    src_dir,
+                    file_settings[keys[file]].get("output_format", "FBX"),
+                ),
+            )
+        ]
+        for file in uptodate:
+            batch.mark(keys[file], "skipped")
+        files = [file for file in files if file not in uptodate]
+    if not files:
+        batch.close()
+        return 0
+    job = {
+        "dst_dir": str(dst_dir),
+        "src_root": str(src_dir),
+        "templ_path": templ_path,
+        "cbones": cbones,
+        "scale": scale,
+        "settings": settings,
+        "overrides": {file: overrides[keys[file]] for file in files},
+        "duplicate_mode": duplicate_mode,
+        "settings_digests": {
+            file: settings_digests[keys[file]]
+            for file in files
+            if keys[file] in settings_digests
+        },
+        "cprofile_file": cprofile_file,
+        "memory_limit_mb": memory_limit_mb,
+        "clips_per_pass": clips_per_pass,
+    }
+    blender = blender or bpy.app.binary_path
+    workers = max(1, min(workers, len(files)))
+
+    results = {}
+    # last reported entry of every file, started ones included
+    reported = {}
+    running = []
+    job_dir = None
+
+    def finish(file, entry):
+        results[file] = entry
+        batch.mark(keys[file], entry["status"], entry.get("error"))
+        if incremental and entry["status"] == "done":
+            manifest.record(
+                baked,
+                keys[file],
+                source_digests[file],
+                settings_digests[keys[file]],
+                mixamo_baker.output_path(
+                    file,
+                    dst_dir,
+                    src_dir,
+                    file_settings[keys[file]].get("output_format", "FBX"),
+                ),
+            )
+            manifest.save_manifest(dst_dir, baked)
+
+    def absorb(entries):
+        clips = {}
+        for entry in entries:
+            reported[entry["file"]] = entry
+            if entry["status"] == "started":
+                batch.mark(keys[entry["file"]], "started")
+            else:
+                finish(entry["file"], entry)
+                clips.update(entry.get("clips") or {})
+        if duplicate_index is not None and clips:
+            duplicate_index.update(clips)
+            duplicate_index.save()
+
+    try:
+        job_dir = tempfile.mkdtemp(prefix="mixamo_baker_")
+        launched = 0
+        for i in range(workers):
+            running.append(
+                start_worker(blender, job_dir, launched, files[i::workers], job)
+            )
+            launched += 1
+
+        while running:
+            yield {
+                "done": len(results),
+                "total": len(files),
+                "file": None,
+                "stage": "%d workers baking" % len(running),
+            }
+            for task in list(running):
+                proc, shard, tail = task
+                # polled before reading, so the read has all an exited worker wrote
+                exited = proc.poll() is not None
+                absorb(tail.read())
+                if not exited:
+                    continue
+                running.remove(task)
+
+                remaining = []
+                for file in shard:
+                    entry = reported.get(file)
+                    if entry is None:
+                        remaining.append(file)
+                    elif entry["status"] == "started":
+                        finish(
+                            file,
+                            dict(
+                                entry,
+                                status="failed",
+                                error="worker exited with code %d" % proc.returncode,
+                            ),
+                        )
+
+                if remaining and len(remaining) == len(shard):
+                    # the worker died before baking anything, don't respawn it forever
+                    for file in remaining:
+                        finish(
+                            file,
+                            {
+                                "file": file,
+                                "status": "failed",
+                                "error": "worker exited with code %d" % proc.returncode,
+                            },
+                        )
+                elif remaining and proc.returncode == worker.restart_exit_code:
+                    log.info(
+                        "worker reached the memory limit, restarting it on %d remaining files",
+                        len(remaining),
+                    )
+                    running.append(
+                        start_worker(blender, job_dir, launched, remaining, job)
+                    )
+                    launched += 1
+                elif remaining:
+                    log.warning(
+                        "worker exited with code %d, restarting it on %d remaining files",
+                        proc.returncode,
+                        len(remaining),
+                    )
+                    running.append(
+                        start_worker(blender, job_dir, launched, remaining, job)
+                    )
+                    launched += 1
+    finally:
+        # cancelled, unfinished files of the running workers stay in the journal
+        for proc, shard, tail in running:
+            proc.terminate()
+            proc.wait()
+            absorb(tail.read())
+        batch.close()
+        if job_dir is not None:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        instrumentation.write_report(
+            dst_dir, [entry.get("stats") for entry in results.values()]
+        )
+
+    failed = [entry for entry in results.values() if entry["status"] == "failed"]
+    for entry in failed:
+        print("Failed : {}\n{}".format(entry["file"], entry["error"]))
+    if failed:
+        return -1
+    return len(results)
+
+
+def process_batch_parallel(*args, poll_interval=0.5, **options):
+    """bakes the files of src_dir in background blender processes, see iter_batch_parallel"""
+    batch = iter_batch_parallel(*args, **options)
+    while True:
+        try:
+            next(batch)
+        except StopIteration as end:
+            return end.value
+        time.sleep(poll_interval)
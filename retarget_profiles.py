@@ -0,0 +1,101 @@
+"""Bone retarget profiles.
+
+A profile is a JSON file mapping Mixamo bone names to the bone names of a
+target skeleton:
+
+    {
+        "name": "unreal",
+        "sides": [["Left", ".L", "l"], ["Right", ".R", "r"]],
+        "bones": {"Hips": "pelvis", "~Arm": "upperarm_~", ...}
+    }
+
+A "~" in a bone name stands for a side. Each side lists the Mixamo prefix,
+the suffix of Blender style names and the token of the target skeleton, so
+"~Arm" matches "LeftArm" or "Arm.L" and becomes "upperarm_l". Profiles are
+compiled once into flat lookup tables and cached for the session.
+"""
+
+from pathlib import Path
+import json
+
+profiles_dir = Path(__file__).resolve().parent.joinpath("profiles")
+_compiled = {}
+
+
+def strip_namespace(name):
+    """returns the part of a bone name after the last ':' or '_'
+
+    Names ending in a separator are returned whole, rather than stripped to
+    an empty name all such bones would share.
+    """
+    return name[max(name.rfind(":"), name.rfind("_")) + 1 :] or name
+
+
+class RetargetProfile:
+    """compiled source to target bone name tables of a profile"""
+
+    def __init__(self, name, sides, bones):
+        self.name = name
+        self.to_target = {}
+        self.to_source = {}
+        for source, target in bones.items():
+            if "~" not in source:
+                self.to_target.setdefault(source, target)
+                self.to_source.setdefault(target, source)
+                continue
+            base = source.replace("~", "")
+            for prefix, suffix, token in sides:
+                side_target = target.replace("~", token)
+                side_source = source.replace("~", prefix)
+                # bare names are claimed by the first side, like the old renaming
+                for candidate in (side_source, base + suffix, base):
+                    self.to_target.setdefault(candidate, side_target)
+                self.to_source.setdefault(side_target, side_source)
+
+    def target_name(self, name):
+        """returns the target skeleton name for a source bone name, or None"""
+        target = self.to_target.get(name)
+        if target is None:
+            target = self.to_target.get(strip_namespace(name))
+        return target
+
+    def pair_bones(self, src_armature, dst_armature):
+        """returns {dst bone name: src pose bone} for every dst bone the source animates
+
+        Source bones are matched either by their profile target name or by
+        already carrying the target name.
+        """
+        pairs = {}
+        dst_bones = dst_armature.pose.bones
+        for src in src_armature.pose.bones:
+            for name in (src.name, self.target_name(src.name)):
+                if name is not None and name in dst_bones and name not in pairs:
+                    pairs[name] = src
+                    break
+        return pairs
+
+
+def profile_path(profile):
+    """resolves a bundled profile name or a path to a profile JSON file"""
+    path = Path(profile)
+    if path.suffix.lower() != ".json":
+        path = profiles_dir.joinpath(profile + ".json")
+    return path.resolve()
+
+
+def load_profile(profile="unreal"):
+    """returns the compiled profile, compiling it on first use or when the file changed"""
+    path = profile_path(profile)
+    key = (str(path), path.stat().st_mtime_ns)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        data = json.loads(path.read_text())
+        compiled = RetargetProfile(
+            data.get("name", path.stem), data.get("sides", []), data["bones"]
+        )
+        _compiled[key] = compiled
+    return compiled
+
+
+def available_profiles():
+    return sorted(path.stem for path in profiles_dir.glob("*.json"))
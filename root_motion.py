@@ -0,0 +1,132 @@
+"""Root motion extraction on arrays of hips transforms.
+
+Reproduces the constraint stack bake_hips used to build on the destination
+object (copy hips location, keep it on the ground, copy the hips yaw) as
+plain NumPy math, so root motion is computed for all frames at once. All
+functions work on arrays and do not need Blender.
+"""
+
+import numpy as np
+
+
+def quaternion_to_matrix(quats):
+    """(n, 4) w, x, y, z quaternions to (n, 3, 3) rotation matrices"""
+    q = quats / np.linalg.norm(quats, axis=1)[:, None]
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    return np.stack(
+        (
+            np.stack(
+                (1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), 1
+            ),
+            np.stack(
+                (2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), 1
+            ),
+            np.stack(
+                (2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), 1
+            ),
+        ),
+        axis=1,
+    )
+
+
+def compose_matrices(locations, quats, scales):
+    """(n, 4, 4) matrices translating, rotating and scaling like Blender's loc/rot/scale"""
+    matrices = np.zeros((len(locations), 4, 4))
+    matrices[:, :3, :3] = quaternion_to_matrix(quats) * scales[:, None, :]
+    matrices[:, :3, 3] = locations
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def euler_to_quaternion(eulers):
+    """(n, 3) XYZ euler angles to (n, 4) w, x, y, z quaternions"""
+    half = np.asarray(eulers) / 2.0
+    cx, cy, cz = np.cos(half).T
+    sx, sy, sz = np.sin(half).T
+    return np.stack(
+        (
+            cx * cy * cz + sx * sy * sz,
+            sx * cy * cz - cx * sy * sz,
+            cx * sy * cz + sx * cy * sz,
+            cx * cy * sz - sx * sy * cz,
+        ),
+        axis=1,
+    )
+
+
+def yaw(matrices):
+    """Z component of the XYZ euler decomposition of (n, 3+, 3+) matrices"""
+    return np.arctan2(matrices[:, 1, 0], matrices[:, 0, 0])
+
+
+def smooth(values, window):
+    """centered moving average over window frames, edges padded with the end values"""
+    if window <= 1 or len(values) < 2:
+        return values
+    before = (window - 1) // 2
+    after = window - 1 - before
+    padded = np.concatenate(
+        (np.repeat(values[:1], before, 0), values, np.repeat(values[-1:], after, 0))
+    )
+    kernel = np.ones(window) / window
+    return np.stack(
+        [
+            np.convolve(padded[:, i], kernel, mode="valid")
+            for i in range(values.shape[1])
+        ],
+        axis=1,
+    )
+
+
+def extract_root_motion(
+    hips_matrices,
+    base_location,
+    base_euler,
+    z_offset,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    smoothing=0,
+    start_at_origin=False,
+):
+    """returns (n, 3) root locations and (n, 3) XYZ euler rotations
+
+    hips_matrices are the (n, 4, 4) world matrices of the hips, base_location
+    and base_euler the rest transform of the root object. on_ground lowers
+    the root by the rest height of the hips, z_offset, and keeps it above the
+    ground. smoothing averages location and yaw over that many frames and
+    start_at_origin moves the horizontal start position to the origin.
+    """
+    n = len(hips_matrices)
+    hips_location = hips_matrices[:, :3, 3]
+
+    locations = np.repeat(np.asarray(base_location, dtype=np.float64)[None, :], n, 0)
+    if use_z:
+        if on_ground:
+            locations[:, 2] = np.maximum(hips_location[:, 2] - z_offset, 0.0)
+        else:
+            locations[:, 2] += hips_location[:, 2]
+    if use_x:
+        locations[:, 0] = hips_location[:, 0]
+    if use_y:
+        locations[:, 1] = hips_location[:, 1]
+
+    eulers = np.repeat(np.asarray(base_euler, dtype=np.float64)[None, :], n, 0)
+    if use_rotation:
+        eulers[:, 2] = np.unwrap(yaw(hips_matrices))
+
+    if smoothing > 1:
+        locations = smooth(locations, smoothing)
+        eulers[:, 2:] = smooth(eulers[:, 2:], smoothing)
+        if use_z and on_ground:
+            locations[:, 2] = np.maximum(locations[:, 2], 0.0)
+
+    if start_at_origin:
+        if use_x:
+            locations[:, 0] -= locations[0, 0] - base_location[0]
+        if use_y:
+            locations[:, 1] -= locations[0, 1] - base_location[1]
+
+    return locations, eulers
@@ -0,0 +1,177 @@
+"""Per file bake settings for libraries that mix in-place and root motion clips.
+
+A rules file overrides the batch settings for the files it matches:
+
+    {
+        "rules": [
+            {"glob": "*_inplace.fbx", "settings": {"hips_to_root": false}},
+            {"glob": "locomotion/*", "settings": {"use_z": false}},
+            {"regex": "(?i)roll", "settings": {"use_rotation": false}}
+        ]
+    }
+
+Globs match the path of a file relative to the input directory from its
+end, so "*.fbx" matches files in every subfolder. Regular expressions are
+searched in that path. A source file can also have a sidecar JSON file of
+the same name, Walking.json next to Walking.fbx, holding settings for that
+file alone. Rules apply in order, later rules and the sidecar override
+earlier ones. Without an explicit rules file, .mixamo_baker_rules.json in
+the input directory is used when it exists. Unknown settings and values
+that don't fit a setting, like "false" for a flag, are rejected.
+
+Settings of every file are resolved once when the batch scans its files.
+"""
+
+from pathlib import Path, PurePosixPath
+import json
+import re
+from . import manifest
+
+rules_name = ".mixamo_baker_rules.json"
+
+# bake_file options a rule may set, with their type or the values they take
+overridable = {
+    "hips_to_root": bool,
+    "use_x": bool,
+    "use_y": bool,
+    "use_z": bool,
+    "use_rotation": bool,
+    "on_ground": bool,
+    "root_smoothing": int,
+    "root_start_at_origin": bool,
+    "bake_mode": ("SINGLE_PASS", "OPERATOR", "FK"),
+    "keep_sparse_keys": bool,
+    "key_reduction": ("CLEAN", "DECIMATE"),
+    "location_tolerance": float,
+    "rotation_tolerance": float,
+    "scale_tolerance": float,
+    "profile": str,
+    "output_format": ("FBX", "CLIP", "BOTH"),
+    "verify": ("OFF", "FLAG", "FAIL"),
+    "max_position_error": float,
+    "max_rotation_error": float,
+}
+
+
+def valid_value(kind, value):
+    if isinstance(kind, tuple):
+        return value in kind
+    if kind is float:
+        # JSON writes whole numbers without a point
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, kind)
+
+
+def check_settings(settings, source):
+    """returns settings, raising ValueError for unknown settings or invalid values"""
+    unknown = sorted(set(settings) - set(overridable))
+    if unknown:
+        raise ValueError("%s sets unknown settings: %s" % (source, ", ".join(unknown)))
+    for name, value in settings.items():
+        kind = overridable[name]
+        if not valid_value(kind, value):
+            expected = (
+                " or ".join(kind) if isinstance(kind, tuple) else "a " + kind.__name__
+            )
+            raise ValueError(
+                "%s sets %s to %s, expected %s"
+                % (source, name, json.dumps(value), expected)
+            )
+    return settings
+
+
+def glob_matcher(pattern):
+    return lambda key: PurePosixPath(key).match(pattern)
+
+
+def load_rules(path):
+    """returns the rules of a rules file as (match function, settings) pairs"""
+    data = json.loads(Path(path).read_text())
+    rules = []
+    for rule in data["rules"]:
+        settings = check_settings(rule["settings"], path)
+        if "glob" in rule:
+            match = glob_matcher(rule["glob"])
+        elif "regex" in rule:
+            match = re.compile(rule["regex"]).search
+        else:
+            raise ValueError("%s has a rule without glob or regex" % path)
+        rules.append((match, settings))
+    return rules
+
+
+def sidecar_path(file):
+    return Path(file).with_suffix(".json")
+
+
+def file_overrides(rules, file, key):
+    """returns the settings rules and the sidecar of file override, key is its relative path"""
+    settings = {}
+    for match, overrides in rules:
+        if match(key):
+            settings.update(overrides)
+    sidecar = sidecar_path(file)
+    if sidecar.is_file():
+        settings.update(check_settings(json.loads(sidecar.read_text()), sidecar))
+    return settings
+
+
+def find_rules(src_dir, rules_file=None):
+    """returns the rules of rules_file, or of the rules file in src_dir if there is one"""
+    if rules_file is None and Path(src_dir).joinpath(rules_name).is_file():
+        rules_file = Path(src_dir).joinpath(rules_name)
+    return load_rules(rules_file) if rules_file else []
+
+
+def resolve_files(src_dir, files, rules_file=None):
+    """returns {key: settings overrides} for a dict of relative paths to source files"""
+    rules = find_rules(src_dir, rules_file)
+    return {key: file_overrides(rules, file, key) for key, file in files.items()}
+
+
+def settings_key(overrides):
+    """returns a hashable key that is equal for equal overrides"""
+    return json.dumps(overrides, sort_keys=True)
+
+
+def file_settings(settings, overrides):
+    """returns {key: settings} of every file from the batch settings and resolve_files overrides"""
+    return {key: dict(settings, **values) for key, values in overrides.items()}
+
+
+def settings_digests(templ_path, cbones, scale, settings, overrides):
+    """returns {key: manifest settings digest} of every file
+
+    The template is hashed once per distinct set of overrides. Files without
+    overrides get the digest of the batch settings.
+    """
+    digests = {}
+    by_overrides = {}
+    for key, values in overrides.items():
+        values_key = settings_key(values)
+        if values_key not in by_overrides:
+            by_overrides[values_key] = manifest.settings_digest(
+                templ_path, cbones, scale, dict(settings, **values)
+            )
+        digests[key] = by_overrides[values_key]
+    return digests
+
+
+def group_files(keys, settings, clips_per_pass):
+    """splits keys into groups of up to clips_per_pass files that share their settings
+
+    settings maps keys to their file settings. Files that don't bake in
+    SINGLE_PASS mode are grouped alone.
+    """
+    same = {}
+    for key in keys:
+        same.setdefault(settings_key(settings[key]), []).append(key)
+    groups = []
+    for keys in same.values():
+        step = clips_per_pass
+        if settings[keys[0]].get("bake_mode", "SINGLE_PASS") != "SINGLE_PASS":
+            step = 1
+        groups.extend(keys[i : i + step] for i in range(0, len(keys), step))
+    return groups
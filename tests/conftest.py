@@ -0,0 +1,17 @@
+"""Makes the NumPy cores of the add-on importable without Blender.
+
+The package __init__ registers the add-on and needs bpy, so the repository
+is registered as a bare package, under the name of its folder that pytest
+imports it as and as mixamo_baker for the tests. Only the modules a test
+imports are loaded from it.
+"""
+
+from pathlib import Path
+import sys
+import types
+
+package_dir = Path(__file__).resolve().parent.parent
+package = types.ModuleType("mixamo_baker")
+package.__path__ = [str(package_dir)]
+for name in (package_dir.name, "mixamo_baker"):
+    sys.modules.setdefault(name, package)
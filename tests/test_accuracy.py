@@ -0,0 +1,72 @@
+import numpy as np
+from mixamo_baker import accuracy
+from mixamo_baker.root_motion import compose_matrices, euler_to_quaternion
+
+
+def world_matrices(locations, eulers):
+    """(frames, bones, 4, 4) matrices from (frames, bones, 3) locations and XYZ eulers"""
+    frames, bones = locations.shape[:2]
+    return compose_matrices(
+        locations.reshape(-1, 3),
+        euler_to_quaternion(eulers.reshape(-1, 3)),
+        np.ones((frames * bones, 3)),
+    ).reshape(frames, bones, 4, 4)
+
+
+def test_identical_joints_have_no_error():
+    rng = np.random.default_rng(1)
+    world = world_matrices(rng.normal(size=(4, 3, 3)), rng.normal(size=(4, 3, 3)))
+    position, rotation = accuracy.joint_errors(world, world.copy(), hips=0)
+    assert position.shape == rotation.shape == (4, 3)
+    np.testing.assert_allclose(position, 0.0, atol=1e-12)
+    np.testing.assert_allclose(rotation, 0.0, atol=1e-6)
+
+
+def test_errors_are_measured_relative_to_the_hips():
+    rng = np.random.default_rng(2)
+    locations = rng.normal(size=(3, 2, 3))
+    eulers = np.zeros((3, 2, 3))
+    src = world_matrices(locations, eulers)
+    # root motion moves the whole destination skeleton
+    dst = world_matrices(locations + [1.0, 2.0, 0.0], eulers)
+    position, rotation = accuracy.joint_errors(src, dst, hips=0)
+    np.testing.assert_allclose(position, 0.0, atol=1e-12)
+    position, rotation = accuracy.joint_errors(src, dst)
+    np.testing.assert_allclose(position, np.sqrt(5.0))
+
+
+def test_rotation_error_is_the_angle_between_joints():
+    locations = np.zeros((1, 1, 3))
+    src = world_matrices(locations, np.zeros((1, 1, 3)))
+    dst = world_matrices(locations, np.array([[[0.0, 0.0, 0.25]]]))
+    position, rotation = accuracy.joint_errors(src, dst)
+    np.testing.assert_allclose(rotation, 0.25, atol=1e-6)
+
+
+def test_rotation_error_ignores_scale():
+    src = world_matrices(np.zeros((1, 1, 3)), np.zeros((1, 1, 3)))
+    dst = src.copy()
+    dst[..., :3, :3] *= 2.0
+    position, rotation = accuracy.joint_errors(src, dst)
+    np.testing.assert_allclose(rotation, 0.0, atol=1e-6)
+
+
+def test_summarize_finds_worst_bone_and_frame():
+    position = np.array([[0.0, 0.1, 0.2], [0.5, 0.0, 0.1]])
+    rotation = np.array([[0.0, 3.0, 0.2], [0.5, 0.0, 0.1]])
+    summary = accuracy.summarize(["pelvis", "spine_01", "head"], position, rotation)
+    assert summary["position"] == 0.5
+    assert summary["position_bone"] == "pelvis"
+    assert summary["position_frame"] == 1
+    assert summary["rotation"] == 3.0
+    assert summary["rotation_bone"] == "spine_01"
+    assert summary["rotation_frame"] == 0
+    assert summary["bones"]["head"] == {"position": 0.2, "rotation": 0.2}
+
+
+def test_summarize_without_bones():
+    summary = accuracy.summarize([], np.zeros((10, 0)), np.zeros((10, 0)))
+    assert summary["bones"] == {}
+    assert summary["position"] == summary["rotation"] == 0.0
+    assert summary["position_bone"] is None
+    assert summary["rotation_frame"] is None
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from mixamo_baker import clip_format
+
+tolerances = {"rotation": 1e-4, "location": 1e-5, "scale": 1e-5}
+
+
+def random_quaternions(rng, n):
+    quats = rng.normal(size=(n, 4))
+    return quats / np.linalg.norm(quats, axis=1)[:, None]
+
+
+def rotation_angle(a, b):
+    dots = np.abs(np.einsum("ij,ij->i", a, b))
+    return 2.0 * np.arccos(np.clip(dots, 0.0, 1.0))
+
+
+def test_smallest_three_round_trip():
+    rng = np.random.default_rng(1)
+    quats = random_quaternions(rng, 500)
+    quats[:4] = np.eye(4)
+    data = clip_format.encode_smallest_three(quats)
+    assert data.shape == (500, 6)
+    decoded = clip_format.decode_smallest_three(data)
+    assert rotation_angle(quats, decoded).max() < 1e-3
+
+
+def test_write_read_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    frames = 30
+    locations = np.cumsum(rng.normal(scale=0.01, size=(frames, 3)), axis=0)
+    rotations = random_quaternions(rng, frames)
+    bones = [
+        ("pelvis", {"location": locations, "rotation": rotations}),
+        ("spine_01", {"rotation": np.repeat([[1.0, 0.0, 0.0, 0.0]], frames, 0)}),
+        ("hand_r", {"scale": np.repeat([[2.0, 2.0, 2.0]], frames, 0)}),
+        ("ik_foot_root", {}),
+    ]
+    path = tmp_path.joinpath("Walking.clip")
+    size = clip_format.write_clip(path, 30.0, frames, bones, tolerances)
+    assert size == path.stat().st_size
+
+    fps, frame_count, decoded = clip_format.read_clip(path)
+    assert fps == 30.0
+    assert frame_count == frames
+    assert list(decoded) == ["pelvis", "spine_01", "hand_r", "ik_foot_root"]
+    extent = locations.max(axis=0) - locations.min(axis=0)
+    np.testing.assert_allclose(
+        decoded["pelvis"]["location"], locations, atol=extent.max() / 65535.0
+    )
+    assert rotation_angle(decoded["pelvis"]["rotation"], rotations).max() < 1e-3
+    # tracks holding the rest value are dropped
+    assert decoded["spine_01"] == {}
+    np.testing.assert_allclose(decoded["hand_r"]["scale"], 2.0)
+    assert decoded["hand_r"]["scale"].shape == (frames, 3)
+    assert decoded["ik_foot_root"] == {}
+
+
+def test_track_data_is_aligned(tmp_path):
+    frames = 7
+    bones = [
+        ("a", {"location": np.arange(frames * 3.0).reshape(frames, 3)}),
+        ("b", {"location": np.arange(frames * 3.0).reshape(frames, 3) * 2.0}),
+    ]
+    path = tmp_path.joinpath("aligned.clip")
+    clip_format.write_clip(path, 24.0, frames, bones, tolerances)
+    data = path.read_bytes()
+    header = clip_format.header_format.unpack_from(data, 0)
+    tracks_offset = clip_format.header_format.size + 2 * clip_format.bone_format.size
+    for i in range(header[6]):
+        offset = clip_format.track_format.unpack_from(
+            data, tracks_offset + i * clip_format.track_format.size
+        )[3]
+        assert offset % 8 == 0
+
+
+def test_read_rejects_other_files(tmp_path):
+    path = tmp_path.joinpath("other.clip")
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        clip_format.read_clip(path)
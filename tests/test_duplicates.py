@@ -0,0 +1,76 @@
+import os
+import numpy as np
+from mixamo_baker import duplicates
+
+
+def channels(offset=0.0):
+    frames = np.arange(10.0)
+    return [
+        ('pose.bones["pelvis"].location', 0, np.sin(frames) + offset),
+        ('pose.bones["pelvis"].rotation_quaternion', 0, np.cos(frames)),
+    ]
+
+
+def test_fingerprint_is_stable():
+    assert duplicates.fingerprint(channels()) == duplicates.fingerprint(channels())
+
+
+def test_fingerprint_ignores_noise_below_the_quantum():
+    noisy = channels()
+    noisy[0] = (noisy[0][0], 0, noisy[0][2] + duplicates.quantum * 0.01)
+    assert duplicates.fingerprint(noisy) == duplicates.fingerprint(channels())
+
+
+def test_fingerprint_treats_negative_zero_as_zero():
+    a = [("location", 0, np.array([0.0, 1.0]))]
+    b = [("location", 0, np.array([-0.0, 1.0]))]
+    assert duplicates.fingerprint(a) == duplicates.fingerprint(b)
+
+
+def test_fingerprint_tells_motion_apart():
+    assert duplicates.fingerprint(channels(0.01)) != duplicates.fingerprint(channels())
+
+
+def test_fingerprint_tells_channels_apart():
+    renamed = [("location", 1, values) for path, index, values in channels()]
+    same = [("location", 0, values) for path, index, values in channels()]
+    assert duplicates.fingerprint(renamed) != duplicates.fingerprint(same)
+
+
+def test_fingerprint_tells_rest_poses_apart():
+    rest = [("pelvis", np.eye(4)), ("spine_01", np.eye(4))]
+    longer = [("pelvis", np.eye(4)), ("spine_01", np.eye(4))]
+    longer[1][1][2, 3] = 0.5
+    assert duplicates.fingerprint(channels(), rest) == duplicates.fingerprint(
+        channels(), [("pelvis", np.eye(4)), ("spine_01", np.eye(4))]
+    )
+    assert duplicates.fingerprint(channels(), rest) != duplicates.fingerprint(
+        channels(), longer
+    )
+
+
+def test_clip_key_depends_on_settings():
+    fingerprint = duplicates.fingerprint(channels())
+    assert duplicates.clip_key(fingerprint, "a") != duplicates.clip_key(
+        fingerprint, "b"
+    )
+
+
+def test_index_round_trip_and_links(tmp_path):
+    original = tmp_path.joinpath("Walking.fbx")
+    original.write_bytes(b"baked")
+    index = duplicates.open_index(tmp_path, "LINK")
+    index.add("key", [original])
+    index.save()
+
+    index = duplicates.open_index(tmp_path, "LINK")
+    outputs = index.lookup("key")
+    assert outputs == [original]
+    copy = tmp_path.joinpath("sub", "Walking (1).fbx")
+    index.reuse(outputs, [copy])
+    assert copy.read_bytes() == b"baked"
+    assert os.path.samefile(copy, original)
+
+    original.unlink()
+    assert index.lookup("key") is None
+    assert duplicates.open_index(tmp_path, "OFF") is None
@@ -0,0 +1,35 @@
+import json
+import pytest
+from mixamo_baker import fan_out
+
+
+def test_targets_bake_at_their_own_scale(tmp_path):
+    path = tmp_path.joinpath("targets.json")
+    path.write_text(
+        json.dumps(
+            {
+                "targets": [
+                    {"template": "mannequin.blend"},
+                    {"template": "hero.blend", "cbones": "hand_r", "scale": 1.0},
+                ]
+            }
+        )
+    )
+    mannequin, hero = fan_out.load_targets(path, "wrist_r wrist_l", 0.01)
+    assert mannequin.template == str(tmp_path.joinpath("mannequin.blend"))
+    assert (mannequin.cbones, mannequin.scale) == ("wrist_r wrist_l", 0.01)
+    assert (hero.cbones, hero.scale) == ("hand_r", 1.0)
+    assert hero.output_dir(tmp_path) == tmp_path.joinpath("hero")
+
+    # a source imported at 0.01 is a hundred times larger than at 1.0
+    assert mannequin.source_factor(0.01) == 1.0
+    assert hero.source_factor(0.01) == pytest.approx(0.01)
+
+
+def test_targets_need_positive_scale_and_own_subfolder():
+    with pytest.raises(ValueError):
+        fan_out.make_targets([{"template": "a.blend", "scale": 0}], "", 0.01)
+    with pytest.raises(ValueError):
+        fan_out.make_targets(
+            [{"template": "a.blend"}, {"template": "b/a.blend"}], "", 0.01
+        )
@@ -0,0 +1,133 @@
+import numpy as np
+from mixamo_baker import fk_retarget
+from mixamo_baker.root_motion import euler_to_quaternion
+
+
+def random_quaternions(rng, n):
+    quats = rng.normal(size=(n, 4))
+    return quats / np.linalg.norm(quats, axis=1)[:, None]
+
+
+def chain_rest(lengths):
+    """rest matrices of a chain of bones along +Y, each starting at its parent's tail"""
+    rest = np.repeat(np.eye(4)[None], len(lengths), 0)
+    rest[:, 1, 3] = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+    return rest, [-1] + list(range(len(lengths) - 1))
+
+
+def random_basis(rng, frames, bones):
+    return fk_retarget.compose(
+        rng.normal(scale=0.1, size=(frames * bones, 3)),
+        random_quaternions(rng, frames * bones),
+        np.ones((frames * bones, 3)),
+    ).reshape(frames, bones, 4, 4)
+
+
+def test_hierarchy_order_puts_parents_first():
+    parents = [2, -1, 1, 0]
+    order = fk_retarget.hierarchy_order(parents)
+    assert sorted(order) == [0, 1, 2, 3]
+    for b, p in enumerate(parents):
+        if p >= 0:
+            assert order.index(p) < order.index(b)
+
+
+def test_forward_inverse_round_trip():
+    rng = np.random.default_rng(1)
+    rest, parents = chain_rest([0.3, 0.2, 0.25, 0.1])
+    basis = random_basis(rng, 5, len(parents))
+    pose = fk_retarget.forward_kinematics(rest, parents, basis)
+    np.testing.assert_allclose(
+        fk_retarget.inverse_kinematics(rest, parents, pose), basis, atol=1e-12
+    )
+
+
+def test_forward_kinematics_of_rest_pose_is_rest():
+    rest, parents = chain_rest([0.3, 0.2, 0.25])
+    basis = np.repeat(np.eye(4)[None, None], 2, 0).repeat(len(parents), 1)
+    pose = fk_retarget.forward_kinematics(rest, parents, basis)
+    np.testing.assert_allclose(pose, np.broadcast_to(rest, pose.shape), atol=1e-12)
+
+
+def test_identity_retarget_reproduces_source():
+    rng = np.random.default_rng(2)
+    rest, parents = chain_rest([0.3, 0.2, 0.25, 0.1])
+    basis = random_basis(rng, 4, len(parents))
+    src_world = fk_retarget.forward_kinematics(rest, parents, basis)
+    dst_object = np.repeat(np.eye(4)[None], len(basis), 0)
+    retargeted = fk_retarget.retarget(
+        src_world,
+        dst_object,
+        rest,
+        parents,
+        {b: b for b in range(len(parents))},
+        np.repeat(np.eye(4)[None], len(parents), 0),
+    )
+    np.testing.assert_allclose(retargeted, basis, atol=1e-9)
+
+
+def test_unpaired_bones_keep_their_basis():
+    rng = np.random.default_rng(3)
+    rest, parents = chain_rest([0.3, 0.2])
+    src_world = fk_retarget.forward_kinematics(
+        rest, parents, random_basis(rng, 3, len(parents))
+    )
+    dst_basis = random_basis(rng, 1, len(parents))[0]
+    retargeted = fk_retarget.retarget(
+        src_world,
+        np.repeat(np.eye(4)[None], 3, 0),
+        rest,
+        parents,
+        {0: 0},
+        dst_basis,
+    )
+    np.testing.assert_allclose(
+        retargeted[:, 1], np.broadcast_to(dst_basis[1], (3, 4, 4)), atol=1e-9
+    )
+
+
+def test_constraints_allowed_with_default_cbones():
+    # pelvis, spine, upperarm_r, lowerarm_r, hand_r and the twist bone wrist_r
+    # the template constrains, like the default cbones "wrist_r wrist_l"
+    parents = [-1, 0, 1, 2, 3, 3]
+    pairs = {0: 0, 1: 1, 2: 2, 3: 3, 4: 4}
+    assert fk_retarget.constraints_allowed(parents, pairs, [5])
+    # a paired bone with constraints, or one above a paired bone, is not
+    assert not fk_retarget.constraints_allowed(parents, pairs, [4])
+    assert not fk_retarget.constraints_allowed(parents, pairs, [2])
+    assert not fk_retarget.constraints_allowed(parents, {0: 0, 5: 4}, [5])
+
+
+def test_matrix_to_quaternion_inverts_compose():
+    rng = np.random.default_rng(4)
+    quats = random_quaternions(rng, 200)
+    # the branches for a largest w, x, y and z
+    quats[:4] = np.eye(4)
+    quats[quats[:, 0] < 0] *= -1
+    matrices = fk_retarget.compose(np.zeros((200, 3)), quats, np.ones((200, 3)))
+    result = fk_retarget.matrix_to_quaternion(matrices)
+    result[result[:, 0] < 0] *= -1
+    np.testing.assert_allclose(result, quats, atol=1e-9)
+
+
+def test_matrix_to_quaternion_of_euler_rotations():
+    eulers = np.array([[0.0, 0.0, np.pi / 2], [np.pi, 0.0, 0.0], [0.3, -0.2, 0.1]])
+    quats = euler_to_quaternion(eulers)
+    result = fk_retarget.matrix_to_quaternion(
+        fk_retarget.compose(np.zeros((3, 3)), quats, np.ones((3, 3)))
+    )
+    dots = np.abs(np.einsum("ij,ij->i", result, quats))
+    np.testing.assert_allclose(dots, 1.0, atol=1e-12)
+
+
+def test_decompose_inverts_compose():
+    rng = np.random.default_rng(5)
+    locations = rng.normal(size=(10, 3))
+    quats = random_quaternions(rng, 10)
+    scales = rng.uniform(0.5, 2.0, size=(10, 3))
+    result = fk_retarget.decompose(fk_retarget.compose(locations, quats, scales))
+    np.testing.assert_allclose(result[0], locations, atol=1e-12)
+    np.testing.assert_allclose(
+        np.abs(np.einsum("ij,ij->i", result[1], quats)), 1.0, atol=1e-9
+    )
+    np.testing.assert_allclose(result[2], scales, atol=1e-12)
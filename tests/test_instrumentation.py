@@ -0,0 +1,21 @@
+from mixamo_baker import instrumentation
+
+
+def test_group_counters_sum_and_peak_over_clips():
+    instrumentation.begin_file("group")
+    instrumentation.count("clips", 2)
+    for keys, clip_bytes, error in ((10, 100, 0.5), (4, 60, 0.2)):
+        instrumentation.add("keys_after", keys)
+        instrumentation.add("clip_bytes", clip_bytes)
+        instrumentation.peak("position_error_cm", error)
+    row = instrumentation.end_file()
+    assert row["clips"] == 2
+    assert row["keys_after"] == 14
+    assert row["clip_bytes"] == 160
+    assert row["position_error_cm"] == 0.5
+
+
+def test_counters_are_ignored_without_active_file():
+    instrumentation.add("keys_after", 1)
+    instrumentation.peak("position_error_cm", 1.0)
+    assert instrumentation.end_file() is None
@@ -0,0 +1,57 @@
+from mixamo_baker import journal
+
+
+def test_remaining_records_pending_and_skips_finished(tmp_path):
+    batch = journal.Journal(tmp_path)
+    assert batch.remaining(["a", "b", "c"]) == ["a", "b", "c"]
+    batch.mark("a", "started")
+    batch.mark("a", "done")
+    batch.mark("b", "started")
+    batch.mark("b", "failed", "broken file")
+    batch.close()
+
+    resumed = journal.Journal(tmp_path, resume=True)
+    assert resumed.remaining(["a", "b", "c", "d"]) == ["c", "d"]
+    assert resumed.failed() == {"b": "broken file"}
+    assert resumed.summary() == {"done": 1, "failed": 1, "pending": 2}
+    resumed.close()
+
+
+def test_files_crashing_the_session_are_failed(tmp_path):
+    batch = journal.Journal(tmp_path)
+    batch.remaining(["a"])
+    for attempt in range(journal.max_attempts):
+        batch.mark("a", "started")
+    batch.close()
+
+    resumed = journal.Journal(tmp_path, resume=True)
+    assert resumed.remaining(["a"]) == []
+    assert "a" in resumed.failed()
+    resumed.close()
+
+
+def test_line_cut_short_by_a_crash_is_ignored(tmp_path):
+    batch = journal.Journal(tmp_path)
+    batch.remaining(["a", "b"])
+    batch.mark("a", "done")
+    batch.close()
+    with open(tmp_path.joinpath(journal.journal_name), "a") as f:
+        f.write('{"file": "b", "sta')
+
+    assert journal.read_summary(tmp_path) == {"done": 1, "pending": 1}
+
+
+def test_without_resume_the_journal_starts_over(tmp_path):
+    batch = journal.Journal(tmp_path)
+    batch.remaining(["a"])
+    batch.mark("a", "done")
+    batch.close()
+
+    fresh = journal.Journal(tmp_path)
+    assert fresh.remaining(["a"]) == ["a"]
+    fresh.close()
+    assert journal.read_summary(tmp_path) == {"pending": 1}
+
+
+def test_read_summary_without_journal(tmp_path):
+    assert journal.read_summary(tmp_path) == {}
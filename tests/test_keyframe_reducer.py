@@ -0,0 +1,58 @@
+import numpy as np
+from mixamo_baker import keyframe_reducer
+
+
+def test_short_channels_keep_every_key():
+    times = np.array([0.0, 1.0])
+    values = np.array([[0.0], [5.0]])
+    assert list(keyframe_reducer.decimate(times, values, 0.01)) == [0, 1]
+
+
+def test_constant_channel_keeps_one_key():
+    times = np.arange(10.0)
+    values = np.full((10, 3), 2.5)
+    values[4, 1] += 0.001
+    assert list(keyframe_reducer.decimate(times, values, 0.01)) == [0]
+
+
+def test_linear_channel_keeps_its_ends():
+    times = np.arange(20.0)
+    values = np.stack((times * 0.5, -times), axis=1)
+    assert list(keyframe_reducer.decimate(times, values, 1e-6)) == [0, 19]
+
+
+def test_corner_is_kept():
+    times = np.arange(11.0)
+    values = np.abs(times - 4.0)[:, None]
+    assert list(keyframe_reducer.decimate(times, values, 1e-6)) == [0, 4, 10]
+
+
+def test_error_stays_within_tolerance():
+    times = np.arange(200.0)
+    values = np.stack((np.sin(times / 10.0), np.cos(times / 7.0)), axis=1)
+    for tolerance in (0.1, 0.01, 0.001):
+        keep = keyframe_reducer.decimate(times, values, tolerance)
+        assert keep[0] == 0 and keep[-1] == len(times) - 1
+        assert len(keep) < len(times)
+        assert keyframe_reducer.max_error(times, values, keep) <= tolerance
+
+
+def test_quaternion_error_stays_within_tolerance():
+    times = np.arange(100.0)
+    angles = np.sin(times / 15.0)
+    quats = np.stack(
+        (np.cos(angles / 2), np.sin(angles / 2), np.zeros(100), np.zeros(100)),
+        axis=1,
+    )
+    error = keyframe_reducer.quaternion_error
+    keep = keyframe_reducer.decimate(times, quats, 0.01, error)
+    assert len(keep) < len(times)
+    assert keyframe_reducer.max_error(times, quats, keep, error) <= 0.01
+
+
+def test_quaternion_sign_does_not_count_as_motion():
+    times = np.arange(5.0)
+    quats = np.repeat(np.array([[1.0, 0.0, 0.0, 0.0]]), 5, 0)
+    quats[2] *= -1
+    error = keyframe_reducer.quaternion_error
+    assert list(keyframe_reducer.decimate(times, quats, 1e-6, error)) == [0]
@@ -0,0 +1,62 @@
+import json
+from mixamo_baker import manifest
+
+
+def test_file_digest_reads_in_chunks(tmp_path):
+    path = tmp_path.joinpath("clip.fbx")
+    path.write_bytes(b"x" * 10)
+    digest = manifest.file_digest(path)
+    assert digest == manifest.file_digest(path, chunk_size=3)
+    path.write_bytes(b"x" * 9 + b"y")
+    assert manifest.file_digest(path) != digest
+
+
+def test_settings_digest_depends_on_everything_baked_with(tmp_path):
+    template = tmp_path.joinpath("template.blend")
+    template.write_bytes(b"template")
+    digest = manifest.settings_digest(
+        template, "wrist_r wrist_l", 0.01, {"use_x": True}
+    )
+    # the order of the constrained bones does not matter
+    assert digest == manifest.settings_digest(
+        template, "wrist_l  wrist_r", 0.01, {"use_x": True}
+    )
+    assert digest != manifest.settings_digest(
+        template, "wrist_r", 0.01, {"use_x": True}
+    )
+    assert digest != manifest.settings_digest(
+        template, "wrist_r wrist_l", 1.0, {"use_x": True}
+    )
+    assert digest != manifest.settings_digest(
+        template, "wrist_r wrist_l", 0.01, {"use_x": False}
+    )
+    template.write_bytes(b"changed")
+    assert digest != manifest.settings_digest(
+        template, "wrist_r wrist_l", 0.01, {"use_x": True}
+    )
+
+
+def test_record_save_load_and_up_to_date(tmp_path):
+    output = tmp_path.joinpath("Walk.fbx")
+    clips = manifest.load_manifest(tmp_path)
+    assert clips == {"version": manifest.manifest_version, "files": {}}
+    assert not manifest.is_up_to_date(clips, "Walk.fbx", "src", "set", output)
+
+    manifest.record(clips, "Walk.fbx", "src", "set", output)
+    manifest.save_manifest(tmp_path, clips)
+    loaded = manifest.load_manifest(tmp_path)
+    assert loaded == clips
+    # the output has to exist too
+    assert not manifest.is_up_to_date(loaded, "Walk.fbx", "src", "set", output)
+    output.write_bytes(b"baked")
+    assert manifest.is_up_to_date(loaded, "Walk.fbx", "src", "set", output)
+    assert not manifest.is_up_to_date(loaded, "Walk.fbx", "new", "set", output)
+    assert not manifest.is_up_to_date(loaded, "Walk.fbx", "src", "new", output)
+
+
+def test_unreadable_or_old_manifest_starts_empty(tmp_path):
+    path = tmp_path.joinpath(manifest.manifest_name)
+    path.write_text("{not json")
+    assert manifest.load_manifest(tmp_path)["files"] == {}
+    path.write_text(json.dumps({"version": -1, "files": {"a": {}}}))
+    assert manifest.load_manifest(tmp_path)["files"] == {}
@@ -0,0 +1,20 @@
+from mixamo_baker import retarget_profiles
+
+
+def test_strip_namespace():
+    assert retarget_profiles.strip_namespace("mixamorig:Hips") == "Hips"
+    assert retarget_profiles.strip_namespace("mixamorig_LeftArm") == "LeftArm"
+    assert retarget_profiles.strip_namespace("Hips") == "Hips"
+
+
+def test_strip_namespace_keeps_names_ending_in_a_separator():
+    assert retarget_profiles.strip_namespace("mixamorig:") == "mixamorig:"
+    assert retarget_profiles.strip_namespace("end_") == "end_"
+
+
+def test_unreal_profile_target_names():
+    profile = retarget_profiles.load_profile("unreal")
+    assert profile.target_name("mixamorig:Hips") == "pelvis"
+    assert profile.target_name("mixamorig:LeftArm") == "upperarm_l"
+    assert profile.target_name("Arm.R") == "upperarm_r"
+    assert profile.target_name("mixamorig:") is None
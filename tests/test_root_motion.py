@@ -0,0 +1,88 @@
+import numpy as np
+from mixamo_baker import root_motion
+
+
+def hips_matrices(locations, yaws):
+    quats = root_motion.euler_to_quaternion(
+        np.stack((np.zeros(len(yaws)), np.zeros(len(yaws)), yaws), axis=1)
+    )
+    return root_motion.compose_matrices(
+        np.asarray(locations, dtype=np.float64), quats, np.ones((len(yaws), 3))
+    )
+
+
+def extract(matrices, **options):
+    settings = dict(
+        base_location=(0.0, 0.0, 0.0),
+        base_euler=(0.0, 0.0, 0.0),
+        z_offset=1.0,
+        use_x=True,
+        use_y=True,
+        use_z=True,
+        use_rotation=True,
+        on_ground=True,
+    )
+    settings.update(options)
+    return root_motion.extract_root_motion(matrices, **settings)
+
+
+def test_root_follows_hips_on_the_ground():
+    locations = np.array([[0.0, 0.0, 1.0], [0.5, 1.0, 1.2], [1.0, 2.0, 0.8]])
+    root, eulers = extract(hips_matrices(locations, np.zeros(3)))
+    np.testing.assert_allclose(root[:, :2], locations[:, :2])
+    np.testing.assert_allclose(root[:, 2], [0.0, 0.2, 0.0], atol=1e-12)
+    np.testing.assert_allclose(eulers, 0.0)
+
+
+def test_disabled_axes_keep_the_base_location():
+    locations = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    root, eulers = extract(
+        hips_matrices(locations, np.zeros(2)),
+        base_location=(7.0, 8.0, 9.0),
+        use_x=False,
+        use_z=False,
+    )
+    np.testing.assert_allclose(root[:, 0], 7.0)
+    np.testing.assert_allclose(root[:, 1], locations[:, 1])
+    np.testing.assert_allclose(root[:, 2], 9.0)
+
+
+def test_height_is_added_without_on_ground():
+    locations = np.array([[0.0, 0.0, 1.5], [0.0, 0.0, 0.5]])
+    root, eulers = extract(
+        hips_matrices(locations, np.zeros(2)),
+        base_location=(0.0, 0.0, 1.0),
+        on_ground=False,
+    )
+    np.testing.assert_allclose(root[:, 2], [2.5, 1.5])
+
+
+def test_yaw_is_unwrapped():
+    yaws = np.linspace(0.0, 3 * np.pi, 31)
+    root, eulers = extract(hips_matrices(np.zeros((31, 3)), yaws))
+    np.testing.assert_allclose(eulers[:, 2], yaws, atol=1e-9)
+    np.testing.assert_allclose(eulers[:, :2], 0.0)
+
+
+def test_rotation_is_kept_without_use_rotation():
+    root, eulers = extract(
+        hips_matrices(np.zeros((3, 3)), np.array([0.1, 0.2, 0.3])),
+        base_euler=(0.0, 0.0, 1.0),
+        use_rotation=False,
+    )
+    np.testing.assert_allclose(eulers[:, 2], 1.0)
+
+
+def test_start_at_origin_moves_the_horizontal_start():
+    locations = np.array([[2.0, 3.0, 1.0], [3.0, 5.0, 1.0]])
+    root, eulers = extract(hips_matrices(locations, np.zeros(2)), start_at_origin=True)
+    np.testing.assert_allclose(root[:, :2], [[0.0, 0.0], [1.0, 2.0]])
+
+
+def test_smoothing_averages_and_keeps_ends():
+    locations = np.zeros((5, 3))
+    locations[:, 0] = [0.0, 0.0, 3.0, 0.0, 0.0]
+    locations[:, 2] = 1.0
+    root, eulers = extract(hips_matrices(locations, np.zeros(5)), smoothing=3)
+    np.testing.assert_allclose(root[:, 0], [0.0, 1.0, 1.0, 1.0, 0.0])
+    assert (root[:, 2] >= 0.0).all()
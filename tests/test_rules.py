@@ -0,0 +1,115 @@
+import json
+import pytest
+from mixamo_baker import manifest
+from mixamo_baker import rules
+
+
+def write_rules(path, rule_list):
+    path.write_text(json.dumps({"rules": rule_list}))
+    return path
+
+
+def test_rules_and_sidecar_apply_in_order(tmp_path):
+    rules_file = write_rules(
+        tmp_path.joinpath("rules.json"),
+        [
+            {"glob": "*_inplace.fbx", "settings": {"hips_to_root": False}},
+            {"glob": "locomotion/*", "settings": {"use_z": False}},
+            {"regex": "(?i)roll", "settings": {"use_rotation": False, "use_z": True}},
+        ],
+    )
+    src = tmp_path.joinpath("src")
+    src.joinpath("locomotion").mkdir(parents=True)
+    files = {
+        "Idle.fbx": src.joinpath("Idle.fbx"),
+        "locomotion/Walk_inplace.fbx": src.joinpath("locomotion", "Walk_inplace.fbx"),
+        "locomotion/Roll.fbx": src.joinpath("locomotion", "Roll.fbx"),
+    }
+    src.joinpath("locomotion", "Roll.json").write_text(
+        json.dumps({"bake_mode": "FK", "root_smoothing": 3})
+    )
+    overrides = rules.resolve_files(src, files, rules_file)
+    assert overrides["Idle.fbx"] == {}
+    assert overrides["locomotion/Walk_inplace.fbx"] == {
+        "hips_to_root": False,
+        "use_z": False,
+    }
+    assert overrides["locomotion/Roll.fbx"] == {
+        "use_z": True,
+        "use_rotation": False,
+        "bake_mode": "FK",
+        "root_smoothing": 3,
+    }
+
+    settings = rules.file_settings(
+        {"use_z": True, "bake_mode": "SINGLE_PASS"}, overrides
+    )
+    assert settings["Idle.fbx"] == {"use_z": True, "bake_mode": "SINGLE_PASS"}
+    assert settings["locomotion/Roll.fbx"]["bake_mode"] == "FK"
+
+
+def test_rules_file_in_input_dir_is_found(tmp_path):
+    write_rules(
+        tmp_path.joinpath(rules.rules_name),
+        [{"glob": "*.fbx", "settings": {"on_ground": False}}],
+    )
+    overrides = rules.resolve_files(tmp_path, {"a.fbx": tmp_path.joinpath("a.fbx")})
+    assert overrides == {"a.fbx": {"on_ground": False}}
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"unknown": True},
+        {"use_x": "false"},
+        {"bake_mode": "fk"},
+        {"root_smoothing": 1.5},
+        {"root_smoothing": True},
+        {"max_position_error": "1"},
+        {"profile": 1},
+    ],
+)
+def test_invalid_settings_are_rejected(tmp_path, settings):
+    path = write_rules(
+        tmp_path.joinpath("rules.json"), [{"glob": "*", "settings": settings}]
+    )
+    with pytest.raises(ValueError, match="rules.json"):
+        rules.load_rules(path)
+
+
+def test_invalid_sidecar_names_file_and_setting(tmp_path):
+    tmp_path.joinpath("Walk.json").write_text(json.dumps({"use_x": "false"}))
+    with pytest.raises(ValueError, match="Walk.json sets use_x"):
+        rules.file_overrides([], tmp_path.joinpath("Walk.fbx"), "Walk.fbx")
+
+
+def test_whole_numbers_are_valid_floats():
+    settings = {"max_position_error": 2, "location_tolerance": 0.5}
+    assert rules.check_settings(settings, "rules.json") == settings
+
+
+def test_settings_digests_follow_overrides(tmp_path):
+    template = tmp_path.joinpath("template.blend")
+    template.write_bytes(b"template")
+    overrides = {"a.fbx": {}, "b.fbx": {}, "c.fbx": {"use_x": False}}
+    digests = rules.settings_digests(
+        template, "wrist_r", 0.01, {"use_x": True}, overrides
+    )
+    assert digests["a.fbx"] == digests["b.fbx"]
+    assert digests["a.fbx"] == manifest.settings_digest(
+        template, "wrist_r", 0.01, {"use_x": True}
+    )
+    assert digests["c.fbx"] != digests["a.fbx"]
+
+
+def test_group_files_share_settings():
+    settings = {
+        "a": {"bake_mode": "SINGLE_PASS"},
+        "b": {"bake_mode": "SINGLE_PASS"},
+        "c": {"bake_mode": "SINGLE_PASS"},
+        "d": {"bake_mode": "SINGLE_PASS", "use_x": False},
+        "e": {"bake_mode": "FK"},
+        "f": {"bake_mode": "FK"},
+    }
+    groups = rules.group_files(list(settings), settings, 2)
+    assert groups == [["a", "b"], ["c"], ["d"], ["e"], ["f"]]
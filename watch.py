@@ -0,0 +1,277 @@
+"""Watch folder mode that bakes clips as they land in the input directory.
+
+Started from the command line with --watch:
+
+    blender -b --factory-startup --python path/to/mixamo_baker/cli.py -- \
+        --watch --in ~/mixamo --out ~/baked --template ~/skeleton.blend
+
+The session is set up once and keeps the skeleton template and the retarget
+profile loaded between files. The input directory is watched with inotify on
+Linux and polled elsewhere. A file is baked once its size and modification
+time have not changed for settle_time seconds, so clips that are still being
+copied are not picked up half written. Whether a settled file is new or
+changed is decided by the manifest of the output directory, the same way
+incremental batches do, so restarting the watcher only bakes what changed
+while it was down. The bake report holds the last report_rows baked files.
+"""
+
+from collections import deque
+from pathlib import Path
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+import traceback
+from . import duplicates
+from . import instrumentation
+from . import manifest
+from . import mixamo_baker
+from . import retarget_profiles
+from . import rules
+
+log = logging.getLogger(__name__)
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+
+# seconds between rescans when inotify reports nothing, in case events were lost
+idle_rescan = 30.0
+# files kept in the bake report, which is rewritten after every file
+report_rows = 1000
+
+
+class Inotify:
+    """wakes the watcher on file system events in the watched directories"""
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watched = set()
+
+    def watch(self, directory):
+        directory = str(directory)
+        if directory in self.watched:
+            return
+        if self._add_watch(self.fd, os.fsencode(directory), self.mask) < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+        self.watched.add(directory)
+
+    def wait(self, timeout):
+        """blocks until events arrive or timeout passes, the events are discarded"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        try:
+            while ready and os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """stands in for Inotify where it is not available"""
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def watch(self, directory):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+
+    def close(self):
+        pass
+
+
+def open_watcher(poll_interval):
+    if sys.platform.startswith("linux"):
+        try:
+            return Inotify()
+        except (OSError, AttributeError) as error:
+            log.warning("inotify is not available (%s), polling instead", error)
+    return Poller(poll_interval)
+
+
+def signature(file):
+    stat = file.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def settled_files(files, handled, pending, settle_time, now):
+    """returns the keys of files that changed since they were handled and have been still for settle_time
+
+    pending maps keys to their last signature and the time it was first seen,
+    it is updated in place.
+    """
+    settled = []
+    for key, file in files.items():
+        try:
+            current = signature(file)
+        except OSError:
+            # removed or renamed while scanning
+            pending.pop(key, None)
+            continue
+        if handled.get(key) == current:
+            pending.pop(key, None)
+            continue
+        seen = pending.get(key)
+        if seen is None or seen[0] != current:
+            pending[key] = (current, now)
+        elif now - seen[1] >= settle_time:
+            del pending[key]
+            settled.append(key)
+    return settled
+
+
+def watch_batch(
+    src_dir,
+    dst_dir,
+    templ_path,
+    cbones,
+    hips_to_root,
+    use_x,
+    use_y,
+    use_z,
+    use_rotation,
+    on_ground,
+    scale,
+    recursive=False,
+    settle_time=2.0,
+    poll_interval=1.0,
+    cprofile_file=None,
+    memory_limit_mb=0,
+    rules_file=None,
+    duplicate_mode="OFF",
+    **options
+):
+    """bakes new and changed files of src_dir until interrupted
+
+    Options are passed on to bake_file, overridden for single files by the
+    rules of rules_file and their sidecar files. The rules file is read once
+    when watching starts, sidecars whenever their file is baked. With
+    duplicate_mode, files identical to a baked one are copied or linked, see
+    duplicates.py. Returns the number of files converted once stopped with
+    Ctrl+C.
+    """
+    numfiles = 0
+    rows = deque(maxlen=report_rows)
+    handled = {}
+    pending = {}
+
+    mixamo_baker.setup_scene(scale)
+
+    settings = dict(
+        options,
+        hips_to_root=hips_to_root,
+        use_x=use_x,
+        use_y=use_y,
+        use_z=use_z,
+        use_rotation=use_rotation,
+        on_ground=on_ground,
+    )
+    clips = manifest.load_manifest(dst_dir)
+    file_rules = rules.find_rules(src_dir, rules_file)
+    duplicate_index = duplicates.open_index(dst_dir, duplicate_mode)
+    # settings digests by overrides, so the template is hashed once for each
+    settings_digests = {}
+    retarget_profiles.load_profile(settings.get("profile", "unreal"))
+    template = mixamo_baker.SkeletonTemplate(templ_path)
+    watcher = open_watcher(poll_interval)
+    print("Watching : {}".format(src_dir))
+
+    try:
+        while True:
+            watcher.watch(src_dir)
+            if recursive:
+                for directory in Path(src_dir).rglob("*"):
+                    if directory.is_dir() and not mixamo_baker.inside_output(
+                        directory, src_dir, dst_dir
+                    ):
+                        watcher.watch(directory)
+
+            files = {
+                mixamo_baker.relative_name(file, src_dir): file
+                for file in mixamo_baker.source_files(src_dir, recursive, dst_dir)
+            }
+            for key in settled_files(
+                files, handled, pending, settle_time, time.monotonic()
+            ):
+                file = files[key]
+                try:
+                    current = signature(file)
+                    source_digest = manifest.file_digest(file)
+                except OSError:
+                    # removed or renamed since it settled, it settles again if it is back
+                    continue
+                handled[key] = current
+                try:
+                    overrides = rules.file_overrides(file_rules, file, key)
+                except ValueError as error:
+                    print("Failed : {}\n{}".format(key, error))
+                    continue
+                file_settings = dict(settings, **overrides)
+                overrides_key = rules.settings_key(overrides)
+                if overrides_key not in settings_digests:
+                    settings_digests[overrides_key] = manifest.settings_digest(
+                        templ_path, cbones, scale, file_settings
+                    )
+                settings_digest = settings_digests[overrides_key]
+                output = mixamo_baker.output_path(
+                    file, dst_dir, src_dir, file_settings.get("output_format", "FBX")
+                )
+                if manifest.is_up_to_date(
+                    clips, key, source_digest, settings_digest, output
+                ):
+                    continue
+
+                try:
+                    converted, row = mixamo_baker.bake_file_recorded(
+                        file,
+                        dst_dir,
+                        template,
+                        cbones,
+                        cprofile_file,
+                        src_root=src_dir,
+                        duplicate_index=duplicate_index,
+                        settings_digest=settings_digest,
+                        **file_settings
+                    )
+                except Exception:
+                    traceback.print_exc()
+                    print("Failed : {}".format(key))
+                    mixamo_baker.wipe_scene(template)
+                    continue
+                rows.append(row)
+                if duplicate_index is not None:
+                    duplicate_index.save()
+                template = mixamo_baker.limit_memory(
+                    template, templ_path, memory_limit_mb, key
+                )
+                if not converted:
+                    continue
+                numfiles += 1
+                print("Baked : {}".format(key))
+                manifest.record(clips, key, source_digest, settings_digest, output)
+                manifest.save_manifest(dst_dir, clips)
+                instrumentation.write_report(dst_dir, rows)
+
+            watcher.wait(settle_time / 2 if pending else idle_rescan)
+    except KeyboardInterrupt:
+        print("Stopped watching, {} files converted".format(numfiles))
+    finally:
+        watcher.close()
+        template.free()
+    return numfiles
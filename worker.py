@@ -0,0 +1,132 @@
+"""Background worker for parallel batch baking.
+
+Run by the coordinator in parallel.py as
+
+    blender -b --factory-startup --python worker.py -- job.json
+
+The job file lists the source files of this worker's shard together with the
+bake settings and the overrides rules set for single files. Files with the
+same settings are baked clips_per_pass at a time. One JSON line is appended
+to the job's result file when a file is started and another once it is done,
+skipped or failed, so the coordinator can tell which file a crashed worker
+was working on. Clips the worker adds to the duplicate index are reported
+along with the file they were baked for.
+
+When the job sets memory_limit_mb and the worker's memory use grows above it,
+the worker exits with restart_exit_code after finishing the current file so
+the coordinator can continue the shard in a fresh session.
+"""
+
+from pathlib import Path
+import importlib
+import json
+import sys
+import traceback
+
+restart_exit_code = 75
+
+
+def load_addon():
+    """imports the add-on package this script belongs to"""
+    package_dir = Path(__file__).resolve().parent
+    sys.path.insert(0, str(package_dir.parent))
+    return importlib.import_module(package_dir.name + ".mixamo_baker")
+
+
+def run_job(job_path):
+    mixamo_baker = load_addon()
+    rules = mixamo_baker.rules
+    job = json.loads(Path(job_path).read_text())
+    overrides = job.get("overrides", {})
+    file_settings = rules.file_settings(
+        job["settings"], {file: overrides.get(file, {}) for file in job["files"]}
+    )
+
+    settings_digests = job.get("settings_digests", {})
+    duplicate_index = mixamo_baker.duplicates.open_index(
+        job["dst_dir"], job.get("duplicate_mode", "OFF")
+    )
+
+    mixamo_baker.setup_scene(job["scale"])
+    template = mixamo_baker.SkeletonTemplate(job["templ_path"])
+
+    with open(job["results"], "a") as results:
+
+        def record(file, status, error=None, stats=None):
+            entry = {"file": file, "status": status, "error": error, "stats": stats}
+            if duplicate_index is not None and status != "started":
+                # clips baked since the last record, for the coordinator's index
+                entry["clips"] = duplicate_index.pop_added()
+            results.write(json.dumps(entry))
+            results.write("\n")
+            results.flush()
+
+        for group in rules.group_files(
+            job["files"], file_settings, job.get("clips_per_pass", 1)
+        ):
+            for file in group:
+                record(file, "started")
+
+            converted = {}
+            stats = {}
+            if len(group) > 1:
+                try:
+                    baked, row = mixamo_baker.bake_files_recorded(
+                        group,
+                        job["dst_dir"],
+                        template,
+                        job["cbones"],
+                        src_root=job.get("src_root"),
+                        duplicate_index=duplicate_index,
+                        settings_digest=settings_digests.get(group[0]),
+                        **file_settings[group[0]]
+                    )
+                except Exception:
+                    # bake the files one by one below
+                    traceback.print_exc()
+                    mixamo_baker.object_mode()
+                else:
+                    converted = {
+                        file: baked[Path(file)] for file in group if Path(file) in baked
+                    }
+                    # the report row covers the whole group, keep it once
+                    stats = {group[0]: row}
+
+            for file in group:
+                if file in converted:
+                    record(
+                        file,
+                        "done" if converted[file] else "skipped",
+                        stats=stats.get(file),
+                    )
+                    continue
+                try:
+                    baked, row = mixamo_baker.bake_file_recorded(
+                        file,
+                        job["dst_dir"],
+                        template,
+                        job["cbones"],
+                        job.get("cprofile_file"),
+                        src_root=job.get("src_root"),
+                        duplicate_index=duplicate_index,
+                        settings_digest=settings_digests.get(file),
+                        **file_settings[file]
+                    )
+                except Exception:
+                    traceback.print_exc()
+                    record(file, "failed", traceback.format_exc())
+                    mixamo_baker.object_mode()
+                    continue
+                record(file, "done" if baked else "skipped", stats=row)
+
+            memory_limit_mb = job.get("memory_limit_mb")
+            rss = mixamo_baker.instrumentation.current_rss() / (1 << 20)
+            if memory_limit_mb and rss > memory_limit_mb:
+                print("Memory : {:.0f} MB, restarting worker".format(rss))
+                return restart_exit_code
+    return 0
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    sys.exit(run_job(argv[0]))